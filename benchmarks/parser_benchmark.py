@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Compare nrfcredstore.parser with the split based parsing it replaced.
+# Run with: PYTHONPATH=src python benchmarks/parser_benchmark.py
+
+import timeit
+
+from nrfcredstore.credstore import Credential, parse_credentials
+from nrfcredstore.parser import last_line, parse_cmng
+
+CMNG_LINE = '%CMNG: {},{},"2C43952EE9E000FF2ACC4E2ED0897C0A72AD5FA72C3D934E81741CBD54F05BD1"\r\n'
+CMNG_OUTPUT = ''.join(CMNG_LINE.format(tag, cred_type) for tag in range(100) for cred_type in range(5))
+CGMR_OUTPUT = 'uart:~$ at AT+CGMR\r\n' * 20 + 'mfw_nrf91x1_2.0.2\r\n'
+
+def split_cmng(output):
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    columns = [line.replace('%CMNG: ', '').replace('"', '').split(',') for line in lines]
+    return [(int(c[0]), int(c[1]), c[2].strip()) for c in columns]
+
+def split_credentials(output):
+    return [Credential(*c) for c in split_cmng(output)]
+
+def split_last_line(output):
+    return [x.strip() for x in output.split("\n") if x.strip()][-1]
+
+def bench(name, func, arg, number):
+    seconds = min(timeit.repeat(lambda: func(arg), number=number, repeat=5))
+    print(f'{name:<20} {seconds / number * 1e6:10.1f} us')
+
+def main():
+    print(f'AT%CMNG=1, {CMNG_OUTPUT.count(chr(10))} credentials')
+    bench('split', split_cmng, CMNG_OUTPUT, 200)
+    bench('parser', parse_cmng, CMNG_OUTPUT, 200)
+    print('CredStore.list parsing')
+    bench('split', split_credentials, CMNG_OUTPUT, 200)
+    bench('parser', parse_credentials, CMNG_OUTPUT, 200)
+    print('last line')
+    bench('split', split_last_line, CGMR_OUTPUT, 20000)
+    bench('parser', last_line, CGMR_OUTPUT, 20000)
+
+if __name__ == '__main__':
+    main()
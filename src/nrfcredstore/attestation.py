@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Attestation token harvesting and offline decoding.
+# %ATTESTTOKEN returns "body.cose". body is the base64url encoded CBOR array
+# [msg_type, device UUID, device type, firmware UUID], and cose is a COSE_Sign1 structure
+# signing it. Harvested tokens are appended to a file with one JSON record per line.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from typing import IO, Iterator, NamedTuple, Optional, Union
+
+from nrfcredstore import cbor
+from nrfcredstore.csr import b64url_decode
+from nrfcredstore.output import OUTPUT_FORMATS, OUTPUT_TABLE, create_writer
+from nrfcredstore.parser import parse_attesttoken
+
+logger = logging.getLogger(__name__)
+
+# Tag 55799 marks self-described CBOR, tag 18 a COSE_Sign1 structure
+CBOR_SELF_DESCRIBE_TAG = 55799
+COSE_SIGN1_TAG = 18
+COSE_HEADER_ALG = 1
+COSE_HEADER_KID = 4
+
+class AttestationToken(NamedTuple):
+    msg_type: int
+    device_uuid: str
+    device_type: int
+    firmware_uuid: str
+    alg: Optional[int] = None
+    kid: Optional[str] = None
+
+def _untag(value, tag: int):
+    if isinstance(value, cbor.CBORTag) and value.tag == tag:
+        return value.value
+    return value
+
+def decode_token(token: str) -> AttestationToken:
+    """Decode an attestation token, either "body.cose" or a whole %ATTESTTOKEN line
+
+    Raises ValueError if the token is malformed. The signature is not verified.
+    """
+    if '%ATTESTTOKEN' in token:
+        parsed = parse_attesttoken(token)
+        if parsed is None:
+            raise ValueError('No attestation token found')
+        token = parsed.blob
+    body, _, cose = token.strip().strip('"').partition('.')
+    claims = _untag(cbor.loads(b64url_decode(body)), CBOR_SELF_DESCRIBE_TAG)
+    if not isinstance(claims, list) or len(claims) < 4:
+        raise ValueError('Attestation token body is not a claims array')
+    msg_type, device_uuid, device_type, firmware_uuid = claims[:4]
+    if not isinstance(device_uuid, bytes) or not isinstance(firmware_uuid, bytes):
+        raise ValueError('Attestation token UUIDs are not byte strings')
+    alg, kid = None, None
+    if cose:
+        sign1 = _untag(cbor.loads(b64url_decode(cose)), COSE_SIGN1_TAG)
+        if not isinstance(sign1, list) or len(sign1) != 4:
+            raise ValueError('Attestation token signature is not a COSE_Sign1 structure')
+        protected = cbor.loads(sign1[0]) if sign1[0] else {}
+        unprotected = sign1[1] or {}
+        if not isinstance(protected, dict) or not isinstance(unprotected, dict):
+            raise ValueError('Attestation token COSE headers are not maps')
+        alg = protected.get(COSE_HEADER_ALG, unprotected.get(COSE_HEADER_ALG))
+        kid = protected.get(COSE_HEADER_KID, unprotected.get(COSE_HEADER_KID))
+        kid = kid.hex() if isinstance(kid, bytes) else kid
+    return AttestationToken(msg_type, str(uuid.UUID(bytes=device_uuid)), device_type,
+                            str(uuid.UUID(bytes=firmware_uuid)), alg, kid)
+
+def token_record(device_id: Union[str, int, None], token: str) -> dict:
+    """Record of a token with its decoded fields, or the reason it could not be decoded"""
+    record = {'device': None if device_id is None else str(device_id), 'attestation_token': token}
+    try:
+        record.update(decode_token(token)._asdict())
+    except ValueError as e:
+        record['error'] = str(e)
+    return record
+
+def harvest_token(path: str, device_id: Union[str, int], token: str) -> dict:
+    """Append a token with its decoded fields to a harvest file and return the record"""
+    record = {'time': round(time.time()), **token_record(device_id, token)}
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    # A single O_APPEND write keeps lines intact when fleet workers share the file
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+    return record
+
+def iter_tokens(stream: IO[str]) -> Iterator[dict]:
+    """Decode the tokens of a harvest file, or of a file with one token per line"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            try:
+                record = json.loads(line)
+                token = record['attestation_token']
+                if not isinstance(token, str):
+                    raise TypeError('Token is not a string')
+            except (ValueError, KeyError, TypeError):
+                # A torn last line is expected if a worker was killed during an append
+                logger.debug(f'Ignoring corrupt harvest line: {line!r}')
+                continue
+            yield token_record(record.get('device'), token)
+        else:
+            yield token_record(None, line)
+
+def parse_args(in_args):
+    parser = argparse.ArgumentParser(description='Decode attestation tokens offline.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('files', nargs='+',
+        help='Files written by "attoken --harvest", or with one token per line. Use "-" for stdin.')
+    parser.add_argument('--output', dest='output_format', choices=OUTPUT_FORMATS, default=OUTPUT_TABLE,
+        help='Output format')
+    return parser.parse_args(in_args)
+
+def main(argv=sys.argv[1:]) -> int:
+    args = parse_args(argv)
+    failed = 0
+    table_format = "{:<20} {:<36} {:<36} {:<6}"
+    fields = ['device', 'attestation_token', *AttestationToken._fields, 'error']
+    writer = create_writer(args.output_format, fields=fields) if args.output_format != OUTPUT_TABLE else None
+    if not writer:
+        print(table_format.format('Device', 'Device UUID', 'Firmware UUID', 'Type'))
+    for path in args.files:
+        stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        try:
+            for record in iter_tokens(stream):
+                failed += 'error' in record
+                if writer:
+                    writer.write(record)
+                elif 'error' in record:
+                    print(table_format.format(record['device'] or '', f'error: {record["error"]}', '', ''))
+                else:
+                    print(table_format.format(record['device'] or '', record['device_uuid'],
+                                              record['firmware_uuid'], record['device_type']))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    if writer:
+        writer.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Baud rate negotiation for serial devices.
+# Candidate rates are probed with an AT handshake after reopening the port, and the fastest
+# working rate is remembered per device serial number so later runs only need one handshake.
+
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from nrfcredstore.command_interface import PROBE_DRAIN_TIMEOUT, shell_pattern
+from nrfcredstore.comms import Comms
+
+logger = logging.getLogger(__name__)
+
+BAUDRATE_CANDIDATES = [1000000, 921600, 460800, 230400, 115200]
+BAUDRATE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'nrfcredstore', 'baudrates.jsonl')
+
+# AT+CLAC lists all supported commands. The answer is long enough to estimate throughput.
+# Both the raw AT and the AT shell variant are sent, the one the device does not know fails.
+HANDSHAKE_COMMANDS = ['AT+CLAC', 'at AT+CLAC']
+HANDSHAKE_TIMEOUT = 1
+
+class BaudrateCache:
+    def __init__(self, path: str = BAUDRATE_CACHE_PATH):
+        """Best known baud rate per device serial number, stored as one JSON line per update
+
+        Later lines replace earlier ones for the same device.
+        """
+        self.path = path
+        self.rates: Dict[str, int] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.rates[str(record['serial'])] = int(record['baudrate'])
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line is expected if a run was interrupted during an append
+                        logger.debug(f'Ignoring corrupt baud rate cache line: {line!r}')
+        except FileNotFoundError:
+            pass
+
+    def get(self, serial_number) -> Optional[int]:
+        return self.rates.get(str(serial_number))
+
+    def set(self, serial_number, baudrate: int):
+        self.rates[str(serial_number)] = baudrate
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps({'serial': str(serial_number), 'baudrate': baudrate}) + '\n'
+        # A single O_APPEND write keeps lines intact when fleet workers share the file
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+def handshake(comms: Comms) -> Tuple[bool, float]:
+    """Run the AT handshake at the current baud rate
+
+    Returns whether the device answered, and the measured throughput in bytes per second.
+    """
+    with comms.transaction():
+        comms.reset_input_buffer()
+        start = time.perf_counter()
+        for command in HANDSHAKE_COMMANDS:
+            comms.write_line(command)
+        result, output = comms.expect_response("OK", "ERROR", "", suppress_errors=True, timeout=HANDSHAKE_TIMEOUT)
+        elapsed = time.perf_counter() - start
+        if result and not shell_pattern.search(output):
+            # A raw AT client still has to reject the shell variant, before the next rate is tried
+            comms.expect_response("OK", "ERROR", suppress_errors=True, timeout=PROBE_DRAIN_TIMEOUT)
+    if not result or 'AT+' not in output:
+        return False, 0.0
+    return True, len(output) / elapsed if elapsed else 0.0
+
+def _try_baudrate(comms: Comms, baudrate: int) -> Tuple[bool, float]:
+    try:
+        comms.reopen(baudrate)
+        ok, throughput = handshake(comms)
+    except (OSError, ValueError) as e:
+        # The serial driver rejects rates the adapter does not support
+        logger.debug(f'{baudrate} baud: {e}')
+        return False, 0.0
+    if ok:
+        logger.debug(f'{baudrate} baud: {throughput:.0f} B/s')
+    else:
+        logger.debug(f'{baudrate} baud: no handshake')
+    return ok, throughput
+
+def negotiate_baudrate(comms: Comms, candidates: Iterable[int] = BAUDRATE_CANDIDATES,
+                       cache: Optional[BaudrateCache] = None) -> int:
+    """Switch the serial port to the fastest baud rate the device answers at
+
+    A rate cached for the device is tried first. Otherwise all candidates are probed and the
+    one with the highest throughput is kept. If no rate works, the original one is restored.
+
+    Returns the baud rate in use.
+    """
+    original = comms.baudrate
+    cached = cache.get(comms.serial_number) if cache else None
+    if cached:
+        ok, _ = _try_baudrate(comms, cached)
+        if ok:
+            logger.debug(f'Using cached baud rate {cached}')
+            return cached
+        logger.debug(f'Cached baud rate {cached} failed, probing')
+
+    best, best_throughput = None, 0.0
+    for baudrate in candidates:
+        ok, throughput = _try_baudrate(comms, baudrate)
+        if ok and (best is None or throughput > best_throughput):
+            best, best_throughput = baudrate, throughput
+
+    if best is None:
+        logger.warning(f'Baud rate negotiation failed, using {original}')
+        comms.reopen(original)
+        return original
+    if comms.baudrate != best:
+        comms.reopen(best)
+    if cache:
+        cache.set(comms.serial_number, best)
+    logger.info(f'Using baud rate {best}')
+    return best
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Minimal CBOR (RFC 8949) decoder for the COSE structures returned by the modem.
+# Covers definite and indefinite length items, tags and floats. Decoding only, no dependencies.
+
+import struct
+from typing import Any, NamedTuple, Tuple
+
+class CBORTag(NamedTuple):
+    tag: int
+    value: Any
+
+class CBORDecodeError(ValueError):
+    pass
+
+_BREAK = object()
+_SIMPLE = {20: False, 21: True, 22: None, 23: None}
+
+def _read_length(data: bytes, pos: int, info: int) -> Tuple[int, int]:
+    if info < 24:
+        return info, pos
+    if info == 24:
+        return data[pos], pos + 1
+    if info == 25:
+        return int.from_bytes(data[pos:pos + 2], 'big'), pos + 2
+    if info == 26:
+        return int.from_bytes(data[pos:pos + 4], 'big'), pos + 4
+    if info == 27:
+        return int.from_bytes(data[pos:pos + 8], 'big'), pos + 8
+    raise CBORDecodeError(f'Invalid additional information {info} at offset {pos - 1}')
+
+def _decode_chunks(data: bytes, pos: int, major: int) -> Tuple[bytes, int]:
+    # Indefinite length byte or text string, made of definite length chunks of the same type
+    chunks = []
+    while data[pos] != 0xff:
+        if data[pos] >> 5 != major:
+            raise CBORDecodeError(f'Invalid chunk at offset {pos}')
+        length, pos = _read_length(data, pos + 1, data[pos] & 0x1f)
+        chunks.append(data[pos:pos + length])
+        pos += length
+    return b''.join(chunks), pos + 1
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1f
+    pos += 1
+    if major == 7:
+        if info == 31:
+            return _BREAK, pos
+        if info == 25:
+            return struct.unpack('>e', data[pos:pos + 2])[0], pos + 2
+        if info == 26:
+            return struct.unpack('>f', data[pos:pos + 4])[0], pos + 4
+        if info == 27:
+            return struct.unpack('>d', data[pos:pos + 8])[0], pos + 8
+        value, pos = _read_length(data, pos, info)
+        return _SIMPLE.get(value, value), pos
+    if info == 31:
+        if major in (2, 3):
+            value, pos = _decode_chunks(data, pos, major)
+            return (value.decode('utf-8') if major == 3 else value), pos
+        if major == 4:
+            items = []
+            while True:
+                item, pos = _decode(data, pos)
+                if item is _BREAK:
+                    return items, pos
+                items.append(item)
+        if major == 5:
+            result = {}
+            while True:
+                key, pos = _decode(data, pos)
+                if key is _BREAK:
+                    return result, pos
+                result[key], pos = _decode(data, pos)
+        raise CBORDecodeError(f'Invalid indefinite length at offset {pos - 1}')
+    value, pos = _read_length(data, pos, info)
+    if major == 0:
+        return value, pos
+    if major == 1:
+        return -1 - value, pos
+    if major == 2:
+        return bytes(data[pos:pos + value]), pos + value
+    if major == 3:
+        return bytes(data[pos:pos + value]).decode('utf-8'), pos + value
+    if major == 4:
+        items = []
+        for _ in range(value):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos
+    if major == 5:
+        result = {}
+        for _ in range(value):
+            key, pos = _decode(data, pos)
+            result[key], pos = _decode(data, pos)
+        return result, pos
+    item, pos = _decode(data, pos)
+    return CBORTag(value, item), pos
+
+def loads(data: bytes) -> Any:
+    """Decode one CBOR item. Byte strings are returned as bytes, tags as CBORTag."""
+    try:
+        value, pos = _decode(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError) as e:
+        # TypeError: a map key that can not be hashed, like an array
+        raise CBORDecodeError(f'Truncated or invalid CBOR: {e}') from e
+    if value is _BREAK:
+        raise CBORDecodeError('Unexpected break')
+    if pos > len(data):
+        raise CBORDecodeError('Truncated CBOR')
+    if pos != len(data):
+        raise CBORDecodeError(f'{len(data) - pos} bytes after the CBOR item')
+    return value
@@ -1,34 +1,103 @@
 import argparse
+import os
+import re
+import shlex
 import sys
 import serial
 import logging
+import time
 
+from nrfcredstore.baudrate import BAUDRATE_CACHE_PATH, BaudrateCache, negotiate_baudrate
 from nrfcredstore.exceptions import ATCommandError, NoATClientException
 from nrfcredstore.command_interface import ATCommandInterface
-from nrfcredstore.credstore import CredStore, CredType
-from nrfcredstore.comms import Comms
+from nrfcredstore.attestation import harvest_token
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.retry import DEFAULT_RETRIES, retry_policies
+from nrfcredstore.credstore import CredStore, CredType, DEFAULT_TAG_RANGE, WriteResult
+from nrfcredstore.comms import Comms, CMD_TYPE_TLS_SHELL, SERIAL_READY_TIMEOUT
+from nrfcredstore.csr import CSR_FORMATS, FORMAT_DER, FORMAT_PEM, CSRWriter
+from nrfcredstore.fleet import FLEET_DEVS, FLEET_DEV_RTT, device_timeout_for, fleet_devices, run_fleet
+from nrfcredstore.profiling import phase, profile_run, timer
+from nrfcredstore.station import STATION_DEV, run_station
+from nrfcredstore.journal import ProvisioningJournal
+from nrfcredstore.output import OUTPUT_FORMATS, OUTPUT_TABLE, create_writer
 
 FUN_MODE_OFFLINE = 4
 KEY_TYPES_OR_ANY = list(map(lambda type: type.name, CredType))
 KEY_TYPES = KEY_TYPES_OR_ANY.copy()
 KEY_TYPES.remove('ANY')
 
+# Fields of the --output records per subcommand, in order. Not every record has all of them.
+RECORD_FIELDS = {
+    'list': ['device', 'tag', 'type', 'type_value', 'sha'],
+    'write': ['device', 'tag', 'type', 'result'],
+    'delete': ['device', 'tag', 'type', 'deleted'],
+    'deleteall': ['device', 'tag', 'type', 'deleted'],
+    'generate': ['device', 'tag', FORMAT_DER, FORMAT_PEM, 'cose'],
+    'generatemany': ['device', 'tag', FORMAT_DER, FORMAT_PEM, 'cose'],
+    'inventory': ['device', 'credentials', 'file'],
+    'imei': ['device', 'imei'],
+    'attoken': ['device', 'attestation_token'],
+}
+
 ERR_UNKNOWN = 1
 ERR_NO_AT_CLIENT = 10
 ERR_AT_COMMAND = 11
 ERR_TIMEOUT = 12
 ERR_SERIAL = 13
 
+NEXT_TAG = 'next'
+
+def tag_or_next(value: str):
+    return value if value == NEXT_TAG else int(value)
+
+def tag_range(value: str):
+    """Parse "FIRST-LAST" into an inclusive (first, last) tuple"""
+    first, sep, last = value.partition('-')
+    try:
+        first, last = int(first), int(last)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected FIRST-LAST, got {value!r}')
+    if not sep or not DEFAULT_TAG_RANGE[0] <= first <= last <= DEFAULT_TAG_RANGE[1]:
+        raise argparse.ArgumentTypeError(f'Invalid tag range {value!r}')
+    return (first, last)
+
 def parse_args(in_args):
     parser = argparse.ArgumentParser(description='Manage certificates stored in a cellular modem.')
-    parser.add_argument('dev', help='Device used to communicate with the modem. For interactive selection of serial port, use "auto". For RTT, use "rtt". If given a SEGGER serial number, it is assumed to be an RTT device.')
+    parser.add_argument('dev', help='Device used to communicate with the modem. For interactive selection of serial port, use "auto". For RTT, use "rtt". If given a SEGGER serial number, it is assumed to be an RTT device. To run on all connected Nordic boards in parallel, use "all", or "all-rtt" for all J-Link devices. To run on every Nordic board as it is plugged in, use "station".')
     parser.add_argument('--baudrate', type=int, default=115200, help='Serial baudrate')
     parser.add_argument('--timeout', type=int, default=3,
         help='Serial communication timeout in seconds')
+    parser.add_argument('--job-timeout', type=float,
+        help='Time budget in seconds for the whole command on a device. Every wait is limited to the time left, so a dead device fails within this time.')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+        help='Number of retries for AT commands that fail with a transient error, like no response or "not allowed in active state". A command that never answers then takes up to (RETRIES + 1) times --timeout, plus up to 2 s backoff per retry. --job-timeout caps the total.')
+    parser.add_argument('--ready-timeout', type=float, default=SERIAL_READY_TIMEOUT,
+        help='Longest time in seconds to wait for a serial device to answer after opening the port')
+    parser.add_argument('--negotiate-baudrate', action='store_true',
+        help='Probe higher baud rates and use the fastest one the serial device answers at. The result is remembered per device.')
+    parser.add_argument('--baudrate-cache', type=str, default=BAUDRATE_CACHE_PATH,
+        help='File that stores the negotiated baud rate per device')
+    parser.add_argument('--profile', type=str,
+        help='Profile the run with cProfile. Statistics are written to this file, and a report sorted by cumulative time with the time spent per phase to the same name with .txt appended.')
+    parser.add_argument('--trace', type=str,
+        help='Write the recent traffic with the device to this file when a command fails or times out. With "all" or "station", the trace of each device is written next to its log file.')
     parser.add_argument('--debug', action='store_true',
         help='Enable debug logging')
     parser.add_argument('--cmd-type', choices=['at', 'shell', 'auto'], default='auto',
         help='Command type to use. "at" for AT commands, "shell" for shell commands, "auto" to detect automatically.')
+    parser.add_argument('--output', dest='output_format', choices=OUTPUT_FORMATS, default=OUTPUT_TABLE,
+        help='Output format. "json", "ndjson" and "csv" emit one record per result, including the device serial number.')
+    parser.add_argument('--fleet-jobs', type=int,
+        help='Number of devices processed in parallel with "all", "all-rtt" or "station". Defaults to all devices.')
+    parser.add_argument('--fleet-log-dir', type=str, default='nrfcredstore-logs',
+        help='Directory for per-device log files with "all", "all-rtt" or "station"')
+    parser.add_argument('--fleet-report', type=str,
+        help='Write a JSON report of the fleet run to this file')
+    parser.add_argument('--fleet-timeout', type=float,
+        help='Seconds before a device is considered hung and its worker process is killed. Defaults to --job-timeout plus 30 s, or 600 s without --job-timeout.')
+    parser.add_argument('--journal', type=str,
+        help='Journal file used to resume interrupted provisioning. Confirmed steps are skipped on rerun.')
 
     subparsers = parser.add_subparsers(
         title='subcommands', dest='subcommand', help='Certificate related commands'
@@ -43,14 +112,18 @@ def parse_args(in_args):
 
     # Add write command
     write_parser = subparsers.add_parser('write', help='Write key/cert to a secure tag')
-    write_parser.add_argument('tag', type=int,
-        help='Secure tag to write key to')
+    write_parser.add_argument('tag', type=tag_or_next,
+        help='Secure tag to write key to, or "next" for the lowest free tag in --tag-range')
     write_parser.add_argument('type',
         choices=['ROOT_CA_CERT','CLIENT_CERT','CLIENT_KEY', 'PSK'],
         help='Key type to write')
     write_parser.add_argument('file',
         type=argparse.FileType('r', encoding='UTF-8'),
         help='PEM file to read from')
+    write_parser.add_argument('--verify', action='store_true',
+        help='Read back the SHA of the written credential and compare it with the file')
+    write_parser.add_argument('--tag-range', type=tag_range, default=DEFAULT_TAG_RANGE, metavar='FIRST-LAST',
+        help='Range of secure tags to pick from with "next"')
 
     # Add delete command
     delete_parser = subparsers.add_parser('delete', help='Delete value from a secure tag')
@@ -64,28 +137,83 @@ def parse_args(in_args):
     imei_parser = subparsers.add_parser('imei', help='Get IMEI from the modem')
 
     attoken_parser = subparsers.add_parser('attoken', help='Get attestation token of the modem')
+    attoken_parser.add_argument('--harvest', type=str, metavar='FILE',
+        help='Append the token and its decoded device and firmware UUIDs to this file. The same file can be shared by many devices, decode it with "python -m nrfcredstore.attestation".')
+
+    inventory_parser = subparsers.add_parser('inventory', help='Append a snapshot of all stored credentials to a file')
+    inventory_parser.add_argument('file', type=str,
+        help='Snapshot file. The same file can be shared by many devices, compare them with "python -m nrfcredstore.inventory".')
+
+    shell_parser = subparsers.add_parser('shell', help='Interactive session with the subcommands above and raw AT commands')
 
     # Add generate command and args
     generate_parser = subparsers.add_parser('generate', help='Generate private key')
     generate_parser.add_argument('tag', type=int,
         help='Secure tag to store generated key')
     generate_parser.add_argument('file', type=argparse.FileType('wb'),
-        help='File to store CSR in DER format')
+        help='File to store CSR in')
     generate_parser.add_argument('--attributes', type=str, default='',
         help='Comma-separated list of attribute ID and value pairs for the CSR response')
+    generate_parser.add_argument('--format', dest='csr_format', choices=CSR_FORMATS, default=FORMAT_DER,
+        help='CSR file format')
 
-    return parser.parse_args(in_args)
+    # Add generatemany command and args
+    generatemany_parser = subparsers.add_parser('generatemany', help='Generate private keys for several secure tags')
+    generatemany_parser.add_argument('output', type=str,
+        help='Directory, or .zip archive, to store CSRs in. An index of device, tag and files is updated.')
+    generatemany_parser.add_argument('tags', type=int, nargs='+',
+        help='Secure tags to store generated keys')
+    generatemany_parser.add_argument('--attributes', type=str, default='',
+        help='Comma-separated list of attribute ID and value pairs for the CSR response')
+    generatemany_parser.add_argument('--format', dest='csr_format', choices=CSR_FORMATS + ['both'], default=FORMAT_DER,
+        help='CSR file format. The COSE signature of each CSR is always stored next to it.')
+
+    args = parser.parse_args(in_args)
+    # An archive is rewritten as a whole, parallel workers would overwrite each other
+    if (args.subcommand == 'generatemany' and args.output.endswith('.zip')
+            and args.dev in FLEET_DEVS + [STATION_DEV]):
+        parser.error(f'generatemany can not write a .zip archive with "{args.dev}", use a directory')
+    return args
 
 def exec_cmd(args, credstore):
     if args.subcommand:
-        if not credstore.func_mode(FUN_MODE_OFFLINE):
-            raise RuntimeError("Failed to set modem to offline mode.")
+        with phase('cfun'):
+            if not credstore.func_mode(FUN_MODE_OFFLINE):
+                raise RuntimeError("Failed to set modem to offline mode.")
+
+    with phase('operation'):
+        if args.subcommand == 'shell':
+            run_shell(args, credstore)
+        else:
+            exec_with_writer(args, credstore)
 
+def exec_with_writer(args, credstore):
+    # Fleet workers send their records to the parent process instead of writing them
+    writer = getattr(args, 'record_writer', None)
+    if writer is None and args.output_format != OUTPUT_TABLE:
+        writer = create_writer(args.output_format, fields=RECORD_FIELDS.get(args.subcommand))
+    try:
+        exec_subcommand(args, credstore, writer)
+    finally:
+        if writer:
+            writer.close()
+        # Files opened by argparse
+        file = getattr(args, 'file', None)
+        if hasattr(file, 'close'):
+            file.close()
+
+def exec_subcommand(args, credstore, writer):
     if args.subcommand == 'list':
         ct = CredType[args.type]
         if ct != CredType.ANY and args.tag is None:
             raise RuntimeError("Cannot use --type without a --tag.")
         creds = credstore.list(args.tag, ct)
+        if writer:
+            serial = device_serial(credstore)
+            for c in creds:
+                writer.write({'device': serial, 'tag': c.tag, 'type': c.type.name,
+                              'type_value': c.type.value, 'sha': c.sha})
+            return
         table_format = "{:<12} {:<18} {:<64}"
         print(table_format.format('Secure tag','Key type','SHA'))
         for c in creds:
@@ -97,68 +225,296 @@ def exec_cmd(args, credstore):
             print(table_format.format(*columns))
     elif args.subcommand=='write':
         ct = CredType[args.type]
-        credstore.write(args.tag, ct, args.file)
+        if args.tag == NEXT_TAG:
+            args.tag = credstore.allocate_tags(1, args.tag_range)[0]
+            if not writer:
+                print(f'Using free secure tag {args.tag}')
+        if args.verify:
+            result = credstore.write(args.tag, ct, args.file, verify=True)
+            if writer:
+                writer.write({'device': device_serial(credstore), 'tag': args.tag, 'type': ct.name,
+                              'result': result.value})
+            if result == WriteResult.MISMATCH:
+                raise RuntimeError(f'{ct.name} in secure tag {args.tag} does not match {args.file.name}')
+            if not writer:
+                print(f'{ct.name} in secure tag {args.tag} written and verified')
+        else:
+            credstore.write(args.tag, ct, args.file)
+            if writer:
+                writer.write({'device': device_serial(credstore), 'tag': args.tag, 'type': ct.name,
+                              'result': WriteResult.WRITTEN.value})
     elif args.subcommand=='delete':
         ct = CredType[args.type]
         if credstore.delete(args.tag, ct):
-            print(f'{ct.name} in secure tag {args.tag} deleted')
+            if writer:
+                writer.write({'device': device_serial(credstore), 'tag': args.tag, 'type': ct.name,
+                              'deleted': True})
+            else:
+                print(f'{ct.name} in secure tag {args.tag} deleted')
     elif args.subcommand=='deleteall':
         creds = credstore.list(None, CredType.ANY)
         if not creds:
             raise RuntimeError(f'No keys found in secure tag {args.tag}')
-        for c in creds:
-            if c.tag in [4294967292, 4294967293, 4294967294]:
-                continue  # Skip reserved tags
-            credstore.delete(c.tag, c.type)
-        print(f'All credentials deleted.')
+        results = credstore.delete_many(creds)
+        if writer:
+            serial = device_serial(credstore)
+            for c, deleted in results:
+                writer.write({'device': serial, 'tag': c.tag, 'type': c.type.name, 'deleted': deleted})
+        failed = [c for c, deleted in results if not deleted]
+        if not writer:
+            for c in failed:
+                print(f'Failed to delete {c.type.name} in secure tag {c.tag}')
+        if failed:
+            raise RuntimeError(f'Failed to delete {len(failed)} credentials.')
+        if not writer:
+            print(f'All credentials deleted.')
     elif args.subcommand=='generate':
-        credstore.keygen(args.tag, args.file, args.attributes)
-        print(f'New private key generated in secure tag {args.tag}')
-        print(f'Wrote CSR in DER format to {args.file.name}')
+        cose = credstore.keygen(args.tag, args.file, args.attributes, args.csr_format)
+        # The COSE signature goes next to the CSR, as <tag>.cose does with generatemany
+        cose_path = os.path.splitext(args.file.name)[0] + '.cose' if cose else ''
+        if cose_path:
+            with open(cose_path, 'wb') as f:
+                f.write(cose)
+        if writer:
+            writer.write({'device': device_serial(credstore), 'tag': args.tag, args.csr_format: args.file.name,
+                          'cose': cose_path})
+        else:
+            print(f'New private key generated in secure tag {args.tag}')
+            print(f'Wrote CSR in {args.csr_format.upper()} format to {args.file.name}')
+            if cose_path:
+                print(f'Wrote COSE signature to {cose_path}')
+    elif args.subcommand=='generatemany':
+        formats = CSR_FORMATS if args.csr_format == 'both' else [args.csr_format]
+        with CSRWriter(args.output, formats) as csr_writer:
+            device = device_id(credstore)
+            files = credstore.keygen_many(args.tags, csr_writer, device, args.attributes)
+        if writer:
+            for tag, tag_files in files.items():
+                writer.write({'device': device, 'tag': tag, **tag_files})
+        else:
+            for tag in files:
+                print(f'New private key generated in secure tag {tag}')
+            print(f'Wrote CSRs to {args.output}')
+    elif args.subcommand=='inventory':
+        device = device_id(credstore)
+        creds = credstore.export_inventory(args.file, device)
+        if writer:
+            writer.write({'device': device, 'credentials': len(creds), 'file': args.file})
+        else:
+            print(f'Wrote {len(creds)} credentials of {device} to {args.file}')
     elif args.subcommand=='imei':
         imei = credstore.command_interface.get_imei()
         if imei is None:
             raise RuntimeError("Failed to get IMEI.")
-        print(f'IMEI: {imei}')
+        if writer:
+            writer.write({'device': device_serial(credstore), 'imei': imei})
+        else:
+            print(f'IMEI: {imei}')
     elif args.subcommand=='attoken':
         attoken = credstore.command_interface.get_attestation_token()
         if attoken is None:
             raise RuntimeError("Failed to get attestation token.")
-        print(f'Attestation token: {attoken}')
+        if args.harvest:
+            record = harvest_token(args.harvest, device_id(credstore), attoken)
+            if 'error' in record:
+                logging.warning(f'Could not decode attestation token: {record["error"]}')
+        if writer:
+            writer.write({'device': device_serial(credstore), 'attestation_token': attoken})
+        else:
+            print(f'Attestation token: {attoken}')
+
+SHELL_PROMPT = 'nrfcredstore> '
+SHELL_EXIT = ['exit', 'quit']
+# AT, or AT followed by a command prefix. Subcommands like attoken must not match.
+RAW_AT_PATTERN = re.compile(r'(?i)AT([+%#&]|$)')
+
+def run_shell(args, credstore):
+    """Read subcommands and raw AT commands until exit, reusing the open modem session"""
+    try:
+        # Line editing and history where available
+        import readline
+    except ImportError:
+        pass
+    print('Enter subcommands as on the command line, or AT commands. "help" lists subcommands, "exit" quits.')
+    while True:
+        try:
+            line = input(SHELL_PROMPT).strip()
+        except EOFError:
+            print()
+            return
+        if not line:
+            continue
+        if line in SHELL_EXIT:
+            return
+        start = time.perf_counter()
+        try:
+            if RAW_AT_PATTERN.match(line):
+                exec_raw_at(line, credstore)
+            else:
+                exec_shell_line(line, args, credstore)
+        except SystemExit:
+            # argparse already printed usage or an error
+            continue
+        except (RuntimeError, ValueError, ATCommandError, TimeoutError, OSError) as e:
+            print(f'Error: {e}')
+        print(f'({(time.perf_counter() - start) * 1000:.0f} ms)')
+
+def exec_raw_at(line, credstore):
+    command_interface = credstore.command_interface
+    with command_interface.comms.transaction():
+        command_interface.at_command(line)
+        result, output = command_interface.comms.expect_response("OK", "ERROR", "")
+    if output:
+        print(output.rstrip())
+    print('OK' if result else 'ERROR')
+
+def exec_shell_line(line, args, credstore):
+    tokens = shlex.split(line)
+    if tokens[0] == 'help':
+        tokens = ['--help']
+    sub_args = parse_args([args.dev] + tokens)
+    if sub_args.subcommand in (None, 'shell'):
+        print('Enter a subcommand, an AT command or "exit".')
+        return
+    sub_args.output_format = args.output_format
+    exec_with_writer(sub_args, credstore)
+
+def device_serial(credstore):
+    """Serial number of the board the device is connected through"""
+    return credstore.command_interface.comms.serial_number
+
+def device_id(credstore):
+    """IMEI of the device, or the serial number of the board if the IMEI is not available"""
+    imei = credstore.command_interface.get_imei()
+    if imei:
+        return imei
+    serial_number = credstore.command_interface.comms.serial_number
+    if serial_number is None:
+        raise RuntimeError("Failed to get a device id.")
+    return serial_number
 
 def exit_with_msg(exitcode, msg):
     print(msg)
     exit(exitcode)
 
 def main(args, credstore):
-    if args.cmd_type == 'auto':
-        credstore.command_interface.detect_shell_mode()
-    elif args.cmd_type == 'shell':
-        credstore.command_interface.set_shell_mode(True)
-    credstore.command_interface.enable_error_codes()
+    with phase('detect'):
+        if args.cmd_type == 'auto':
+            if credstore.command_interface.detect_shell_mode() == CMD_TYPE_TLS_SHELL:
+                raise NoATClientException('Device has a shell, but no AT client')
+        elif args.cmd_type == 'shell':
+            credstore.command_interface.set_shell_mode(True)
+        credstore.command_interface.enable_error_codes()
+    if args.journal:
+        credstore.journal = ProvisioningJournal(args.journal, device_id(credstore))
     exec_cmd(args, credstore)
 
+def open_comms(args) -> Comms:
+    # Use inquirer to find the device
+    if args.dev == 'auto':
+        return Comms(list_all=True, baudrate=args.baudrate, timeout=args.timeout, ready_timeout=args.ready_timeout, trace_path=args.trace)
+    elif args.dev == 'rtt':
+        return Comms(rtt=True, baudrate=args.baudrate, timeout=args.timeout, trace_path=args.trace)
+    # If dev is just numbers, assume it's an rtt device
+    elif args.dev.isdigit():
+        return Comms(rtt=True, serial=int(args.dev), timeout=args.timeout, trace_path=args.trace)
+    # Otherwise, assume it's a serial device
+    else:
+        return Comms(port=args.dev, baudrate=args.baudrate, timeout=args.timeout, ready_timeout=args.ready_timeout, trace_path=args.trace)
+
+def run_device(args):
+    # The job budget starts before the device is opened
+    deadline = Deadline(args.job_timeout) if args.job_timeout else None
+    comms = open_comms(args)
+    try:
+        if deadline:
+            comms.set_deadline(deadline)
+        if args.negotiate_baudrate and comms.serial_api:
+            with phase('baudrate'):
+                negotiate_baudrate(comms, cache=BaudrateCache(args.baudrate_cache))
+        cred_if = ATCommandInterface(comms)
+
+        main(args, CredStore(cred_if, deadline=deadline, retry_policies=retry_policies(args.retries)))
+    except Exception as e:
+        comms.dump_trace(f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        with phase('close'):
+            comms.close()
+
+def fleet_timeout(args):
+    return args.fleet_timeout or device_timeout_for(args.job_timeout)
+
+def fleet_writer(args):
+    """Writer for the records of all workers, or None for table output"""
+    if args.output_format == OUTPUT_TABLE:
+        return None
+    return create_writer(args.output_format, fields=RECORD_FIELDS.get(args.subcommand))
+
+def fleet_status_stream(args):
+    # Keep stdout machine-readable when records are written to it
+    return sys.stdout if args.output_format == OUTPUT_TABLE else sys.stderr
+
+def run_fleet_cmd(args, argv):
+    devices = fleet_devices(args.dev == FLEET_DEV_RTT)
+    if not devices:
+        raise RuntimeError("No device found")
+    writer = fleet_writer(args)
+    try:
+        report = run_fleet(devices, argv, args.fleet_log_dir, args.fleet_jobs, fleet_timeout(args),
+                           on_record=writer.write if writer else None)
+    finally:
+        if writer:
+            writer.close()
+    print_fleet_report(args, report)
+
+def run_station_cmd(args, argv):
+    out = fleet_status_stream(args)
+    print('Waiting for boards, press Ctrl-C to stop.', file=out)
+    def on_result(result):
+        print(f'{result["device"]}: {"ok" if result["ok"] else result["error"]}', file=out)
+    writer = fleet_writer(args)
+    try:
+        report = run_station(argv, args.fleet_log_dir, args.fleet_jobs, fleet_timeout(args),
+                             on_record=writer.write if writer else None, on_result=on_result)
+    finally:
+        if writer:
+            writer.close()
+    print_fleet_report(args, report)
+
+def print_fleet_report(args, report):
+    if args.fleet_report:
+        report.write(args.fleet_report)
+    out = fleet_status_stream(args)
+    summary = report.summary()
+    print(f'{summary["succeeded"]} of {summary["devices"]} devices succeeded in '
+          f'{summary["duration"]} s ({summary["devices_per_minute"]} devices/min)', file=out)
+    for device, error in summary['failures'].items():
+        print(f'{device}: {error}', file=out)
+    if report.failed:
+        exit_with_msg(ERR_UNKNOWN, f'Logs are in {args.fleet_log_dir}')
+
 def run(argv=sys.argv):
     args = parse_args(argv[1:])
-    comms = None
 
     if args.debug:
         logging.basicConfig(level='DEBUG')
     else:
         logging.basicConfig(level='ERROR')
 
-    # Use inquirer to find the device
-    if args.dev == 'auto':
-        comms = Comms(list_all=True, baudrate=args.baudrate, timeout=args.timeout)
-    elif args.dev == 'rtt':
-        comms = Comms(rtt=True, baudrate=args.baudrate, timeout=args.timeout)
-    # If dev is just numbers, assume it's an rtt device
-    elif args.dev.isdigit():
-        comms = Comms(rtt=True, serial=int(args.dev), timeout=args.timeout)
-    # Otherwise, assume it's a serial device
+    if args.profile:
+        try:
+            profile_run(lambda: dispatch(args, argv), args.profile)
+        finally:
+            print(timer.report(), file=sys.stderr)
+            print(f'Profile written to {args.profile}, report to {args.profile}.txt', file=sys.stderr)
     else:
-        comms = Comms(port=args.dev, baudrate=args.baudrate, timeout=args.timeout)
+        dispatch(args, argv)
 
-    cred_if = ATCommandInterface(comms)
-
-    main(args, CredStore(cred_if))
+def dispatch(args, argv):
+    if args.dev in FLEET_DEVS:
+        run_fleet_cmd(args, argv)
+    elif args.dev == STATION_DEV:
+        run_station_cmd(args, argv)
+    else:
+        run_device(args)
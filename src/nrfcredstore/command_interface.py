@@ -7,8 +7,10 @@
 from enum import Enum
 from abc import ABC, abstractmethod
 import math
-import time
-from nrfcredstore.comms import Comms
+from nrfcredstore.comms import Comms, CMD_TYPE_AT, CMD_TYPE_AT_SHELL, CMD_TYPE_TLS_SHELL
+from nrfcredstore.credfile import CredentialFile
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.parser import last_cmng, last_line, parse_attesttoken, parse_imei, parse_keygen
 import base64
 import hashlib
 import coloredlogs, logging
@@ -17,7 +19,14 @@ from typing import List, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
-IMEI_LEN = 15
+# Probes for detect_shell_mode. A raw AT client answers the first and rejects the second,
+# an AT shell does the opposite, and the TLS credentials shell rejects both.
+PROBE_AT = "AT+CGSN"
+PROBE_AT_SHELL = "at AT+CGSN"
+shell_pattern = re.compile(r'command not found|~\$')
+# Seconds to wait for a raw AT client to reject the shell probe. It answers right after the first
+# probe, and a client that dropped the line should not cost a full command timeout.
+PROBE_DRAIN_TIMEOUT = 0.2
 
 class CredentialCommandInterface(ABC):
     def __init__(self, comms: Comms):
@@ -32,6 +41,10 @@ class CredentialCommandInterface(ABC):
         """Write a raw line directly to the serial interface."""
         self.comms.write_line(command)
 
+    def set_deadline(self, deadline: Optional[Deadline]):
+        """Limit all following commands to the time left of a job, and abort them when it is cancelled."""
+        self.comms.set_deadline(deadline)
+
     @abstractmethod
     def write_credential(self, sectag: int, cred_type: int, cred_text: str) -> bool:
         """Write a credential string to the command interface"""
@@ -52,6 +65,10 @@ class CredentialCommandInterface(ABC):
         """Returns the expected digest/hash for a given credential as a string"""
         return ""
 
+    def expected_hash_for_file(self, cred_file: CredentialFile) -> str:
+        """Returns the expected digest/hash for a cached credential file"""
+        return self.calculate_expected_hash(cred_file.text)
+
     @abstractmethod
     def get_csr(self, sectag: int, attributes: str) -> Optional[str]:
         """Generate a private/public keypair and a corresponding Certificate Signing Request.
@@ -78,29 +95,43 @@ class CredentialCommandInterface(ABC):
 
 class ATCommandInterface(CredentialCommandInterface):
     shell = False
-
-    def _parse_sha(self, cmng_result_str: str):
-        # Example AT%CMNG response:
-        #   %CMNG: 123,0,"2C43952EE9E000FF2ACC4E2ED0897C0A72AD5FA72C3D934E81741CBD54F05BD1"
-        # The first item in " is the SHA.
-        try:
-            return cmng_result_str.split('"')[1]
-        except (ValueError, IndexError):
-            logger.error(f'Could not parse credential hash: {cmng_result_str}')
-            return None
+    # Device information learned once and answered from memory afterwards
+    _imei = None
+    _model_id = None
+    _mfw_version = None
 
     def set_shell_mode(self, shell: bool):
         self.shell = shell
 
-    def detect_shell_mode(self):
-        """Detect if the device is in shell mode or not."""
-        for cmd, shell_mode in [("at AT+CGSN", True), ("AT+CGSN", False)]:
-            for _ in range(3):
-                self.write_raw(cmd)
+    def detect_shell_mode(self) -> str:
+        """Detect if the device is in shell mode or not.
+
+        Both probe variants are sent back to back and classified from the one exchange. If the
+        port already answered with a shell prompt, only the shell variant is sent. The IMEI
+        returned by the probe is kept for get_imei().
+
+        Returns CMD_TYPE_AT, CMD_TYPE_AT_SHELL or CMD_TYPE_TLS_SHELL (shell without AT commands).
+        """
+        prompt_seen = bool(shell_pattern.search(self.comms.ready_response or ''))
+        for _ in range(3):
+            with self.comms.transaction():
+                self.comms.reset_input_buffer()
+                if not prompt_seen:
+                    self.write_raw(PROBE_AT)
+                self.write_raw(PROBE_AT_SHELL)
                 result, output = self.comms.expect_response("OK", "ERROR", "", suppress_errors=True, timeout=2)
-                if result and len(re.findall("[0-9]{15}", output)) > 0:
-                    self.set_shell_mode(shell_mode)
-                    return
+                shell = prompt_seen or bool(shell_pattern.search(output))
+                imei = parse_imei(output)
+                if result and imei:
+                    if not shell:
+                        # The raw AT client still has to reject the shell variant
+                        self.comms.expect_response("OK", "ERROR", suppress_errors=True, timeout=PROBE_DRAIN_TIMEOUT)
+                    self.set_shell_mode(shell)
+                    self._imei = imei
+                    return CMD_TYPE_AT_SHELL if shell else CMD_TYPE_AT
+                if shell and f'{PROBE_AT_SHELL.split()[0]}: command not found' in output:
+                    self.set_shell_mode(True)
+                    return CMD_TYPE_TLS_SHELL
         raise TimeoutError("Failed to detect shell mode. Device does not respond to AT commands.")
 
     def enable_error_codes(self):
@@ -111,21 +142,55 @@ class ATCommandInterface(CredentialCommandInterface):
     def at_command(self, at_command: str, wait_for_result=False, suppress_errors=False):
         """Write an AT command to the command interface. Optionally wait for OK"""
 
-        self.comms.reset_input_buffer()
+        with self.comms.transaction():
+            self.comms.reset_input_buffer()
 
-        if self.shell:
-            # Transform line endings to match shell expectations
-            at_command = at_command.replace("\r", "")
-            at_command = at_command.replace("\n", "\\n")
-            self.write_raw("at '" + at_command + "'")
-        else:
-            self.write_raw(at_command)
+            if self.shell:
+                # Transform line endings to match shell expectations
+                at_command = at_command.replace("\r", "")
+                at_command = at_command.replace("\n", "\\n")
+                self.write_raw("at '" + at_command + "'")
+            else:
+                self.write_raw(at_command)
 
-        if wait_for_result:
-            result, _ = self.comms.expect_response("OK", "ERROR", suppress_errors=suppress_errors)
-            return result
-        else:
-            return True
+            if wait_for_result:
+                result, _ = self.comms.expect_response("OK", "ERROR", suppress_errors=suppress_errors)
+                return result
+            else:
+                return True
+
+    def at_command_with_payload(self, prefix: str, payload: bytes, suffix: str, wait_for_result=False, suppress_errors=False):
+        """Write an AT command with a large payload. Optionally wait for OK
+
+        The payload is streamed to the device between prefix and suffix without building
+        the whole command string.
+        """
+
+        with self.comms.transaction():
+            self.comms.reset_input_buffer()
+
+            if self.shell:
+                # Transform line endings to match shell expectations
+                payload = payload.replace(b"\r", b"").replace(b"\n", b"\\n")
+                parts = [f"at '{prefix}".encode('ascii'), payload, f"{suffix}'".encode('ascii')]
+            else:
+                parts = [prefix.encode('ascii'), payload, suffix.encode('ascii')]
+            self.comms.write_line_parts(parts)
+
+            if wait_for_result:
+                result, _ = self.comms.expect_response("OK", "ERROR", suppress_errors=suppress_errors)
+                return result
+            else:
+                return True
+
+    def at_command_response(self, at_command: str, store_str: str = '') -> Tuple[bool, str]:
+        """Write an AT command and wait for OK, keeping other threads off the link meanwhile
+
+        Returns (result, lines containing store_str).
+        """
+        with self.comms.transaction():
+            self.at_command(at_command)
+            return self.comms.expect_response("OK", "ERROR", store_str)
 
     def write_credential(self, sectag: int, cred_type: int, cred_text: str):
         return self.at_command(f'AT%CMNG=0,{sectag},{cred_type},"{cred_text}"', wait_for_result=True)
@@ -134,73 +199,77 @@ class ATCommandInterface(CredentialCommandInterface):
         return self.at_command(f'AT%CMNG=3,{sectag},{cred_type}', wait_for_result=True)
 
     def check_credential_exists(self, sectag: int, cred_type: int, get_hash=True):
-        self.at_command(f'AT%CMNG=1,{sectag},{cred_type}')
-        retval, output = self.comms.expect_response("OK", "ERROR", "%CMNG: ")
-        # get the last line of the response
-        output = [x.strip() for x in output.split("\n") if x.strip()][-1]
-        if retval and output:
-            if not get_hash:
-                return True, None
-            else:
-                return True, self._parse_sha(output)
-
-        return False, None
+        retval, output = self.at_command_response(f'AT%CMNG=1,{sectag},{cred_type}', "%CMNG: ")
+        # there is no %CMNG line if the credential does not exist
+        record = last_cmng(output) if retval else None
+        if record is None:
+            return False, None
+        if not get_hash:
+            return True, None
+        if not record.sha:
+            logger.error(f'Could not parse credential hash: {output.strip()}')
+            return True, None
+        return True, record.sha
 
     def calculate_expected_hash(self, cred_text: str):
         # AT Command host returns hex of SHA256 hash of credential plaintext
         return hashlib.sha256(cred_text.encode('utf-8')).hexdigest().upper()
 
+    def expected_hash_for_file(self, cred_file: CredentialFile):
+        return cred_file.at_sha
+
     def go_offline(self):
         return self.at_command('AT+CFUN=4', wait_for_result=True)
 
     def get_imei(self):
-        self.at_command('AT+CGSN')
-        retval, output = self.comms.expect_response("OK", "ERROR", "")
-        # get the last line of the response
-        output = [x.strip() for x in output.split("\n") if x.strip()][-1]
+        if self._imei:
+            return self._imei
+        retval, output = self.at_command_response('AT+CGSN')
         if not retval:
             return None
-        return output[:IMEI_LEN]
+        self._imei = parse_imei(output)
+        return self._imei
 
     def get_model_id(self):
-        self.at_command('AT+CGMM')
-        retval, output = self.comms.expect_response("OK", "ERROR", "")
-        # get the last line of the response
-        output = [x.strip() for x in output.split("\n") if x.strip()][-1]
+        if self._model_id:
+            return self._model_id
+        retval, output = self.at_command_response('AT+CGMM')
         if not retval:
             return None
+        output = last_line(output)
+        self._model_id = output
         return output
 
     def get_mfw_version(self):
-        self.at_command('AT+CGMR')
-        retval, output = self.comms.expect_response("OK", "ERROR", "")
-        # get the last line of the response
-        output = [x.strip() for x in output.split("\n") if x.strip()][-1]
+        if self._mfw_version:
+            return self._mfw_version
+        retval, output = self.at_command_response('AT+CGMR')
         if not retval:
             return None
+        output = last_line(output)
+        self._mfw_version = output
         return output
 
     def get_attestation_token(self):
-        self.at_command('AT%ATTESTTOKEN')
-        retval, output = self.comms.expect_response("OK", "ERROR", "%ATTESTTOKEN:")
-        if not retval:
+        retval, output = self.at_command_response('AT%ATTESTTOKEN', "%ATTESTTOKEN:")
+        token = parse_attesttoken(output) if retval else None
+        if token is None:
             return None
-        attest_tok = output.split('"')[1]
-        return attest_tok
+        return token.blob
 
     def get_csr(self, sectag=0, attributes=""):
         if attributes:
-            self.at_command(f'AT%KEYGEN={sectag},2,0,"{attributes}"')
+            command = f'AT%KEYGEN={sectag},2,0,"{attributes}"'
         else:
-            self.at_command(f'AT%KEYGEN={sectag},2,0')
+            command = f'AT%KEYGEN={sectag},2,0'
 
-        retval, output = self.comms.expect_response("OK", "ERROR", "%KEYGEN:")
+        retval, output = self.at_command_response(command, "%KEYGEN:")
 
-        if not retval:
+        csr = parse_keygen(output) if retval else None
+        if csr is None:
             return None
 
-        # Convert the encoded blob to an actual cert
-        csr_blob = str(output).split('"')[1]
+        csr_blob = csr.blob
         logger.debug('CSR blob: {}'.format(csr_blob))
 
         # Format is "body.cose"
@@ -227,35 +296,38 @@ class TLSCredShellInterface(CredentialCommandInterface):
         # text -> bytes -> base64 bytes -> base64 text
         encoded = base64.b64encode(cred_text.encode()).decode()
 
-        # Clear credential buffer -- If it is already clear, there may not be text feedback
-        self.write_raw("cred buf clear")
-
-        # Write the encoded credential in chunks
-        chunks = math.ceil(len(encoded)/TLS_CRED_CHUNK_SIZE)
-        for c in range(chunks):
-            chunk = encoded[c*TLS_CRED_CHUNK_SIZE:(c+1)*TLS_CRED_CHUNK_SIZE]
-            self.write_raw(f"cred buf {chunk}")
-            self.comms.expect_response("Stored")
-
-        # Store the buffered credential
-        self.write_raw(f"cred add {sectag} {TLS_CRED_TYPES[cred_type]} DEFAULT bint")
-        result, _ = self.comms.expect_response("Added TLS credential")
-        time.sleep(1)
+        with self.comms.transaction():
+            # Clear credential buffer -- If it is already clear, there may not be text feedback
+            self.write_raw("cred buf clear")
+
+            # Write the encoded credential in chunks
+            chunks = math.ceil(len(encoded)/TLS_CRED_CHUNK_SIZE)
+            for c in range(chunks):
+                chunk = encoded[c*TLS_CRED_CHUNK_SIZE:(c+1)*TLS_CRED_CHUNK_SIZE]
+                self.write_raw(f"cred buf {chunk}")
+                self.comms.expect_response("Stored")
+
+            # Store the buffered credential
+            self.write_raw(f"cred add {sectag} {TLS_CRED_TYPES[cred_type]} DEFAULT bint")
+            result, _ = self.comms.expect_response("Added TLS credential")
+        self.comms.wait(1)
         return result
 
     def delete_credential(self, sectag: int, cred_type: int):
-        self.write_raw(f'cred del {sectag} {TLS_CRED_TYPES[cred_type]}')
-        result, _ = self.comms.expect_response("Deleted TLS credential", "There is no TLS credential")
-        time.sleep(2)
+        with self.comms.transaction():
+            self.write_raw(f'cred del {sectag} {TLS_CRED_TYPES[cred_type]}')
+            result, _ = self.comms.expect_response("Deleted TLS credential", "There is no TLS credential")
+        self.comms.wait(2)
         return result
 
     def check_credential_exists(self, sectag: int, cred_type: int, get_hash=True):
-        self.write_raw(f'cred list {sectag} {TLS_CRED_TYPES[cred_type]}')
+        with self.comms.transaction():
+            self.write_raw(f'cred list {sectag} {TLS_CRED_TYPES[cred_type]}')
 
-        # This will capture the list dump for the credential if it exists.
-        result, output = self.comms.expect_response("1 credentials found.",
-                                                    "0 credentials found.",
-                                                    f"{sectag},{TLS_CRED_TYPES[cred_type]}")
+            # This will capture the list dump for the credential if it exists.
+            result, output = self.comms.expect_response("1 credentials found.",
+                                                        "0 credentials found.",
+                                                        f"{sectag},{TLS_CRED_TYPES[cred_type]}")
 
         if not output:
             return False, None
@@ -281,6 +353,9 @@ class TLSCredShellInterface(CredentialCommandInterface):
         hash = hashlib.sha256(cred_text.encode('utf-8') + b'\x00')
         return base64.b64encode(hash.digest()).decode()
 
+    def expected_hash_for_file(self, cred_file: CredentialFile):
+        return cred_file.tls_sha
+
     def get_csr(self, sectag=0, attributes=""):
         raise RuntimeError("The TLS Credentials Shell does not support CSR generation")
 
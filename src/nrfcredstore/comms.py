@@ -11,16 +11,22 @@
 from serial.tools import list_ports
 from serial.tools.list_ports_common import ListPortInfo
 import serial
-from collections import defaultdict
+from collections import defaultdict, deque
 import sys
 import time
 import atexit
+import threading
+from contextlib import contextmanager
 import inquirer
 from pynrfjprog import LowLevel
 import coloredlogs, logging
 import re
 import platform
-from typing import Tuple, List, Union, Optional
+from typing import Callable, Dict, Tuple, List, Union, Optional
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.parser import parse_cme_error
+from nrfcredstore.profiling import phase
+from nrfcredstore.trace import TraceBuffer, TRACE_EVENT, TRACE_RX, TRACE_TX
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +40,23 @@ CMD_TYPE_AT_SHELL = "at_shell"
 CMD_TYPE_TLS_SHELL = "tls_cred_shell"
 CMD_TYPE_AUTO = "auto"
 
+# Default seconds to wait for the device to answer the serial readiness probe
+SERIAL_READY_TIMEOUT = 0.2
+# Sent after opening a serial port. An AT client answers OK, a shell rejects it and prints its prompt.
+SERIAL_READY_PROBE = 'AT'
+ready_pattern = re.compile(r'^(OK|ERROR)\r?$|command not found|~\$', re.MULTILINE)
+
+# Seconds to wait for the RTT control block after starting RTT
+RTT_CONTROL_BLOCK_TIMEOUT = 2.5
+
+# Limits of the output captured by expect_response
+CAPTURE_MAX_LINES = 4096
+CAPTURE_MAX_BYTES = 256 * 1024
+
+# Chunk sizes used when writing to the transport
+RTT_WRITE_CHUNK_SIZE = 12
+SERIAL_WRITE_CHUNK_SIZE = 1024
+
 ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
 
 usb_patterns = [
@@ -87,14 +110,73 @@ def get_connected_nordic_boards() -> List[Tuple[str, Union[str, int], ListPortIn
     for serial, ports in nordic_boards.items():
         for pattern, name, main_port in usb_patterns:
             if f"SER={pattern}" in ports[0].hwid:
-                main_ports.append((name, serial, ports[main_port]))
+                # The main port may not be enumerated yet right after the board is plugged in
+                if main_port < len(ports):
+                    main_ports.append((name, serial, ports[main_port]))
                 break
     return main_ports
 
+class JLinkSessionPool:
+    '''
+    Keeps the J-Link DLL loaded and emulator connections open for reuse within a process.
+    Enumeration results are cached until refreshed.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._enum_api = None
+        self._jlinks: Optional[List[int]] = None
+        self._sessions: Dict[int, LowLevel.API] = {}
+
+    def connected_jlinks(self, refresh=False) -> List[int]:
+        with self._lock:
+            if self._jlinks is None or refresh:
+                if self._enum_api is None:
+                    self._enum_api = LowLevel.API(LowLevel.DeviceFamily.UNKNOWN)
+                    self._enum_api.open()
+                self._jlinks = self._enum_api.enum_emu_snr() or []
+            return self._jlinks
+
+    def acquire(self, serial_number: int) -> Tuple[LowLevel.API, bool]:
+        '''
+        Return an API connected to the emulator, and whether it is a reused session.
+        '''
+        with self._lock:
+            api = self._sessions.pop(serial_number, None)
+        if api is not None:
+            return (api, True)
+        api = LowLevel.API(LowLevel.DeviceFamily.UNKNOWN)
+        api.open()
+        api.connect_to_emu_with_snr(serial_number)
+        api.select_family(api.read_device_family())
+        return (api, False)
+
+    def release(self, serial_number: int, api: LowLevel.API):
+        '''
+        Return a session to the pool. It stays connected, with RTT running.
+        '''
+        with self._lock:
+            old = self._sessions.pop(serial_number, None)
+            self._sessions[serial_number] = api
+        if old is not None and old is not api:
+            old.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            enum_api, self._enum_api = self._enum_api, None
+            self._jlinks = None
+        for api in sessions:
+            api.close()
+        if enum_api is not None:
+            enum_api.close()
+
+jlink_pool = JLinkSessionPool()
+atexit.register(jlink_pool.close_all)
+
 # Returns a list of SEGGER J-Link serial numbers as int
-def get_connected_jlinks() -> List[int]:
-    with LowLevel.API(LowLevel.DeviceFamily.UNKNOWN) as api:
-        return api.enum_emu_snr() or []
+def get_connected_jlinks(refresh=False) -> List[int]:
+    return jlink_pool.connected_jlinks(refresh)
 
 # For a serial device, return the serial number
 def extract_serial_number_from_serial_device(dev: ListPortInfo) -> Union[str, int, None]:
@@ -271,21 +353,55 @@ class Comms:
         line_ending="\r\n",
         rtt=False,
         list_all=False,
+        rtt_reset=None,
+        ready_timeout=SERIAL_READY_TIMEOUT,
+        trace_path=None,
+        capture_max_lines=CAPTURE_MAX_LINES,
+        capture_max_bytes=CAPTURE_MAX_BYTES,
     ):
+        '''
+        rtt_reset: Reset the device when opening RTT. By default, only fresh J-Link sessions
+        reset the device. Sessions reused from the pool are already running RTT.
+        ready_timeout: Longest time to wait for a serial device to answer the readiness probe.
+        trace_path: File the trace of recent traffic is written to when a command fails.
+        capture_max_lines, capture_max_bytes: Limits of the output kept by expect_response.
+        '''
         self.timeout = timeout
+        self.ready_timeout = ready_timeout
+        # Whatever the device answered to the readiness probe, such as a shell prompt
+        self.ready_response = ''
         self.jlink_api = None
         self.serial_api = None
+        self.baudrate = None
+        # Settings of the serial port, kept to reopen it at another baud rate
+        self._serial_settings = None
         self.write = None
         self.read_line = None
         self.line_ending = line_ending
         self._rtt_line_buffer = ''
-
-        serial_port, self.serial_number = select_device(rtt, serial, port, list_all)
-
-        if rtt:
-            self._init_rtt()
-        else:
-            self._init_serial(serial_port, baudrate, xonxoff, rtscts, dsrdtr)
+        self.trace = TraceBuffer()
+        self.trace_path = trace_path
+        self.capture_max_lines = capture_max_lines
+        self.capture_max_bytes = capture_max_bytes
+        # Set when the output of the last expect_response was cut to the capture limits
+        self.capture_overflow = False
+        # How the last expect_response failed: the +CME ERROR code, or a timeout
+        self.last_error_code: Optional[int] = None
+        self.last_timed_out = False
+        # Job deadline and cancellation token, honoured by every wait
+        self.deadline: Optional[Deadline] = None
+        # Held for each single call, and across a whole exchange with transaction()
+        self._lock = threading.RLock()
+        self._urc_handlers: List[Tuple[Optional[str], Callable[[str], None]]] = []
+
+        with phase('enumerate'):
+            serial_port, self.serial_number = select_device(rtt, serial, port, list_all)
+
+        with phase('open'):
+            if rtt:
+                self._init_rtt(rtt_reset)
+            else:
+                self._init_serial(serial_port, baudrate, xonxoff, rtscts, dsrdtr)
 
         atexit.register(self.close)
 
@@ -295,53 +411,251 @@ class Comms:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    @contextmanager
+    def transaction(self):
+        '''
+        Hold the link for a command and its response, or a sequence of exchanges.
+        Other threads block until the block is left, also if it raises. Transactions nest.
+        '''
+        with self._lock:
+            yield self
+
+    def add_urc_handler(self, callback: Callable[[str], None], prefix: Optional[str] = None):
+        '''
+        Register a callback for unsolicited lines, such as +CEREG or %XMODEMSLEEP.
+        Lines starting with prefix are passed to the callback and kept out of command output.
+        Without a prefix, the callback receives all lines that would otherwise be discarded.
+        '''
+        self._urc_handlers.append((prefix, callback))
+
+    def remove_urc_handler(self, callback: Callable[[str], None]):
+        self._urc_handlers = [(p, c) for p, c in self._urc_handlers if c != callback]
+
+    def _urc_handler_for(self, line: str) -> Optional[Callable[[str], None]]:
+        for prefix, callback in self._urc_handlers:
+            if prefix is not None and line.startswith(prefix):
+                return callback
+        return None
+
+    def _dispatch(self, callback: Callable[[str], None], line: str):
+        try:
+            callback(line)
+        except Exception as e:
+            logger.error(f'Unsolicited result handler failed: {e}')
+
+    def _dispatch_unhandled(self, line: str):
+        for prefix, callback in self._urc_handlers:
+            if prefix is None:
+                self._dispatch(callback, line)
+
+    def poll_urcs(self, timeout=1):
+        '''
+        Read and dispatch unsolicited lines for up to timeout seconds while no command is running.
+        '''
+        with self._lock:
+            time_end = time.time() + timeout
+            while time.time() < time_end:
+                line = self.read_line() # type: ignore
+                if not line:
+                    continue
+                line = ansi_escape.sub('', line.strip())
+                if not line:
+                    continue
+                callback = self._urc_handler_for(line)
+                if callback:
+                    self._dispatch(callback, line)
+                else:
+                    self._dispatch_unhandled(line)
+
+    def reset_input_buffer(self):
+        '''
+        Drop stale input.
+        If unsolicited result handlers are registered, pending lines are dispatched first.
+        '''
+        with self._lock:
+            if self._urc_handlers:
+                for line in self._pending_lines():
+                    line = ansi_escape.sub('', line.strip())
+                    if not line:
+                        continue
+                    callback = self._urc_handler_for(line)
+                    if callback:
+                        self._dispatch(callback, line)
+                    else:
+                        self._dispatch_unhandled(line)
+            self._reset_input_buffer()
+
     def close(self):
         if self.jlink_api:
-            self.jlink_api.close()
+            # Keep the session open, so the next Comms for this J-Link can skip the setup
+            jlink_pool.release(self.serial_number, self.jlink_api)
             self.jlink_api = None
         if self.serial_api:
             self.serial_api.close()
             self.serial_api = None
 
+    def reopen(self, baudrate: int):
+        '''
+        Close the serial port and open it again at another baud rate.
+        If the driver rejects the baud rate, the port is opened again at the previous one
+        before the error is raised.
+        '''
+        if not self._serial_settings:
+            raise RuntimeError("Baud rate can only be changed for serial devices")
+        with self._lock:
+            previous = self.baudrate
+            if self.serial_api:
+                self.serial_api.close()
+                self.serial_api = None
+            self.ready_response = ''
+            try:
+                self._open_serial(baudrate)
+            except (OSError, ValueError):
+                if previous is not None and previous != baudrate:
+                    self._open_serial(previous)
+                raise
+
+    def set_deadline(self, deadline: Optional[Deadline]):
+        '''
+        Limit all following waits to the time left of the job, and abort them when it is cancelled.
+        '''
+        if self.deadline:
+            self.deadline.remove_on_cancel(self._cancel_read)
+        self.deadline = deadline
+        if deadline:
+            deadline.on_cancel(self._cancel_read)
+
+    def _cancel_read(self):
+        # Wake up a blocking serial read. RTT reads poll and notice the cancellation themselves.
+        if self.serial_api:
+            self.serial_api.cancel_read()
+
+    def wait(self, seconds: float):
+        '''
+        Sleep, or with a deadline set, wait until the time is up or the job is cancelled.
+        '''
+        if self.deadline:
+            self.deadline.wait(seconds)
+        else:
+            time.sleep(seconds)
+
     def expect_response(self, ok_str=None, error_str=None, store_str=None, timeout=15, suppress_errors=False):
         '''
         Read lines until either ok_str or error_str is found or timeout (seconds) is reached.
         If store_str is in one of the lines, it will be returned as the output.
 
+        Lines matching a registered unsolicited result handler are dispatched instead.
+        Use transaction() to keep other threads off the link between a write and this call.
+
         return tuple of (ok_or_error, output)
         '''
-        output = ''
+        with self._lock:
+            result = self._expect_response(ok_str, error_str, store_str, timeout, suppress_errors)
+        if not result[0] and not suppress_errors:
+            self.dump_trace(f'No {ok_str} from device')
+        return result
+
+    def dump_trace(self, reason: str):
+        '''
+        Write the trace of recent traffic to trace_path, if set.
+        '''
+        if self.trace_path:
+            self.trace.dump(self.trace_path, reason)
+            logger.warning(f'{reason}, trace written to {self.trace_path}')
+
+    def _expect_response(self, ok_str, error_str, store_str, timeout, suppress_errors):
+        # Captured lines are kept in a deque, bounded in lines and bytes. When a chatty device
+        # exceeds the cap, the oldest lines are dropped, since the answer precedes the terminator.
+        captured = deque()
+        captured_bytes = 0
+        self.capture_overflow = False
+        self.last_error_code = None
+        self.last_timed_out = False
+        if self.deadline:
+            timeout = self.deadline.budget(timeout)
         time_end = time.time() + timeout
+        result = None
         while time.time() < time_end:
             line = self.read_line() # type: ignore
-            if line:
-                line = line.strip()
-                # Remove ANSI escape codes
-                line = ansi_escape.sub('', line)
-                if ok_str and ok_str == line:
-                    return (True, output)
-                if error_str and error_str == line:
-                    return (False, output)
-                if line.startswith('+CME ERROR'):
-                    code = int(line.replace('+CME ERROR: ', ''))
-                    if not suppress_errors:
-                        logging.error(f'AT command error: {ERR_CODE_TO_MSG.get(code, "Unknown error")}')
-                    return (False, output)
-                if (store_str is not None) and store_str in line:
-                    output += line + '\r\n'
-            time.sleep(0.1)
-        return (False, output)
+            if not line:
+                self.wait(0.1)
+                continue
+            line = line.strip()
+            # Remove ANSI escape codes
+            line = ansi_escape.sub('', line)
+            if ok_str and ok_str == line:
+                result = True
+                break
+            if error_str and error_str == line:
+                result = False
+                break
+            cme_error = parse_cme_error(line)
+            if cme_error:
+                self.last_error_code = cme_error.code
+                if not suppress_errors:
+                    logging.error(f'AT command error: {ERR_CODE_TO_MSG.get(cme_error.code, "Unknown error")}')
+                result = False
+                break
+            callback = self._urc_handler_for(line) if self._urc_handlers else None
+            if callback:
+                self._dispatch(callback, line)
+            elif (store_str is not None) and store_str in line:
+                captured.append(line)
+                captured_bytes += len(line) + 2
+                while len(captured) > self.capture_max_lines or captured_bytes > self.capture_max_bytes:
+                    captured_bytes -= len(captured.popleft()) + 2
+                    self.capture_overflow = True
+            elif line and self._urc_handlers:
+                self._dispatch_unhandled(line)
+        if result is None:
+            self.trace.record(TRACE_EVENT, f'Timeout after {timeout} s')
+            self.last_timed_out = True
+            if self.deadline:
+                # Raises if the job budget, not the command timeout, ran out
+                self.deadline.check()
+            result = False
+        if self.capture_overflow:
+            logger.warning(f'Response exceeded {self.capture_max_lines} lines or {self.capture_max_bytes} bytes, '
+                           'oldest lines were dropped')
+        return (result, ''.join(line + '\r\n' for line in captured))
 
     def reset_device(self):
         if self.jlink_api:
-            self.close()
-            self._init_rtt()
+            self.jlink_api.rtt_stop()
+            self._start_rtt(reset=True)
         else:
             logger.error("Cannot reset device, not using RTT")
 
+    def reconnect_rtt(self):
+        '''
+        Restart RTT without resetting the device.
+        '''
+        if self.jlink_api:
+            self.jlink_api.rtt_stop()
+            self._start_rtt(reset=False)
+        else:
+            logger.error("Cannot reconnect, not using RTT")
+
     def write_line(self, data : str):
-        logger.debug(f"> {data}")
-        self.write((data + self.line_ending).encode('ascii')) # type: ignore
+        encoded = (data + self.line_ending).encode('ascii')
+        with self._lock:
+            self.trace.record(TRACE_TX, encoded)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"> {data}")
+            self.write(encoded) # type: ignore
+
+    def write_line_parts(self, parts: List[bytes]):
+        '''
+        Write one line given as several byte buffers, for example a command prefix, a large
+        payload and a suffix. The buffers are sent in order without joining them first.
+        '''
+        with self._lock:
+            self.trace.record(TRACE_TX, tuple(parts))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"> {bytes(parts[0][:64]).decode('ascii', errors='replace')}... ({sum(len(p) for p in parts)} bytes)")
+            for part in parts:
+                self.write(part) # type: ignore
+            self.write(self.line_ending.encode('ascii')) # type: ignore
 
     def _readline_rtt(self) -> Optional[str]:
         time_end = time.time() + self.timeout
@@ -353,64 +667,123 @@ class Comms:
                 # Split the line from the buffer
                 line = self._rtt_line_buffer[:line_end]
                 self._rtt_line_buffer = self._rtt_line_buffer[line_end + len(self.line_ending) :]
-                logger.debug(f"< {line}")
+                self.trace.record(TRACE_RX, line)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"< {line}")
                 return line
-            time.sleep(0.1)
+            self.wait(0.1)
         return None
 
     def _readline_serial(self) -> Optional[str]:
         # Read a line from the serial port
         line = self.serial_api.readline() # type: ignore
         if line:
+            self.trace.record(TRACE_RX, line)
             line = line.decode('utf-8', errors="replace").strip()
-            logger.debug(f"< {line}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"< {line}")
             return line
         return None
 
     def _write_rtt(self, data: bytes):
-        # Hacky workaround from old rtt_interface
-        for i in range(0, len(data), 12):
-            self.jlink_api.rtt_write(channel_index=0, msg=data[i : i + 12]) # type: ignore
-            time.sleep(0.01)
+        # Hacky workaround from old rtt_interface: write in small chunks.
+        # The target buffer may accept less than a chunk, so resend the rest until it is taken.
+        view = memoryview(data)
+        time_end = time.time() + self.timeout
+        while view:
+            written = self.jlink_api.rtt_write(channel_index=0, msg=view[:RTT_WRITE_CHUNK_SIZE]) # type: ignore
+            if written:
+                view = view[written:]
+                time_end = time.time() + self.timeout
+            elif time.time() > time_end:
+                raise TimeoutError("RTT write timed out")
+            self.wait(0.01)
 
     def _write_serial(self, data: bytes):
-        self.serial_api.write(data) # type: ignore
+        view = memoryview(data)
+        for i in range(0, len(view), SERIAL_WRITE_CHUNK_SIZE):
+            self.serial_api.write(view[i : i + SERIAL_WRITE_CHUNK_SIZE]) # type: ignore
 
     def _reset_input_buffer_rtt(self):
         # RTT does not have an input buffer to reset, but we can clear the line buffer
         self._rtt_line_buffer = ''
 
-    def _init_rtt(self):
-        self.jlink_api = LowLevel.API(LowLevel.DeviceFamily.UNKNOWN)
-        self.jlink_api.open()
-        self.jlink_api.connect_to_emu_with_snr(self.serial_number)
-        self.jlink_api.select_family(self.jlink_api.read_device_family())
-        self.jlink_api.sys_reset()
-        self.jlink_api.go()
-        self.jlink_api.rtt_start()
-        for _ in range(5):
-            if self.jlink_api.rtt_is_control_block_found():
+    def _pending_lines_rtt(self) -> List[str]:
+        self._rtt_line_buffer += self.jlink_api.rtt_read(channel_index=0, length=4096) # type: ignore
+        lines = self._rtt_line_buffer.split(self.line_ending)
+        # Keep an incomplete last line, it is dropped by the reset
+        self._rtt_line_buffer = lines.pop()
+        return lines
+
+    def _pending_lines_serial(self) -> List[str]:
+        waiting = self.serial_api.in_waiting # type: ignore
+        if not waiting:
+            return []
+        lines = self.serial_api.read(waiting).decode('utf-8', errors="replace").split('\n') # type: ignore
+        # Keep only complete lines, an incomplete last line is dropped by the reset
+        lines.pop()
+        return lines
+
+    def _start_rtt(self, reset: bool):
+        self._rtt_line_buffer = ''
+        if reset:
+            self.jlink_api.sys_reset() # type: ignore
+            self.jlink_api.go() # type: ignore
+        if reset or not self.jlink_api.is_rtt_started(): # type: ignore
+            self.jlink_api.rtt_start() # type: ignore
+        time_end = time.time() + RTT_CONTROL_BLOCK_TIMEOUT
+        while not self.jlink_api.rtt_is_control_block_found(): # type: ignore
+            if time.time() > time_end:
+                logger.warning("RTT control block not found")
                 break
-            time.sleep(0.5)
+            time.sleep(0.05)
+
+    def _init_rtt(self, reset: Optional[bool] = None):
+        self.jlink_api, reused = jlink_pool.acquire(self.serial_number) # type: ignore
+        self._start_rtt(reset=not reused if reset is None else reset)
         self.write = self._write_rtt
         self.read_line = self._readline_rtt
-        self.reset_input_buffer = self._reset_input_buffer_rtt
+        self._reset_input_buffer = self._reset_input_buffer_rtt
+        self._pending_lines = self._pending_lines_rtt
+
+    def _wait_ready_serial(self):
+        '''
+        Wait until the device answers the probe sent after opening the port, instead of
+        sleeping for a fixed time. The answer is kept in ready_response.
+        '''
+        time_end = time.time() + self.ready_timeout
+        data = b''
+        while time.time() < time_end:
+            waiting = self.serial_api.in_waiting # type: ignore
+            if waiting:
+                data += self.serial_api.read(waiting) # type: ignore
+                response = ansi_escape.sub('', data.decode('utf-8', errors="replace"))
+                if ready_pattern.search(response):
+                    self.ready_response = response
+                    logger.debug(f"Device ready: {self.ready_response!r}")
+                    return True
+            time.sleep(0.005)
+        logger.debug(f"No answer to readiness probe: {data!r}")
+        return False
 
     def _init_serial(self, serial_port, baudrate, xonxoff, rtscts, dsrdtr):
+        self._serial_settings = dict(port=serial_port.device, xonxoff=xonxoff, rtscts=rtscts, dsrdtr=dsrdtr)
+        self._open_serial(baudrate)
+
+    def _open_serial(self, baudrate):
         self.serial_api = serial.Serial(
-            port=serial_port.device,
             baudrate=baudrate,
             timeout=self.timeout,
-            xonxoff=xonxoff,
-            rtscts=rtscts,
-            dsrdtr=dsrdtr,
+            **self._serial_settings,
         )
+        self.baudrate = baudrate
         # Initialize the serial port, clear the buffers
         self.serial_api.reset_output_buffer()
-        self.serial_api.write(self.line_ending.encode('ascii'))
+        self.serial_api.write((SERIAL_READY_PROBE + self.line_ending).encode('ascii'))
         self.serial_api.flush()
-        time.sleep(0.2)
+        self._wait_ready_serial()
         self.serial_api.reset_input_buffer()
         self.write = self._write_serial
         self.read_line = self._readline_serial
-        self.reset_input_buffer = self.serial_api.reset_input_buffer
+        self._reset_input_buffer = self.serial_api.reset_input_buffer
+        self._pending_lines = self._pending_lines_serial
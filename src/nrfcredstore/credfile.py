@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Process-wide cache of local credential files.
+# Files are keyed by (path, size, mtime, inode), so the same CA or certificate is read and hashed
+# only once per run, no matter how many devices it is written to.
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from functools import cached_property
+from typing import Dict, Optional, Tuple
+
+class CredentialFile:
+    def __init__(self, text: str):
+        """Normalized contents of a credential file
+
+        Args:
+            text: Credential text with trailing whitespace removed.
+        """
+        self.text = text
+
+    @cached_property
+    def data(self) -> bytes:
+        """Credential encoded for the wire, shared by all writes of this file"""
+        return self.text.encode('ascii')
+
+    @cached_property
+    def at_sha(self) -> str:
+        """Digest as reported by AT%CMNG: hex of SHA256 of the credential plaintext"""
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest().upper()
+
+    @cached_property
+    def tls_sha(self) -> str:
+        """Digest as reported by the TLS credentials shell: base64 of SHA256 including NULL"""
+        digest = hashlib.sha256(self.text.encode('utf-8') + b'\x00').digest()
+        return base64.b64encode(digest).decode()
+
+_cache: Dict[Tuple, CredentialFile] = {}
+_cache_lock = threading.Lock()
+
+def _file_key(file) -> Optional[Tuple]:
+    name = getattr(file, 'name', None)
+    path = os.path.abspath(name) if isinstance(name, str) else None
+    try:
+        st = os.fstat(file.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+    return (path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+def load_credential(file: io.TextIOBase) -> CredentialFile:
+    """Return the normalized credential from an open text file
+
+    Files on disk are cached. In-memory streams are always read.
+    """
+    key = _file_key(file)
+    if key is None:
+        return CredentialFile(file.read().rstrip())
+    with _cache_lock:
+        cred = _cache.get(key)
+        if cred is None:
+            cred = CredentialFile(file.read().rstrip())
+            _cache[key] = cred
+    return cred
+
+def load_credential_path(path: str) -> CredentialFile:
+    """Return the normalized credential from a path, only opening the file on a cache miss"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+    with _cache_lock:
+        cred = _cache.get(key)
+        if cred is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                cred = CredentialFile(f.read().rstrip())
+            _cache[key] = cred
+    return cred
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
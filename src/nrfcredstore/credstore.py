@@ -1,10 +1,32 @@
-import base64
+import bisect
 import io
+import logging
 from enum import Enum
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+from nrfcredstore.credfile import load_credential
+from nrfcredstore.csr import CSRWriter, FORMAT_DER, FORMAT_PEM, der_to_pem, split_keygen_output
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.parser import CMNG_PATTERN
+from nrfcredstore.journal import ProvisioningJournal
+from nrfcredstore.retry import (
+    NO_RETRY, RETRY_DELETE, RETRY_KEYGEN, RETRY_QUERY, RETRY_WRITE, RetryPolicy, run_with_retry
+)
+
+logger = logging.getLogger(__name__)
 
 FUN_MODE_OFFLINE = 4
 
+# Nordic identity and attestation keys that can not be deleted
+RESERVED_TAGS = frozenset([4294967292, 4294967293, 4294967294])
+
+# Highest secure tag available to applications
+SEC_TAG_MAX = 2147483647
+DEFAULT_TAG_RANGE = (0, SEC_TAG_MAX)
+
+# Longest command line used when concatenating AT commands
+AT_CONCAT_MAX_LEN = 512
+
 class CredType(Enum):
     ANY = -1
     ROOT_CA_CERT = 0
@@ -20,15 +42,73 @@ class CredType(Enum):
     NORDIC_ID_ROOT_CA = 10
     NORDIC_PUB_KEY = 11
 
+class WriteResult(Enum):
+    WRITTEN = 'written'
+    VERIFIED = 'verified'
+    MISMATCH = 'mismatch'
+
 class Credential:
     def __init__(self, tag: int, type: int, sha: str):
         self.tag = tag
         self.type = CredType(type)
         self.sha = sha
 
+def parse_credentials(output: str) -> List[Credential]:
+    """All credentials in AT%CMNG=1 output"""
+    # Built straight from the match groups, without intermediate records, as listing is hot
+    return [Credential(int(tag), int(type), sha) for tag, type, sha in CMNG_PATTERN.findall(output)]
+
 class CredStore:
-    def __init__(self, command_interface):
+    def __init__(self, command_interface, journal: Optional[ProvisioningJournal] = None,
+                 deadline: Optional[Deadline] = None,
+                 retry_policies: Optional[Dict[str, RetryPolicy]] = None):
+        """Credential operations on a modem
+
+        retry_policies maps operation classes (see nrfcredstore.retry) to their retry policy.
+        Operations without a policy are not retried.
+        """
         self.command_interface = command_interface
+        self.journal = journal
+        self.retry_policies = retry_policies or {}
+        self.deadline = None
+        self._concat_supported = None
+        # Sorted secure tags in use, built from one listing and kept up to date by writes
+        self._tag_index: Optional[List[int]] = None
+        if deadline:
+            self.set_deadline(deadline)
+
+    def set_deadline(self, deadline: Optional[Deadline]):
+        """Run all following operations within the time budget of a job, and stop them when it is cancelled"""
+        self.deadline = deadline
+        self.command_interface.set_deadline(deadline)
+
+    def _check_deadline(self):
+        if self.deadline:
+            self.deadline.check()
+
+    def _retry(self, operation: str, attempt, confirm=None, name: str = 'command') -> bool:
+        policy = self.retry_policies.get(operation, NO_RETRY)
+        if policy.attempts <= 1:
+            return attempt()
+        return run_with_retry(policy, self.command_interface.comms, attempt, confirm, name)
+
+    def _holds(self, tag: int, type: CredType, sha: Optional[str]) -> bool:
+        """Check if the device holds the credential, with the given SHA if not None"""
+        exists, device_sha = self.command_interface.check_credential_exists(tag, type.value, get_hash=sha is not None)
+        return exists and (sha is None or device_sha == sha)
+
+    def _journal_confirmed(self, step: str, tag: int, type: CredType, sha: Optional[str]) -> bool:
+        """Check if a journaled step is done and the device still holds the expected credential"""
+        if not self.journal:
+            return False
+        record = self.journal.completed(step)
+        if not record or sha is None or record.get('sha') != sha:
+            return False
+        exists, device_sha = self.command_interface.check_credential_exists(tag, type.value)
+        if exists and device_sha == sha:
+            logger.info(f'Skipping {step}, already confirmed by journal')
+            return True
+        return False
 
     def func_mode(self, mode):
         """Set modem functioning mode
@@ -36,7 +116,9 @@ class CredStore:
         See AT Command Reference Guide for valid modes.
         """
 
-        return self.command_interface.at_command(f'AT+CFUN={mode}', wait_for_result=True)
+        return self._retry(RETRY_QUERY,
+            lambda: self.command_interface.at_command(f'AT+CFUN={mode}', wait_for_result=True),
+            name=f'AT+CFUN={mode}')
 
     def list(self, tag = None, type: CredType = CredType.ANY) -> List[Credential]:
         """List stored credentials
@@ -57,54 +139,243 @@ class CredStore:
             if type != CredType.ANY:
                 cmd = f'{cmd},{CredType(type).value}'
 
-        self.command_interface.at_command(cmd, wait_for_result=False)
-        result, response = self.command_interface.comms.expect_response("OK", "ERROR", "%CMNG: ")
-        if not result:
-            raise RuntimeError("Failed to list credentials")
-        response_lines = response.splitlines()
-        response_lines = [line.strip() for line in response_lines if line.strip()]
+        response = ''
+        def attempt():
+            nonlocal response
+            with self.command_interface.comms.transaction():
+                self.command_interface.at_command(cmd, wait_for_result=False)
+                result, response = self.command_interface.comms.expect_response("OK", "ERROR", "%CMNG: ")
+            return result
 
-        columns = map(lambda line: line.replace('%CMNG: ', '').replace('"', '').split(','), response_lines)
-        cred_map = map(lambda columns:
-                Credential(int(columns[0]), int(columns[1]), columns[2].strip()),
-                columns
-            )
+        if not self._retry(RETRY_QUERY, attempt, name=cmd):
+            raise RuntimeError("Failed to list credentials")
 
-        return list(cred_map)
+        return parse_credentials(response)
 
-    def write(self, tag: int, type: CredType, file: io.TextIOBase):
+    def write(self, tag: int, type: CredType, file: io.TextIOBase, verify: bool = False) -> WriteResult:
         """Write a credential file to the modem
 
         type can not be ANY.
+
+        With verify, the credential is read back with a tag and type scoped AT%CMNG=1 right
+        after the write, and its SHA is compared with the digest of the local file.
         """
 
         if type == CredType.ANY:
             raise ValueError
-        cert = file.read().rstrip()
-        if not self.command_interface.at_command(f'AT%CMNG=0,{tag},{type.value},"{cert}"', wait_for_result=True):
+        cred = load_credential(file)
+        step = f'write:{tag}:{type.value}'
+        sha = None
+        if self.journal or verify:
+            sha = self.command_interface.expected_hash_for_file(cred)
+        if self.journal:
+            if self._journal_confirmed(step, tag, type, sha):
+                return WriteResult.VERIFIED
+            self.journal.plan(step, sha=sha)
+
+        def confirm():
+            # A write that lost its OK is done if the device holds the same credential
+            nonlocal sha
+            if sha is None:
+                sha = self.command_interface.expected_hash_for_file(cred)
+            return self._holds(tag, type, sha)
+
+        if not self._retry(RETRY_WRITE,
+                lambda: self.command_interface.at_command_with_payload(
+                    f'AT%CMNG=0,{tag},{type.value},"', cred.data, '"', wait_for_result=True),
+                confirm, name=step):
             raise RuntimeError("Failed to write credential")
+        result = WriteResult.WRITTEN
+        if verify:
+            exists, device_sha = self.command_interface.check_credential_exists(tag, type.value)
+            if not exists or device_sha != sha:
+                logger.error(f'Credential hash mismatch in secure tag {tag}: expected {sha}, got {device_sha}')
+                return WriteResult.MISMATCH
+            result = WriteResult.VERIFIED
+        self._mark_used(tag)
+        if self.journal:
+            self.journal.complete(step, sha=sha)
+        return result
+
+    def used_tags(self, refresh: bool = False) -> List[int]:
+        """Sorted secure tags that hold a credential, reserved tags included
+
+        The index is built from one AT%CMNG=1 listing and then maintained locally.
+        """
+        if self._tag_index is None or refresh:
+            self._tag_index = sorted({c.tag for c in self.list()} | RESERVED_TAGS)
+        return self._tag_index
 
-    def delete(self, tag: int, type: CredType):
+    def _mark_used(self, tag: int):
+        if self._tag_index is not None:
+            i = bisect.bisect_left(self._tag_index, tag)
+            if i == len(self._tag_index) or self._tag_index[i] != tag:
+                self._tag_index.insert(i, tag)
+
+    def allocate_tags(self, n: int, tag_range: Tuple[int, int] = DEFAULT_TAG_RANGE) -> List[int]:
+        """Return the n lowest free secure tags in tag_range (inclusive), and mark them as used
+
+        Raises ValueError if tag_range is not within DEFAULT_TAG_RANGE, which keeps the reserved
+        Nordic tags out, and RuntimeError if the range does not have n free tags.
+        """
+        low, high = tag_range
+        if not DEFAULT_TAG_RANGE[0] <= low <= high <= DEFAULT_TAG_RANGE[1]:
+            raise ValueError(f'Invalid tag range {low}-{high}, must be within {DEFAULT_TAG_RANGE[0]}-{DEFAULT_TAG_RANGE[1]}')
+        used = self.used_tags()
+        tags = []
+        candidate = low
+        i = bisect.bisect_left(used, low)
+        while len(tags) < n and candidate <= high:
+            if i < len(used) and used[i] == candidate:
+                i += 1
+            else:
+                tags.append(candidate)
+            candidate += 1
+        if len(tags) < n:
+            raise RuntimeError(f'Only {len(tags)} free secure tags in {low}-{high}, {n} needed')
+        for tag in tags:
+            self._mark_used(tag)
+        return tags
+
+    def export_inventory(self, path: str, device_id) -> List[Credential]:
+        """Append a snapshot of all stored credentials to an inventory file"""
+        # Imported here to avoid a circular import, inventory uses this module
+        from nrfcredstore.inventory import write_snapshot
+        creds = self.list()
+        write_snapshot(path, device_id, ((c.tag, c.type.value, c.sha) for c in creds))
+        return creds
+
+    def delete(self, tag: int, type: CredType) -> bool:
         """Delete a credential from the modem
 
-        type can not be ANY.
+        type can not be ANY. Returns True, failures raise RuntimeError.
         """
 
         if type == CredType.ANY:
             raise ValueError
-        if not self.command_interface.at_command(f'AT%CMNG=3,{tag},{type.value}', wait_for_result=True):
+        step = f'delete:{tag}:{type.value}'
+        if self.journal:
+            if self.journal.completed(step):
+                exists, _ = self.command_interface.check_credential_exists(tag, type.value, get_hash=False)
+                if not exists:
+                    logger.info(f'Skipping {step}, already confirmed by journal')
+                    return True
+            self.journal.plan(step)
+        if not self._retry(RETRY_DELETE,
+                lambda: self.command_interface.at_command(f'AT%CMNG=3,{tag},{type.value}', wait_for_result=True),
+                lambda: not self._holds(tag, type, None), name=step):
             raise RuntimeError("Failed to delete credential")
+        # The tag may still hold credentials of other types
+        self._tag_index = None
+        if self.journal:
+            self.journal.complete(step)
+        return True
+
+    def supports_concatenation(self) -> bool:
+        """Probe once whether the AT client accepts concatenated commands"""
+        if self._concat_supported is None:
+            self._concat_supported = bool(self.command_interface.at_command(
+                'AT+CFUN?;+CMEE?', wait_for_result=True, suppress_errors=True))
+        return self._concat_supported
+
+    def _concat_batches(self, creds: List[Credential]):
+        batch, length = [], len('AT')
+        for c in creds:
+            cmd = f'%CMNG=3,{c.tag},{c.type.value}'
+            if batch and length + len(cmd) + 1 > AT_CONCAT_MAX_LEN:
+                yield batch
+                batch, length = [], len('AT')
+            batch.append(c)
+            length += len(cmd) + 1
+        if batch:
+            yield batch
+
+    def delete_many(self, creds: List[Credential]) -> List[Tuple[Credential, bool]]:
+        """Delete several credentials, skipping reserved tags
+
+        Deletes are sent as concatenated AT commands when the AT client supports it.
+        Otherwise, or if a batch fails, credentials are deleted one by one.
+
+        Returns a list of (credential, deleted) tuples.
+        """
+
+        creds = [c for c in creds if c.tag not in RESERVED_TAGS and c.type != CredType.ANY]
+        self._tag_index = None
+        retry = creds
+        results = []
+        if len(creds) > 1 and self.supports_concatenation():
+            retry = []
+            for batch in self._concat_batches(creds):
+                cmd = 'AT' + ';'.join(f'%CMNG=3,{c.tag},{c.type.value}' for c in batch)
+                if self.command_interface.at_command(cmd, wait_for_result=True, suppress_errors=True):
+                    results.extend((c, True) for c in batch)
+                    continue
+                # Commands before the failing one were executed, check what is left
+                present = {(c.tag, c.type) for c in self.list()}
+                for c in batch:
+                    if (c.tag, c.type) in present:
+                        retry.append(c)
+                    else:
+                        results.append((c, True))
+        for c in retry:
+            self._check_deadline()
+            try:
+                self.delete(c.tag, c.type)
+                results.append((c, True))
+            except RuntimeError:
+                results.append((c, False))
+        return results
 
-    def keygen(self, tag: int, file: io.BufferedIOBase, attributes: str = ''):
-        """Generate a new private key and return a certificate signing request in DER format"""
+    def _keygen_output(self, tag: int, attributes: str) -> str:
+        step = f'keygen:{tag}'
+        if self.journal:
+            record = self.journal.completed(step)
+            if record and self._journal_confirmed(step, tag, CredType.CLIENT_KEY, record.get('sha')):
+                return record['csr']
+            self.journal.plan(step)
 
-        keygen_output = self.command_interface.get_csr(sectag=tag, attributes=attributes)
+        keygen_output = None
+        def attempt():
+            nonlocal keygen_output
+            keygen_output = self.command_interface.get_csr(sectag=tag, attributes=attributes)
+            return bool(keygen_output)
 
+        self._retry(RETRY_KEYGEN, attempt, name=step)
         if not keygen_output:
             raise RuntimeError("Failed to generate key")
 
-        csr_der_b64 = keygen_output.split('.')[0]
-        csr_der_bytes = base64.urlsafe_b64decode(csr_der_b64 + '===')
+        self._mark_used(tag)
+        if self.journal:
+            _, sha = self.command_interface.check_credential_exists(tag, CredType.CLIENT_KEY.value)
+            self.journal.complete(step, sha=sha, csr=keygen_output)
+        return keygen_output
+
+    def keygen(self, tag: int, file: io.BufferedIOBase, attributes: str = '', csr_format: str = FORMAT_DER) -> bytes:
+        """Generate a new private key and write a certificate signing request to file
+
+        csr_format is FORMAT_DER or FORMAT_PEM. The file is left open for the caller.
+        Returns the COSE signature of the CSR, or b'' if the modem did not return one.
+
+        With a journal, a confirmed keygen is not repeated. The CSR stored in the journal is
+        written instead, as long as the device still holds the same private key.
+        """
+
+        keygen_output = self._keygen_output(tag, attributes)
+        csr_der_bytes, cose = split_keygen_output(keygen_output)
+
+        file.write(der_to_pem(csr_der_bytes) if csr_format == FORMAT_PEM else csr_der_bytes)
+        return cose
+
+    def keygen_many(self, tags: List[int], writer: CSRWriter, device_id, attributes: str = '') -> Dict[int, Dict[str, str]]:
+        """Generate private keys for several secure tags in one session
+
+        Each CSR (DER and COSE) is handed to writer as soon as it is generated.
+        Returns a mapping of tag to the files written.
+        """
 
-        file.write(csr_der_bytes)
-        file.close()
+        files = {}
+        for tag in tags:
+            self._check_deadline()
+            der, cose = split_keygen_output(self._keygen_output(tag, attributes))
+            files[tag] = writer.add(device_id, tag, der, cose)
+        return files
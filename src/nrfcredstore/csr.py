@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Helpers for certificate signing requests generated with AT%KEYGEN.
+# The modem returns "body.cose", where body is the base64url encoded CSR in DER format and
+# cose is the base64url encoded COSE signature of the body.
+# Run as "python -m nrfcredstore.csr" to convert captured %KEYGEN outputs in bulk. The CSRs are
+# read with a minimal DER parser, so no openssl is needed for the subject and public key.
+
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import zipfile
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from nrfcredstore.output import OUTPUT_FORMATS, OUTPUT_TABLE, create_writer
+from nrfcredstore.parser import parse_keygen
+
+logger = logging.getLogger(__name__)
+
+CSR_INDEX_NAME = 'index.jsonl'
+
+FORMAT_DER = 'der'
+FORMAT_PEM = 'pem'
+CSR_FORMATS = [FORMAT_DER, FORMAT_PEM]
+
+PEM_CSR_LABEL = 'CERTIFICATE REQUEST'
+PEM_PUBLIC_KEY_LABEL = 'PUBLIC KEY'
+
+# Short names of the subject attributes used in device certificates
+OID_NAMES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+}
+
+DER_SEQUENCE = 0x30
+DER_BIT_STRING = 0x03
+DER_OID = 0x06
+DER_BMP_STRING = 0x1e
+
+class CSRInfo(NamedTuple):
+    subject: str
+    # SubjectPublicKeyInfo in DER, and the key itself as hex
+    public_key_der: bytes
+    public_key: str
+
+def b64url_decode(data: str) -> bytes:
+    # The modem strips base64 padding
+    return base64.urlsafe_b64decode(data + '===')
+
+def split_keygen_output(keygen_output: str) -> Tuple[bytes, bytes]:
+    """Decode a %KEYGEN blob into (DER, COSE). COSE is empty if not present."""
+    body, _, cose = keygen_output.strip().partition('.')
+    return b64url_decode(body), b64url_decode(cose) if cose else b''
+
+def der_to_pem(der: bytes, label: str = PEM_CSR_LABEL) -> bytes:
+    body = base64.b64encode(der)
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    return b'\n'.join([f'-----BEGIN {label}-----'.encode('ascii'), *lines,
+                       f'-----END {label}-----'.encode('ascii'), b''])
+
+def _der_item(data: bytes, pos: int, expected_tag: Optional[int] = None) -> Tuple[int, int, int]:
+    """Return (tag, content start, content end) of the DER item at pos"""
+    if pos + 2 > len(data):
+        raise ValueError('Truncated DER')
+    tag, length = data[pos], data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    if pos + length > len(data):
+        raise ValueError('Truncated DER')
+    if expected_tag is not None and tag != expected_tag:
+        raise ValueError(f'Expected DER tag {expected_tag:#x}, got {tag:#x}')
+    return tag, pos, pos + length
+
+def _decode_oid(data: bytes) -> str:
+    arcs, value = [], 0
+    for byte in data:
+        value = value << 7 | byte & 0x7f
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    if not arcs:
+        raise ValueError('Empty OID')
+    first = min(arcs[0] // 40, 2)
+    return '.'.join(str(arc) for arc in [first, arcs[0] - 40 * first, *arcs[1:]])
+
+def _decode_name(data: bytes, pos: int, end: int) -> str:
+    # Name is a SEQUENCE of SETs of (OID, value) SEQUENCEs
+    parts = []
+    while pos < end:
+        _, set_pos, set_end = _der_item(data, pos)
+        pos = set_end
+        while set_pos < set_end:
+            _, attr_pos, set_pos = _der_item(data, set_pos, DER_SEQUENCE)
+            _, oid_pos, oid_end = _der_item(data, attr_pos, DER_OID)
+            tag, value_pos, value_end = _der_item(data, oid_end)
+            oid = _decode_oid(data[oid_pos:oid_end])
+            value = data[value_pos:value_end]
+            text = value.decode('utf-16-be' if tag == DER_BMP_STRING else 'utf-8', errors='replace')
+            parts.append(f'{OID_NAMES.get(oid, oid)}={text}')
+    return ','.join(parts)
+
+def parse_csr(der: bytes) -> CSRInfo:
+    """Extract the subject and public key of a PKCS#10 CSR in DER format
+
+    Raises ValueError if the CSR is malformed. The signature is not verified.
+    """
+    _, pos, _ = _der_item(der, 0, DER_SEQUENCE)
+    _, pos, _ = _der_item(der, pos, DER_SEQUENCE)
+    # version INTEGER
+    _, _, pos = _der_item(der, pos)
+    _, name_pos, name_end = _der_item(der, pos, DER_SEQUENCE)
+    key_start = name_end
+    _, key_pos, key_end = _der_item(der, key_start, DER_SEQUENCE)
+    # AlgorithmIdentifier, then the key as BIT STRING with the number of unused bits first
+    _, _, alg_end = _der_item(der, key_pos, DER_SEQUENCE)
+    _, bits_pos, bits_end = _der_item(der, alg_end, DER_BIT_STRING)
+    return CSRInfo(_decode_name(der, name_pos, name_end), der[key_start:key_end],
+                   der[bits_pos + 1:bits_end].hex())
+
+class CSRWriter:
+    def __init__(self, path: str, formats: Sequence[str] = (FORMAT_DER,)):
+        """Store CSRs of many devices in a directory or a zip archive
+
+        Files are named <device id>/<tag>.der, <device id>/<tag>.pem and <device id>/<tag>.cose.
+        An index with one JSON line per CSR is appended to index.jsonl inside the directory, or
+        next to the archive as <archive>.index.jsonl. Read it with load_csr_index().
+
+        Several processes can write to the same directory. An archive is rewritten on close, with
+        entries of the same name replaced, so it must only be written by one process at a time.
+
+        Args:
+            path: Output directory, or a path ending in .zip for a single archive.
+            formats: CSR formats to write, der and/or pem.
+        """
+        self.path = path
+        self.formats = formats
+        self._zip = None
+        self._zip_names = set()
+        self._index_lines: List[str] = []
+        if path.endswith('.zip'):
+            self._zip = zipfile.ZipFile(path + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED)
+            self.index_path = path[:-len('.zip')] + '.' + CSR_INDEX_NAME
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.index_path = os.path.join(path, CSR_INDEX_NAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_file(self, name: str, data: bytes):
+        if self._zip:
+            self._zip.writestr(name, data)
+            self._zip_names.add(name)
+        else:
+            full_path = os.path.join(self.path, name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                f.write(data)
+
+    def add(self, device_id: Union[str, int], tag: int, der: bytes, cose: bytes = b'') -> Dict[str, str]:
+        """Write the CSR of one secure tag and return the file names used"""
+        device_id = str(device_id)
+        files = {}
+        if FORMAT_DER in self.formats:
+            files['der'] = f'{device_id}/{tag}.der'
+            self._write_file(files['der'], der)
+        if FORMAT_PEM in self.formats:
+            files['pem'] = f'{device_id}/{tag}.pem'
+            self._write_file(files['pem'], der_to_pem(der))
+        if cose:
+            files['cose'] = f'{device_id}/{tag}.cose'
+            self._write_file(files['cose'], cose)
+        self._index_lines.append(json.dumps({'device': device_id, 'tag': tag, 'files': files}) + '\n')
+        return files
+
+    def _close_zip(self):
+        # Copy the entries of the previous archive that were not written again
+        if os.path.exists(self.path):
+            with zipfile.ZipFile(self.path) as old:
+                for info in old.infolist():
+                    if info.filename not in self._zip_names:
+                        self._zip.writestr(info, old.read(info))
+        self._zip.close()
+        self._zip = None
+        os.replace(self.path + '.tmp', self.path)
+
+    def close(self):
+        if self._zip:
+            self._close_zip()
+        if not self._index_lines:
+            return
+        # A single O_APPEND write keeps lines intact when fleet workers share the index
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ''.join(self._index_lines).encode('utf-8'))
+        finally:
+            os.close(fd)
+        self._index_lines = []
+
+def load_csr_index(path: str) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """Read a CSR index into device id -> tag -> files. Later lines replace earlier ones."""
+    index: Dict[str, Dict[str, Dict[str, str]]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                index.setdefault(record['device'], {})[str(record['tag'])] = record['files']
+            except (ValueError, KeyError, TypeError):
+                # A torn last line is expected if a run was interrupted during an append
+                logger.debug(f'Ignoring corrupt CSR index line: {line!r}')
+    return index
+
+KeygenOutput = Tuple[Optional[str], Optional[int], str]
+
+def parse_keygen_line(line: str) -> Optional[KeygenOutput]:
+    """Parse one line of captured %KEYGEN output into (device id, tag, "body.cose")
+
+    The line can hold a %KEYGEN response, a bare "body.cose" blob, or a JSON record with a "csr"
+    field, like the keygen steps of a provisioning journal. Device id and tag are None if the
+    line does not say. Returns None for lines without a CSR, raises ValueError if malformed.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    device, tag = None, None
+    if line.startswith('{'):
+        record = json.loads(line)
+        if not isinstance(record, dict) or 'csr' not in record:
+            return None
+        device, blob = record.get('device'), record['csr']
+        tag = record.get('tag')
+        if tag is None and record.get('step', '').startswith('keygen:'):
+            tag = int(record['step'].partition(':')[2])
+    elif '%KEYGEN' in line:
+        parsed = parse_keygen(line)
+        if parsed is None:
+            raise ValueError(f'Malformed %KEYGEN output: {line}')
+        blob = parsed.blob
+    else:
+        blob = line.strip('"')
+    return device, tag, blob
+
+def iter_keygen_outputs(lines: Iterable[str]) -> Iterator[KeygenOutput]:
+    """Yield (device id, tag, "body.cose") for each line with a CSR, see parse_keygen_line"""
+    for line in lines:
+        output = parse_keygen_line(line)
+        if output:
+            yield output
+
+def process_keygen_outputs(lines: Iterable[str], writer: Optional[CSRWriter] = None) -> Iterator[dict]:
+    """Decode captured %KEYGEN outputs, write them with writer and yield a record per CSR
+
+    Outputs without a device id are stored as device "unknown", numbered in input order.
+    A malformed output gives a record with an "error" field, and processing goes on.
+    """
+    n = 0
+    for line in lines:
+        device, tag = None, None
+        try:
+            output = parse_keygen_line(line)
+            if output is None:
+                continue
+            device, tag, blob = output
+            der, cose = split_keygen_output(blob)
+            info = parse_csr(der)
+        except ValueError as e:
+            yield {'device': device or 'unknown', 'tag': n if tag is None else tag, 'error': str(e)}
+            n += 1
+            continue
+        device = device or 'unknown'
+        tag = n if tag is None else tag
+        n += 1
+        record = {'device': device, 'tag': tag, 'subject': info.subject, 'public_key': info.public_key}
+        if writer:
+            record.update(writer.add(device, tag, der, cose))
+        yield record
+
+def _read_lines(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from f
+
+def parse_args(in_args):
+    parser = argparse.ArgumentParser(description='Convert captured %KEYGEN outputs to CSR files.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('files', nargs='+',
+        help='Files with %%KEYGEN outputs, one per line, or provisioning journals. Use "-" for stdin.')
+    parser.add_argument('--output-dir', type=str,
+        help='Directory, or .zip archive, to store the CSRs and COSE signatures in. '
+             'Without it, only the subject and public key are printed.')
+    parser.add_argument('--format', dest='csr_formats', choices=CSR_FORMATS + ['both'], default=FORMAT_DER,
+        help='CSR file format')
+    parser.add_argument('--output', dest='output_format', choices=OUTPUT_FORMATS, default=OUTPUT_TABLE,
+        help='Output format')
+    return parser.parse_args(in_args)
+
+def main(argv=sys.argv[1:]) -> int:
+    args = parse_args(argv)
+    formats = CSR_FORMATS if args.csr_formats == 'both' else [args.csr_formats]
+    csr_writer = CSRWriter(args.output_dir, formats) if args.output_dir else None
+    fields = ['device', 'tag', 'subject', 'public_key', FORMAT_DER, FORMAT_PEM, 'cose', 'error']
+    writer = create_writer(args.output_format, fields=fields) if args.output_format != OUTPUT_TABLE else None
+    table_format = "{:<20} {:<12} {:<60}"
+    if not writer:
+        print(table_format.format('Device', 'Secure tag', 'Subject'))
+    count, failed = 0, 0
+    try:
+        # Numbering of outputs without a tag runs across all inputs
+        for record in process_keygen_outputs(_read_lines(args.files), csr_writer):
+            if 'error' in record:
+                failed += 1
+            else:
+                count += 1
+            if writer:
+                writer.write(record)
+            elif 'error' in record:
+                print(table_format.format(record['device'], record['tag'], f'error: {record["error"]}'))
+            else:
+                print(table_format.format(record['device'], record['tag'], record['subject']))
+    finally:
+        if csr_writer:
+            csr_writer.close()
+        if writer:
+            writer.close()
+    if not writer and csr_writer:
+        print(f'Wrote {count} CSRs to {args.output_dir}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Job deadline and cooperative cancellation.
+# A Deadline is shared by all operations of one job. Every wait in Comms is capped by the time
+# left, and wakes up as soon as the job is cancelled from another thread.
+
+import threading
+import time
+from typing import Callable, List, Optional
+
+from nrfcredstore.exceptions import DeadlineExceededError, JobCancelledError
+
+class Deadline:
+    def __init__(self, timeout: Optional[float] = None):
+        """Time budget and cancellation token of a job
+
+        Args:
+            timeout: Seconds the job may take in total. None for no limit, only cancellation.
+        """
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel the job. Waits return immediately and blocking reads are aborted."""
+        self._cancelled.set()
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Call callback when the job is cancelled, for example to abort a blocking read"""
+        with self._lock:
+            self._callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def remove_on_cancel(self, callback: Callable[[], None]):
+        with self._lock:
+            self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a time limit"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        """Raise if the job is cancelled or out of time"""
+        if self.cancelled:
+            raise JobCancelledError('Job cancelled')
+        if self.expires is not None and time.monotonic() >= self.expires:
+            raise DeadlineExceededError(f'Job did not finish within {self.timeout} s')
+
+    def budget(self, timeout: float) -> float:
+        """The given per-command timeout, capped by the time left"""
+        self.check()
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def wait(self, seconds: float):
+        """Sleep up to seconds, raising as soon as the job is cancelled or out of time"""
+        self._cancelled.wait(self.budget(seconds))
+        self.check()
@@ -3,3 +3,9 @@ class NoATClientException(Exception):
 
 class ATCommandError(Exception):
     'Raised when an AT command responds with ERROR'
+
+class DeadlineExceededError(TimeoutError):
+    'Raised when the time budget of a job runs out'
+
+class JobCancelledError(Exception):
+    'Raised when a job is cancelled from another thread'
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Fleet runner: run the same nrfcredstore command on many devices in parallel.
+# Every device gets its own worker process and log file, so J-Link sessions and the GIL are not
+# shared, and a crashing or hung board is terminated without stalling the rest of the fleet.
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from nrfcredstore.comms import get_connected_jlinks, get_connected_nordic_boards
+from nrfcredstore.output import OUTPUT_TABLE, RecordWriter
+
+logger = logging.getLogger(__name__)
+
+FLEET_DEV_SERIAL = 'all'
+FLEET_DEV_RTT = 'all-rtt'
+FLEET_DEVS = [FLEET_DEV_SERIAL, FLEET_DEV_RTT]
+
+# Seconds before a worker is killed if neither --fleet-timeout nor --job-timeout is given
+DEFAULT_DEVICE_TIMEOUT = 600
+# Time a worker gets on top of --job-timeout to open the device, report and exit
+JOB_TIMEOUT_MARGIN = 30
+
+def fleet_devices(rtt: bool) -> List[str]:
+    """Device arguments for all connected Nordic boards, or all J-Links for RTT"""
+    if rtt:
+        return [str(serial) for serial in get_connected_jlinks()]
+    return [port.device for _, _, port in get_connected_nordic_boards()]
+
+def log_file_name(dev: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', dev.strip('/')) + '.log'
+
+def device_timeout_for(job_timeout: Optional[float]) -> float:
+    """Worker timeout for a job budget, so a hung board is killed shortly after its budget is used up"""
+    if job_timeout:
+        return job_timeout + JOB_TIMEOUT_MARGIN
+    return DEFAULT_DEVICE_TIMEOUT
+
+class QueueWriter(RecordWriter):
+    """Sends the records of a worker to the parent process, which writes them in the requested format"""
+    def __init__(self, dev: str, results):
+        super().__init__()
+        self.dev = dev
+        self.results = results
+
+    def write(self, record: dict):
+        self.results.put({'device': self.dev, 'record': record})
+
+    def close(self):
+        pass
+
+def run_cli_worker(dev: str, argv: List[str], log_path: str, results):
+    """Worker process entry: run the CLI for one device with output sent to its log file
+
+    Records for --output are put on the results queue, ahead of the result of the device.
+    """
+    result = {'device': dev, 'ok': False, 'error': None}
+    with open(log_path, 'a', encoding='utf-8') as log:
+        sys.stdout = log
+        sys.stderr = log
+        handler = logging.StreamHandler(log)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logging.basicConfig(level=logging.DEBUG if '--debug' in argv else logging.INFO,
+                            handlers=[handler], force=True)
+        try:
+            # Imported here to avoid a circular import, cli uses this module
+            from nrfcredstore.cli import parse_args, run_device
+            args = parse_args(argv[1:])
+            args.dev = dev
+            if args.output_format != OUTPUT_TABLE:
+                args.record_writer = QueueWriter(dev, results)
+            if args.trace:
+                args.trace = os.path.splitext(log_path)[0] + '.trace'
+            run_device(args)
+            result['ok'] = True
+        except BaseException as e:
+            traceback.print_exc(file=log)
+            result['error'] = repr(e)
+        log.flush()
+    results.put(result)
+
+class FleetReport:
+    def __init__(self, results: List[dict], duration: float):
+        self.results = results
+        self.duration = duration
+
+    @property
+    def failed(self) -> List[dict]:
+        return [r for r in self.results if not r['ok']]
+
+    def summary(self) -> dict:
+        succeeded = len(self.results) - len(self.failed)
+        return {
+            'devices': len(self.results),
+            'succeeded': succeeded,
+            'failed': len(self.failed),
+            'duration': round(self.duration, 3),
+            'devices_per_minute': round(len(self.results) * 60 / self.duration, 2) if self.duration else 0,
+            'failures': {r['device']: r['error'] for r in self.failed},
+            'results': self.results,
+        }
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+
+class FleetRunner:
+    def __init__(self, argv: List[str], log_dir: str,
+                 device_timeout: Optional[float] = DEFAULT_DEVICE_TIMEOUT,
+                 target: Callable = run_cli_worker, mp_context=None,
+                 on_record: Optional[Callable[[dict], None]] = None):
+        """Start CLI worker processes for devices and collect their results
+
+        Args:
+            argv: Full CLI argument list. The dev argument is replaced per device.
+            log_dir: Directory for the per-device log files.
+            device_timeout: Seconds before a device is considered hung and its worker is killed.
+                None never kills a worker.
+            target: Worker function, called as target(dev, argv, log_path, results).
+            mp_context: multiprocessing context. Defaults to spawn, which does not inherit an
+                already loaded J-Link DLL.
+            on_record: Called with every output record a worker sends, in the order they arrive.
+        """
+        self.argv = argv
+        self.log_dir = log_dir
+        self.device_timeout = device_timeout
+        self.target = target
+        self.on_record = on_record
+        self.ctx = mp_context or multiprocessing.get_context('spawn')
+        self.results_queue = self.ctx.Queue()
+        self.running: Dict[str, tuple] = {}
+        self._finished: Dict[str, dict] = {}
+        os.makedirs(log_dir, exist_ok=True)
+
+    def start(self, dev: str, name: Optional[str] = None):
+        """Start the worker for a device. Its log file is named after name, or the device.
+
+        Raises RuntimeError if the device still has a running worker.
+        """
+        if dev in self.running:
+            raise RuntimeError(f'{dev} already has a running job')
+        log_path = os.path.join(self.log_dir, log_file_name(name or dev))
+        proc = self.ctx.Process(target=self.target, args=(dev, self.argv, log_path, self.results_queue),
+                                daemon=True)
+        proc.start()
+        self.running[dev] = (proc, time.time(), log_path)
+        logger.info(f'Started {dev}')
+
+    def _collect(self):
+        while True:
+            try:
+                result = self.results_queue.get_nowait()
+            except queue.Empty:
+                return
+            if 'record' in result:
+                if self.on_record:
+                    self.on_record(result['record'])
+                continue
+            self._finished[result['device']] = result
+
+    def poll(self) -> List[dict]:
+        """Return the results of workers that finished, crashed or timed out since the last poll"""
+        done = []
+        self._collect()
+        for dev, (proc, started, log_path) in list(self.running.items()):
+            elapsed = time.time() - started
+            if proc.is_alive():
+                if self.device_timeout is None or elapsed < self.device_timeout:
+                    continue
+                proc.kill()
+                proc.join()
+                result = {'device': dev, 'ok': False, 'error': f'Timed out after {self.device_timeout} s'}
+            else:
+                proc.join()
+                self._collect()
+                result = self._finished.pop(dev, None) or {
+                    'device': dev, 'ok': False, 'error': f'Worker exited with code {proc.exitcode}'}
+            result['duration'] = round(elapsed, 3)
+            result['log'] = log_path
+            del self.running[dev]
+            logger.info(f'Finished {dev}: {"ok" if result["ok"] else result["error"]}')
+            done.append(result)
+        return done
+
+def run_fleet(devices: List[str], argv: List[str], log_dir: str, jobs: Optional[int] = None,
+              device_timeout: Optional[float] = DEFAULT_DEVICE_TIMEOUT, target: Callable = run_cli_worker,
+              mp_context=None, on_record: Optional[Callable[[dict], None]] = None) -> FleetReport:
+    """Run the CLI for every device in its own process
+
+    Args:
+        devices: Device arguments (serial ports or J-Link serial numbers).
+        jobs: Maximum number of devices processed in parallel. Defaults to all devices.
+        Other arguments are passed to FleetRunner.
+    """
+    runner = FleetRunner(argv, log_dir, device_timeout, target, mp_context, on_record)
+    jobs = jobs or len(devices) or 1
+    pending = list(devices)
+    finished: Dict[str, dict] = {}
+    start = time.time()
+
+    while pending or runner.running:
+        while pending and len(runner.running) < jobs:
+            runner.start(pending.pop(0))
+        for result in runner.poll():
+            finished[result['device']] = result
+        time.sleep(0.05)
+
+    return FleetReport([finished[dev] for dev in devices], time.time() - start)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Credential inventory snapshots and cross-device comparison.
+# A snapshot file holds one line per device: {"device": ..., "creds": [[tag, type, sha], ...]}.
+# Snapshots are indexed by (tag, type) -> SHA -> devices, so outliers among thousands of devices
+# are found in a single pass over the index.
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from nrfcredstore.credstore import CredType, RESERVED_TAGS
+from nrfcredstore.output import OUTPUT_FORMATS, OUTPUT_TABLE, create_writer
+
+ISSUE_MISMATCH = 'mismatch'
+ISSUE_MISSING = 'missing'
+ISSUE_UNEXPECTED = 'unexpected'
+
+CredKey = Tuple[int, int]
+
+def write_snapshot(path: str, device_id: Union[str, int], creds: Iterable[Tuple[int, int, str]]):
+    """Append the inventory of one device to a snapshot file"""
+    record = {'device': str(device_id), 'time': round(time.time()),
+              'creds': [[tag, int(type), sha] for tag, type, sha in creds]}
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    # A single O_APPEND write keeps lines intact when fleet workers share the file
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+class Inventory:
+    def __init__(self):
+        self.devices: Set[str] = set()
+        self.index: Dict[CredKey, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+
+    def add(self, device_id: Union[str, int], creds: Iterable[Tuple[int, int, str]]):
+        """Add the credentials of one device. A later snapshot of a device replaces earlier ones."""
+        device_id = str(device_id)
+        if device_id in self.devices:
+            self.remove(device_id)
+        self.devices.add(device_id)
+        for tag, type, sha in creds:
+            self.index[(tag, int(type))][sha].add(device_id)
+
+    def remove(self, device_id: str):
+        self.devices.discard(device_id)
+        for shas in self.index.values():
+            for devices in shas.values():
+                devices.discard(device_id)
+
+    def load(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.add(record['device'], record['creds'])
+
+    def expected(self) -> Dict[CredKey, str]:
+        """The SHA of every credential present on the majority of devices"""
+        result = {}
+        for key, shas in self.index.items():
+            sha, devices = max(shas.items(), key=lambda item: len(item[1]))
+            if len(devices) * 2 > len(self.devices):
+                result[key] = sha
+        return result
+
+    def compare(self, manifest: Optional[Dict[CredKey, str]] = None,
+                include_reserved: bool = False) -> List[dict]:
+        """Find devices that differ from a golden manifest, or from the majority of devices
+
+        Args:
+            manifest: Expected SHA per (tag, type). Defaults to the majority of devices.
+            include_reserved: Also compare the Nordic reserved tags, which hold device
+                specific keys.
+
+        Returns one record per device and credential that is missing, has another SHA than
+        expected, or is not expected at all.
+        """
+        expected = manifest if manifest is not None else self.expected()
+        issues = []
+        for key in sorted(set(self.index) | set(expected)):
+            tag, type = key
+            if tag in RESERVED_TAGS and not include_reserved:
+                continue
+            shas = self.index.get(key, {})
+            expected_sha = expected.get(key)
+            present: Set[str] = set()
+            for sha, devices in shas.items():
+                present |= devices
+                if expected_sha is None:
+                    issue = ISSUE_UNEXPECTED
+                elif sha != expected_sha:
+                    issue = ISSUE_MISMATCH
+                else:
+                    continue
+                issues += [self._issue(issue, device, key, sha, expected_sha) for device in devices]
+            if expected_sha is not None:
+                issues += [self._issue(ISSUE_MISSING, device, key, None, expected_sha)
+                           for device in self.devices - present]
+        issues.sort(key=lambda i: (i['tag'], i['type_value'], i['device']))
+        return issues
+
+    @staticmethod
+    def _issue(issue: str, device: str, key: CredKey, sha: Optional[str], expected: Optional[str]) -> dict:
+        return {'device': device, 'tag': key[0], 'type': CredType(key[1]).name, 'type_value': key[1],
+                'issue': issue, 'sha': sha, 'expected': expected}
+
+def load_manifest(path: str) -> Dict[CredKey, str]:
+    """Read a golden manifest, which is a snapshot file of one or more reference devices"""
+    manifest = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                for tag, type, sha in json.loads(line)['creds']:
+                    manifest[(tag, type)] = sha
+    return manifest
+
+def parse_args(in_args):
+    parser = argparse.ArgumentParser(description='Compare credential inventory snapshots of many devices.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('snapshots', nargs='+',
+        help='Snapshot files written by the inventory subcommand')
+    parser.add_argument('--manifest', type=str,
+        help='Snapshot of a reference device. By default, devices are compared with the majority.')
+    parser.add_argument('--include-reserved', action='store_true',
+        help='Also compare the reserved Nordic secure tags, which hold device specific keys')
+    parser.add_argument('--output', dest='output_format', choices=OUTPUT_FORMATS, default=OUTPUT_TABLE,
+        help='Output format')
+    return parser.parse_args(in_args)
+
+def main(argv=sys.argv[1:]) -> int:
+    args = parse_args(argv)
+    inventory = Inventory()
+    for path in args.snapshots:
+        inventory.load(path)
+    manifest = load_manifest(args.manifest) if args.manifest else None
+    issues = inventory.compare(manifest, args.include_reserved)
+    if args.output_format != OUTPUT_TABLE:
+        with create_writer(args.output_format) as writer:
+            for issue in issues:
+                writer.write(issue)
+    else:
+        table_format = "{:<20} {:<12} {:<18} {:<10} {:<64}"
+        print(table_format.format('Device', 'Secure tag', 'Key type', 'Issue', 'SHA'))
+        for i in issues:
+            print(table_format.format(i['device'], i['tag'], i['type'], i['issue'], i['sha'] or ''))
+        devices = {i['device'] for i in issues}
+        print(f'{len(devices)} of {len(inventory.devices)} devices differ')
+    return 1 if issues else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
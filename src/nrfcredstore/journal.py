@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Write-ahead journal for provisioning runs.
+# Every step is recorded as planned before it is sent to the device and as done once the
+# device confirmed it. A rerun after a crash or power loss can then skip confirmed steps.
+
+import json
+import os
+import time
+import logging
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+STEP_PLANNED = "planned"
+STEP_DONE = "done"
+
+class ProvisioningJournal:
+    def __init__(self, path: str, device_id: Union[str, int]):
+        """Open (or create) a journal file and load the steps recorded for one device
+
+        Args:
+            path: Journal file. The same file can be shared by many devices.
+            device_id: Device serial number or IMEI used as the journal key.
+        """
+        self.path = path
+        self.device_id = str(device_id)
+        self._steps: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line is expected if power was lost during an append
+                        logger.debug(f'Ignoring corrupt journal line: {line!r}')
+                        continue
+                    if record.get('device') != self.device_id:
+                        continue
+                    self._steps[record['step']] = record
+        except FileNotFoundError:
+            pass
+
+    def _append(self, record: dict):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        # A single O_APPEND write keeps lines intact when several processes share the file
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._steps[record['step']] = record
+
+    def _record(self, state: str, step: str, fields: dict):
+        record = {'device': self.device_id, 'step': step, 'state': state, 'time': time.time()}
+        record.update(fields)
+        self._append(record)
+
+    def plan(self, step: str, **fields):
+        """Record that a step is about to be sent to the device"""
+        self._record(STEP_PLANNED, step, fields)
+
+    def complete(self, step: str, **fields):
+        """Record that the device confirmed a step"""
+        self._record(STEP_DONE, step, fields)
+
+    def completed(self, step: str) -> Optional[dict]:
+        """Return the journal record of a confirmed step, or None"""
+        record = self._steps.get(step)
+        if record and record['state'] == STEP_DONE:
+            return record
+        return None
+
+    def pending(self) -> List[str]:
+        """Steps that were planned but never confirmed"""
+        return [step for step, record in self._steps.items() if record['state'] == STEP_PLANNED]
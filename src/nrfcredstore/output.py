@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Machine-readable output for CLI results.
+# Records are written and flushed one by one, so a pipeline reading the output of many devices
+# can consume it as a stream.
+
+import csv
+import json
+import sys
+from abc import ABC, abstractmethod
+from typing import IO, Optional, Sequence
+
+OUTPUT_TABLE = 'table'
+OUTPUT_JSON = 'json'
+OUTPUT_NDJSON = 'ndjson'
+OUTPUT_CSV = 'csv'
+OUTPUT_FORMATS = [OUTPUT_TABLE, OUTPUT_JSON, OUTPUT_NDJSON, OUTPUT_CSV]
+
+class RecordWriter(ABC):
+    def __init__(self, stream: Optional[IO[str]] = None):
+        self.stream = stream or sys.stdout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @abstractmethod
+    def write(self, record: dict):
+        """Write one record and flush it"""
+
+    def close(self):
+        self.stream.flush()
+
+class JSONWriter(RecordWriter):
+    """A single JSON array, written element by element"""
+    def __init__(self, stream: Optional[IO[str]] = None):
+        super().__init__(stream)
+        self._count = 0
+
+    def write(self, record: dict):
+        self.stream.write('[\n' if self._count == 0 else ',\n')
+        self.stream.write(json.dumps(record))
+        self.stream.flush()
+        self._count += 1
+
+    def close(self):
+        self.stream.write('[]\n' if self._count == 0 else '\n]\n')
+        super().close()
+
+class NDJSONWriter(RecordWriter):
+    """One JSON object per line"""
+    def write(self, record: dict):
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+class CSVWriter(RecordWriter):
+    """CSV with a header of the given fields, or of the keys of the first record
+
+    Fields missing in a record are left empty and fields not in the header are dropped, so a
+    record that differs from the first one does not end the stream.
+    """
+    def __init__(self, stream: Optional[IO[str]] = None, fields: Optional[Sequence[str]] = None):
+        super().__init__(stream)
+        self.fields = fields
+        self._writer = None
+
+    def write(self, record: dict):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self.stream, fieldnames=list(self.fields or record.keys()),
+                                          restval='', extrasaction='ignore', lineterminator='\n')
+            self._writer.writeheader()
+        self._writer.writerow(record)
+        self.stream.flush()
+
+def create_writer(fmt: str, stream: Optional[IO[str]] = None,
+                  fields: Optional[Sequence[str]] = None) -> RecordWriter:
+    """Writer for the output format. fields, all the record fields in order, sets the CSV header."""
+    if fmt == OUTPUT_JSON:
+        return JSONWriter(stream)
+    if fmt == OUTPUT_NDJSON:
+        return NDJSONWriter(stream)
+    if fmt == OUTPUT_CSV:
+        return CSVWriter(stream, fields)
+    raise ValueError(f'Unsupported output format: {fmt}')
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Parsers for AT command responses captured by Comms.expect_response.
+# Patterns are compiled once at import. Parsers scan the captured text in place and only
+# build the records that the caller asks for.
+
+import re
+from typing import Iterator, List, NamedTuple, Optional
+
+IMEI_LEN = 15
+
+CMNG_PATTERN = re.compile(r'%CMNG: *(\d+) *, *(\d+) *(?:, *"([^"]*)")?')
+KEYGEN_PATTERN = re.compile(r'%KEYGEN:\s*"([A-Za-z0-9_=-]*)(?:\.([A-Za-z0-9_=-]*))?"')
+ATTESTTOKEN_PATTERN = re.compile(r'%ATTESTTOKEN:\s*"([A-Za-z0-9_=-]*)(?:\.([A-Za-z0-9_=-]*))?"')
+IMEI_PATTERN = re.compile(r'(?<![0-9])([0-9]{15})(?![0-9])')
+CME_ERROR_PATTERN = re.compile(r'\+CME ERROR:\s*(\d+)')
+
+class CmngRecord(NamedTuple):
+    """One line of AT%CMNG=1 output"""
+    tag: int
+    type: int
+    sha: str
+
+class SignedBlob(NamedTuple):
+    """A "body.cose" response, as returned by %KEYGEN and %ATTESTTOKEN"""
+    body: str
+    cose: str
+
+    @property
+    def blob(self) -> str:
+        return f'{self.body}.{self.cose}' if self.cose else self.body
+
+class CmeError(NamedTuple):
+    code: int
+
+def iter_cmng(output: str) -> Iterator[CmngRecord]:
+    """Iterate over the credentials in AT%CMNG=1 output"""
+    for m in CMNG_PATTERN.finditer(output):
+        yield CmngRecord(int(m.group(1)), int(m.group(2)), m.group(3) or '')
+
+def parse_cmng(output: str) -> List[CmngRecord]:
+    """All credentials in AT%CMNG=1 output"""
+    make = CmngRecord._make
+    return [make((int(tag), int(type), sha)) for tag, type, sha in CMNG_PATTERN.findall(output)]
+
+def last_cmng(output: str) -> Optional[CmngRecord]:
+    """Last credential in AT%CMNG=1 output, or None if there is none"""
+    record = None
+    for record in iter_cmng(output):
+        pass
+    return record
+
+def _parse_signed_blob(pattern: re.Pattern, output: str) -> Optional[SignedBlob]:
+    m = pattern.search(output)
+    if m is None:
+        return None
+    return SignedBlob(m.group(1), m.group(2) or '')
+
+def parse_keygen(output: str) -> Optional[SignedBlob]:
+    """CSR from %KEYGEN output"""
+    return _parse_signed_blob(KEYGEN_PATTERN, output)
+
+def parse_attesttoken(output: str) -> Optional[SignedBlob]:
+    """Attestation token from %ATTESTTOKEN output"""
+    return _parse_signed_blob(ATTESTTOKEN_PATTERN, output)
+
+def parse_imei(output: str) -> Optional[str]:
+    """IMEI from AT+CGSN output, with or without the +CGSN: prefix"""
+    m = IMEI_PATTERN.search(output)
+    return m.group(1) if m else None
+
+def parse_cme_error(line: str) -> Optional[CmeError]:
+    m = CME_ERROR_PATTERN.match(line)
+    return CmeError(int(m.group(1))) if m else None
+
+def last_line(output: str) -> str:
+    """Last non-empty line of the output, stripped"""
+    end = len(output)
+    while end > 0:
+        start = output.rfind('\n', 0, end)
+        line = output[start + 1:end].strip()
+        if line:
+            return line
+        end = max(start, 0)
+    return ''
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Wall-clock phase timers and cProfile support for --profile.
+# Phases are always timed, which costs two perf_counter calls per phase. cProfile only runs
+# with --profile.
+
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+PROFILE_REPORT_LINES = 40
+
+class PhaseTimer:
+    def __init__(self):
+        """Accumulated wall-clock time per named phase, in the order phases first ran"""
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def reset(self):
+        self.phases.clear()
+
+    def report(self) -> str:
+        total = sum(self.phases.values())
+        lines = [f'{"Phase":<12} {"Seconds":>10} {"Share":>7}']
+        for name, seconds in self.phases.items():
+            share = seconds / total * 100 if total else 0
+            lines.append(f'{name:<12} {seconds:>10.3f} {share:>6.1f}%')
+        lines.append(f'{"total":<12} {total:>10.3f}')
+        return '\n'.join(lines)
+
+timer = PhaseTimer()
+
+def phase(name: str):
+    """Time a phase of the run: enumerate, open, detect, cfun, operation or close"""
+    return timer.phase(name)
+
+def profile_run(func: Callable, path: str):
+    """Run func under cProfile
+
+    The raw statistics are written to path, for pstats or snakeviz. A report with the phase
+    breakdown and the functions sorted by cumulative time is written to path.txt. Both are
+    written even if func raises.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        stream = io.StringIO()
+        stream.write(timer.report() + '\n\n')
+        pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_REPORT_LINES)
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(stream.getvalue())
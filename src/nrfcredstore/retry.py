@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Retry policies for transient link and modem errors.
+# A failed AT command is classified from how expect_response failed: a missing response or a
+# +CME ERROR code that clears by itself is transient, everything else is permanent. Retries wait
+# with exponential backoff and full jitter, so devices on a shared USB hub do not retry in step.
+
+import logging
+import random
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional
+
+from nrfcredstore.comms import ERR_CODE_TO_MSG
+
+logger = logging.getLogger(__name__)
+
+# +CME ERROR codes that are worth retrying. 518 (not allowed in active state) is returned while
+# the modem is still switching functional mode.
+TRANSIENT_CME_ERRORS = frozenset([518])
+
+RETRY_QUERY = 'query'
+RETRY_WRITE = 'write'
+RETRY_DELETE = 'delete'
+RETRY_KEYGEN = 'keygen'
+
+# Off by default: every retry of a command that got no response costs another --timeout
+DEFAULT_RETRIES = 0
+
+class RetryPolicy(NamedTuple):
+    """How often and when to retry one class of operations
+
+    attempts includes the first try. retry_on_timeout is only safe for operations that can be
+    repeated, or whose effect can be checked before repeating them.
+    """
+    attempts: int = 1
+    base_delay: float = 0.2
+    max_delay: float = 2.0
+    retry_on_timeout: bool = True
+    retry_codes: FrozenSet[int] = TRANSIENT_CME_ERRORS
+
+    def delay(self, retry: int, rand: Callable[[], float] = random.random) -> float:
+        """Seconds to wait before the given retry, counted from 0"""
+        return rand() * min(self.max_delay, self.base_delay * 2 ** retry)
+
+    def is_transient(self, error_code: Optional[int], timed_out: bool) -> bool:
+        """Check if a command that failed with error_code, or timed out, is worth retrying"""
+        if error_code is not None:
+            return error_code in self.retry_codes
+        return self.retry_on_timeout and timed_out
+
+NO_RETRY = RetryPolicy()
+
+def retry_policies(retries: int = DEFAULT_RETRIES) -> Dict[str, RetryPolicy]:
+    """Policies per operation class, each allowing the given number of retries
+
+    Queries, writes and deletes can be repeated after a timeout. Writes and deletes check the
+    credential first, so a command that succeeded but lost its OK is not sent again. A keygen
+    that timed out may have replaced the key already, so it is only retried on a modem error.
+    """
+    attempts = retries + 1
+    return {
+        RETRY_QUERY: RetryPolicy(attempts),
+        RETRY_WRITE: RetryPolicy(attempts),
+        RETRY_DELETE: RetryPolicy(attempts),
+        RETRY_KEYGEN: RetryPolicy(attempts, retry_on_timeout=False),
+    }
+
+def run_with_retry(policy: RetryPolicy, comms, attempt: Callable[[], bool],
+                   confirm: Optional[Callable[[], bool]] = None, name: str = 'command') -> bool:
+    """Call attempt until it returns True, or the failure is permanent or attempts run out
+
+    Args:
+        policy: Retry policy of the operation class.
+        comms: Comms of the device, to classify failures and to wait within the job deadline.
+        attempt: Sends the command, returns True on success.
+        confirm: Checks on the device if an attempt that timed out took effect anyway. A True
+            result ends the retries successfully.
+        name: Used in log messages.
+    """
+    for retry in range(policy.attempts):
+        if retry:
+            comms.wait(policy.delay(retry - 1))
+        # The failure is read in the same transaction, before another thread's command replaces it
+        with comms.transaction():
+            if attempt():
+                return True
+            error_code, timed_out = comms.last_error_code, comms.last_timed_out
+        if not policy.is_transient(error_code, timed_out):
+            break
+        if error_code is not None:
+            reason = ERR_CODE_TO_MSG.get(error_code, f'error {error_code}')
+        else:
+            reason = 'no response'
+        if confirm and timed_out and confirm():
+            logger.info(f'{name} took effect despite {reason}')
+            return True
+        if retry + 1 < policy.attempts:
+            logger.warning(f'{name} failed with {reason}, retrying')
+    return False
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Provisioning station: run the same nrfcredstore command on every Nordic board that is plugged
+# in, as soon as its main serial port shows up.
+# On Linux, the ACM entries in /sys/class/tty are listed on every poll, and the serial ports are
+# only enumerated when that list changes. Elsewhere, the Nordic boards are enumerated on every poll.
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from nrfcredstore.comms import get_connected_nordic_boards
+from nrfcredstore.fleet import DEFAULT_DEVICE_TIMEOUT, FleetReport, FleetRunner, run_cli_worker
+
+logger = logging.getLogger(__name__)
+
+STATION_DEV = 'station'
+STATION_POLL_INTERVAL = 0.5
+# Seconds a board must be present before its job starts, so all its ports are set up
+STATION_SETTLE_TIME = 0.5
+SYSFS_TTY = '/sys/class/tty'
+
+def acm_devices(sysfs_tty: str = SYSFS_TTY) -> Optional[FrozenSet[str]]:
+    """Names of the USB ACM devices, or None if sysfs is not available"""
+    try:
+        return frozenset(name for name in os.listdir(sysfs_tty) if name.startswith('ttyACM'))
+    except OSError:
+        return None
+
+class Station:
+    def __init__(self, runner: FleetRunner, jobs: Optional[int] = None,
+                 settle_time: float = STATION_SETTLE_TIME,
+                 list_boards: Callable = get_connected_nordic_boards,
+                 list_acm: Callable = acm_devices):
+        """Start a job for every Nordic board that appears
+
+        A board is processed once while it stays plugged in. Unplugging it and plugging it in
+        again starts a new job, once the previous job for the board or its port has ended.
+
+        Args:
+            runner: Runs the jobs.
+            jobs: Maximum number of boards processed in parallel. Defaults to no limit.
+            settle_time: Seconds a board must be present before its job starts.
+            list_boards: Returns (name, serial, port) of the connected Nordic boards.
+            list_acm: Returns a cheap snapshot of the ACM devices, or None to enumerate the
+                boards on every poll.
+        """
+        self.runner = runner
+        self.jobs = jobs
+        self.settle_time = settle_time
+        self.list_boards = list_boards
+        self.list_acm = list_acm
+        self.results: List[dict] = []
+        # serial -> (port, first seen) of boards waiting to start
+        self._waiting: Dict[str, tuple] = {}
+        # serial -> port of all connected boards
+        self._present: Dict[str, str] = {}
+        # Serial numbers of boards that were started since they were plugged in
+        self._handled = set()
+        # serial -> port of the last job started for a board
+        self._started: Dict[str, str] = {}
+        self._acm = None
+
+    def _scan(self):
+        acm = self.list_acm()
+        if acm is not None and acm == self._acm:
+            return
+        self._acm = acm
+        present = {str(serial): port.device for _, serial, port in self.list_boards()}
+        now = time.time()
+        for serial, port in present.items():
+            if serial not in self._present and serial not in self._handled:
+                logger.info(f'Board {serial} connected on {port}')
+                self._waiting[serial] = (port, now)
+        for serial in set(self._present) - set(present):
+            logger.info(f'Board {serial} disconnected')
+            self._waiting.pop(serial, None)
+            self._handled.discard(serial)
+        self._present = present
+
+    def _start_waiting(self):
+        now = time.time()
+        for serial, (port, seen) in list(self._waiting.items()):
+            if self.jobs and len(self.runner.running) >= self.jobs:
+                return
+            if now - seen < self.settle_time:
+                continue
+            # A replugged board waits until its previous job is joined or killed
+            if port in self.runner.running or self._started.get(serial) in self.runner.running:
+                continue
+            del self._waiting[serial]
+            self._handled.add(serial)
+            self._started[serial] = port
+            self.runner.start(port, name=serial)
+
+    def poll(self) -> List[dict]:
+        """Pick up plugged and unplugged boards, start jobs and return finished results"""
+        self._scan()
+        done = self.runner.poll()
+        self._start_waiting()
+        self.results += done
+        return done
+
+    def run(self, stop: Optional[threading.Event] = None, poll_interval: float = STATION_POLL_INTERVAL,
+            on_result: Optional[Callable[[dict], None]] = None) -> FleetReport:
+        """Process boards until stopped with the event or Ctrl-C, then wait for running jobs"""
+        start = time.time()
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                for result in self.poll():
+                    if on_result:
+                        on_result(result)
+                stop.wait(poll_interval)
+        except KeyboardInterrupt:
+            logger.info('Stopping, waiting for running jobs')
+        while self.runner.running:
+            for result in self.runner.poll():
+                self.results.append(result)
+                if on_result:
+                    on_result(result)
+            time.sleep(0.05)
+        return FleetReport(self.results, time.time() - start)
+
+def run_station(argv: List[str], log_dir: str, jobs: Optional[int] = None,
+                device_timeout: Optional[float] = DEFAULT_DEVICE_TIMEOUT, target: Callable = run_cli_worker,
+                mp_context=None, on_record: Optional[Callable[[dict], None]] = None, **kwargs) -> FleetReport:
+    runner = FleetRunner(argv, log_dir, device_timeout, target, mp_context, on_record)
+    return Station(runner, jobs).run(**kwargs)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025 Nordic Semiconductor ASA
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# In-memory trace of the traffic with the device.
+# Every line sent or received is kept as (timestamp, direction, data) in a ring buffer of fixed
+# size. Nothing is formatted until the trace is dumped, so tracing can stay on for every run.
+
+import time
+from collections import deque
+from datetime import datetime
+from typing import Iterator, Optional, Sequence, Union
+
+TRACE_SIZE = 2048
+TRACE_TX = '>'
+TRACE_RX = '<'
+TRACE_EVENT = '!'
+
+TraceData = Union[bytes, str, Sequence[bytes]]
+
+class TraceBuffer:
+    def __init__(self, size: int = TRACE_SIZE):
+        """Ring buffer holding the last size trace entries"""
+        self._entries = deque(maxlen=size)
+
+    def record(self, direction: str, data: TraceData):
+        """Add an entry. data is stored as is: bytes, text, or a sequence of byte buffers."""
+        self._entries.append((time.time(), direction, data))
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _format_data(data: TraceData) -> str:
+        if isinstance(data, str):
+            return data.rstrip('\r\n')
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = b''.join(data)
+        return bytes(data).decode('utf-8', errors='backslashreplace').rstrip('\r\n')
+
+    def lines(self) -> Iterator[str]:
+        for timestamp, direction, data in list(self._entries):
+            stamp = datetime.fromtimestamp(timestamp).strftime('%H:%M:%S.%f')[:-3]
+            yield f'{stamp} {direction} {self._format_data(data)}'
+
+    def dump(self, path: str, reason: Optional[str] = None):
+        """Write the trace to a file, replacing an earlier dump"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if reason:
+                f.write(f'# {reason}\n')
+            for line in self.lines():
+                f.write(line + '\n')
@@ -0,0 +1,86 @@
+import base64
+import io
+import json
+import time
+import pytest
+
+from nrfcredstore.attestation import decode_token, harvest_token, iter_tokens, main, token_record
+
+TOKEN = ('2dn3hQFQUDYxVDkxRPCAIhIbZAFifQNQGv86y_GmR2SiY0wmRsHGVFDT791_BPH8YOWFiyCHND1q.'
+         '0oRDoQEmoQRBIfZYQGuXwJliinHc6xDPruiyjsaXyXZbZVpUuOhHG9YS8L05VuglCcJhMN4EUhWVGpaHgNnHHno6ahi-d5tOeZmAcNY')
+
+def test_decode_token():
+    token = decode_token(TOKEN)
+    assert token.msg_type == 1
+    assert token.device_uuid == '50363154-3931-44f0-8022-121b6401627d'
+    assert token.device_type == 3
+    assert token.firmware_uuid == '1aff3acb-f1a6-4764-a263-4c2646c1c654'
+    assert token.alg == -7
+    assert token.kid == '21'
+
+def test_decode_attesttoken_line():
+    assert decode_token(f'%ATTESTTOKEN: "{TOKEN}"\r\n') == decode_token(TOKEN)
+
+def test_decode_without_cose():
+    token = decode_token(TOKEN.split('.')[0])
+    assert token.device_type == 3
+    assert token.alg is None
+
+@pytest.mark.parametrize('token', ['', 'Zm9v.YmFy', TOKEN[:40], '%ATTESTTOKEN: foo'])
+def test_decode_malformed(token):
+    with pytest.raises(ValueError):
+        decode_token(token)
+
+def cose_token(protected: bytes, unprotected: bytes = b'\xa0') -> str:
+    # COSE_Sign1 with the given headers, no payload and an empty signature
+    cose = b'\xd2\x84' + bytes([0x40 + len(protected)]) + protected + unprotected + b'\xf6\x40'
+    return TOKEN.split('.')[0] + '.' + base64.urlsafe_b64encode(cose).decode().rstrip('=')
+
+@pytest.mark.parametrize('token', [
+    # Protected header is an array
+    cose_token(b'\x81\x01'),
+    # Unprotected header is an array
+    cose_token(b'\xa1\x01\x26', b'\x81\x01'),
+    # Map with an array as key
+    cose_token(b'\xa1\x80\x01'),
+])
+def test_decode_malformed_cose(token):
+    with pytest.raises(ValueError):
+        decode_token(token)
+    assert 'error' in token_record('dev1', token)
+
+def test_harvest(tmp_path):
+    path = str(tmp_path / 'tokens.ndjson')
+    harvest_token(path, '351234567890123', TOKEN)
+    harvest_token(path, '351234567890124', 'Zm9v.YmFy')
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]['device'] == '351234567890123'
+    assert records[0]['device_uuid'] == '50363154-3931-44f0-8022-121b6401627d'
+    assert 'error' in records[1]
+
+def test_iter_tokens_raw_lines():
+    records = list(iter_tokens(io.StringIO(f'{TOKEN}\n\n{TOKEN}\n')))
+    assert len(records) == 2
+    assert records[0]['device'] is None
+    assert records[1]['firmware_uuid'] == '1aff3acb-f1a6-4764-a263-4c2646c1c654'
+
+def test_iter_tokens_skips_torn_lines():
+    lines = [json.dumps({'device': 'dev1', 'attestation_token': TOKEN}), '{"device": "dev2", "attes',
+             '{"device": "dev3"}', '{"attestation_token": 1}']
+    records = list(iter_tokens(io.StringIO('\n'.join(lines))))
+    assert [r['device'] for r in records] == ['dev1']
+
+def test_main(tmp_path, capsys):
+    path = str(tmp_path / 'tokens.ndjson')
+    harvest_token(path, 'dev1', TOKEN)
+    assert main([path, '--output', 'ndjson']) == 0
+    assert json.loads(capsys.readouterr().out)['device'] == 'dev1'
+    harvest_token(path, 'dev2', 'Zm9v.YmFy')
+    assert main([path]) == 1
+
+def test_decode_rate():
+    start = time.perf_counter()
+    for _ in range(2000):
+        decode_token(TOKEN)
+    assert time.perf_counter() - start < 2
@@ -0,0 +1,131 @@
+import contextlib
+import json
+import pytest
+
+from unittest.mock import Mock, patch
+from serial import SerialException
+from nrfcredstore.comms import Comms
+
+from nrfcredstore.baudrate import HANDSHAKE_TIMEOUT, BaudrateCache, handshake, negotiate_baudrate
+from nrfcredstore.command_interface import PROBE_DRAIN_TIMEOUT
+
+CLAC_OUTPUT = 'AT+CGSN\r\nAT+CGMM\r\nAT+CGMR\r\n' * 20
+
+class FakeComms:
+    """Serial comms for a device with a UART running at one fixed baud rate"""
+    def __init__(self, device_baudrate, baudrate=115200, unsupported=()):
+        self.device_baudrate = device_baudrate
+        self.baudrate = baudrate
+        self.unsupported = unsupported
+        self.serial_number = 1051202135
+        self.reopened = []
+        self.timeouts = []
+
+    def reopen(self, baudrate):
+        if baudrate in self.unsupported:
+            raise ValueError(f'Unsupported baud rate {baudrate}')
+        self.baudrate = baudrate
+        self.reopened.append(baudrate)
+
+    def transaction(self):
+        return contextlib.nullcontext(self)
+
+    def reset_input_buffer(self):
+        pass
+
+    def write_line(self, line):
+        pass
+
+    def expect_response(self, ok_str=None, error_str=None, store_str=None, timeout=15, suppress_errors=False):
+        self.timeouts.append(timeout)
+        if self.baudrate == self.device_baudrate:
+            return True, CLAC_OUTPUT
+        return False, '\x00\xff'
+
+@pytest.fixture
+def cache(tmp_path):
+    return BaudrateCache(str(tmp_path / 'cache' / 'baudrates.jsonl'))
+
+def test_negotiate_finds_device_rate(cache):
+    comms = FakeComms(device_baudrate=921600)
+    assert negotiate_baudrate(comms, cache=cache) == 921600
+    assert comms.baudrate == 921600
+    with open(cache.path) as f:
+        assert [json.loads(line) for line in f] == [{'serial': '1051202135', 'baudrate': 921600}]
+
+def test_cache_shared_by_workers(cache):
+    # Two workers load the cache before either one stores its rate
+    first, second = BaudrateCache(cache.path), BaudrateCache(cache.path)
+    first.set(1, 921600)
+    second.set(2, 460800)
+    first.set(1, 1000000)
+    rates = BaudrateCache(cache.path)
+    assert (rates.get(1), rates.get(2)) == (1000000, 460800)
+
+def test_negotiate_uses_cached_rate(cache):
+    cache.set(1051202135, 460800)
+    comms = FakeComms(device_baudrate=460800)
+    assert negotiate_baudrate(comms, cache=BaudrateCache(cache.path)) == 460800
+    assert comms.reopened == [460800]
+
+def test_negotiate_stale_cache_probes_again(cache):
+    cache.set(1051202135, 1000000)
+    comms = FakeComms(device_baudrate=230400)
+    assert negotiate_baudrate(comms, cache=cache) == 230400
+    assert cache.get(1051202135) == 230400
+
+def test_negotiate_skips_unsupported_rates():
+    comms = FakeComms(device_baudrate=115200, unsupported=(1000000, 921600))
+    assert negotiate_baudrate(comms) == 115200
+
+def test_negotiate_failure_restores_original(cache):
+    comms = FakeComms(device_baudrate=9600)
+    assert negotiate_baudrate(comms, cache=cache) == 115200
+    assert comms.baudrate == 115200
+    assert cache.get(1051202135) is None
+
+def test_corrupt_cache_is_ignored(tmp_path):
+    path = tmp_path / 'baudrates.jsonl'
+    path.write_text('{"serial": "1", "baudrate": 921600}\n{"serial": "2", "bau')
+    cache = BaudrateCache(str(path))
+    assert cache.get(1) == 921600
+    assert cache.get(2) is None
+
+def test_handshake_drains_rejected_shell_probe():
+    comms = FakeComms(device_baudrate=115200)
+    assert handshake(comms)[0]
+    assert comms.timeouts == [HANDSHAKE_TIMEOUT, PROBE_DRAIN_TIMEOUT]
+
+def test_handshake_failure_not_drained():
+    comms = FakeComms(device_baudrate=921600)
+    assert not handshake(comms)[0]
+    assert comms.timeouts == [HANDSHAKE_TIMEOUT]
+
+def test_negotiate_with_rejected_rate_keeps_port_open():
+    def open_port(baudrate, **kwargs):
+        if baudrate == 1000000:
+            raise SerialException(f'Unsupported baud rate {baudrate}')
+        port = Mock()
+        # Device answers the readiness probe
+        port.in_waiting = 4
+        port.read.return_value = b'OK\r\n'
+        return port
+    with patch('nrfcredstore.comms.select_device', return_value=(Mock(device='/dev/ttyACM0'), 1051202135)), \
+         patch('nrfcredstore.comms.serial.Serial', side_effect=open_port), \
+         patch('nrfcredstore.baudrate.handshake', side_effect=lambda comms: (comms.baudrate == 921600, 1000.0)):
+        comms = Comms(port='/dev/ttyACM0', baudrate=115200)
+        assert negotiate_baudrate(comms) == 921600
+        assert comms.baudrate == 921600
+        assert comms.serial_api is not None
+
+def test_reopen_restores_previous_rate():
+    with patch('nrfcredstore.comms.select_device', return_value=(Mock(device='/dev/ttyACM0'), 1051202135)), \
+         patch('nrfcredstore.comms.serial.Serial') as mock_serial:
+        mock_serial.return_value.in_waiting = 4
+        mock_serial.return_value.read.return_value = b'OK\r\n'
+        comms = Comms(port='/dev/ttyACM0', baudrate=115200)
+        mock_serial.side_effect = [SerialException('Unsupported'), mock_serial.return_value]
+        with pytest.raises(SerialException):
+            comms.reopen(1000000)
+        assert comms.baudrate == 115200
+        assert comms.serial_api is mock_serial.return_value
@@ -0,0 +1,38 @@
+import pytest
+
+from nrfcredstore import cbor
+from nrfcredstore.cbor import CBORDecodeError, CBORTag
+
+@pytest.mark.parametrize('data,value', [
+    ('00', 0),
+    ('17', 23),
+    ('1818', 24),
+    ('1903e8', 1000),
+    ('1b000000e8d4a51000', 1000000000000),
+    ('20', -1),
+    ('3903e7', -1000),
+    ('4401020304', b'\x01\x02\x03\x04'),
+    ('6449455446', 'IETF'),
+    ('83010203', [1, 2, 3]),
+    ('a201020304', {1: 2, 3: 4}),
+    ('f4', False),
+    ('f5', True),
+    ('f6', None),
+    ('f93c00', 1.0),
+    ('fb3ff199999999999a', 1.1),
+    ('c11a514b67b0', CBORTag(1, 1363896240)),
+    ('5f42010243030405ff', b'\x01\x02\x03\x04\x05'),
+    ('9f018202039f0405ffff', [1, [2, 3], [4, 5]]),
+    ('bf61610161629f0203ffff', {'a': 1, 'b': [2, 3]}),
+])
+def test_rfc8949_examples(data, value):
+    assert cbor.loads(bytes.fromhex(data)) == value
+
+@pytest.mark.parametrize('data', ['', '4401', '830102', '0000', 'ff', '1c'])
+def test_invalid(data):
+    with pytest.raises(CBORDecodeError):
+        cbor.loads(bytes.fromhex(data))
+
+def test_unhashable_map_key():
+    with pytest.raises(CBORDecodeError):
+        cbor.loads(bytes.fromhex('a18001'))
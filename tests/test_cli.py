@@ -1,18 +1,21 @@
+import json
+import pstats
 import pytest
 
-from unittest.mock import Mock, ANY, patch
+from unittest.mock import Mock, MagicMock, ANY, patch
 from serial import SerialException
 from nrfcredstore.cli import main, parse_args, run, FUN_MODE_OFFLINE
 
-from nrfcredstore.credstore import CredType
+from nrfcredstore.credstore import CredType, WriteResult
 from nrfcredstore.exceptions import NoATClientException, ATCommandError
+from nrfcredstore.profiling import phase, timer
 
 # pylint: disable=no-self-use
 class TestCli():
 
     @pytest.fixture
     def command_interface(self):
-        command_interface = Mock()
+        command_interface = MagicMock()
         return command_interface
 
     @pytest.fixture
@@ -40,6 +43,12 @@ class TestCli():
             main(parse_args(['fakedev', 'list']), credstore)
         assert e.type == TimeoutError
 
+    def test_tls_shell_without_at_client(self, credstore, command_interface):
+        command_interface.detect_shell_mode.return_value = 'tls_cred_shell'
+        with pytest.raises(NoATClientException):
+            main(parse_args(['fakedev', 'list']), credstore)
+        credstore.list.assert_not_called()
+
     def test_non_responsive_device(self, credstore, command_interface, empty_cred_list):
         command_interface.detect_shell_mode.enable_error_codes.return_value = False
         main(parse_args(['fakedev', 'list']), credstore)
@@ -64,12 +73,76 @@ class TestCli():
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
         credstore.list.assert_called_with(ANY, CredType.CLIENT_KEY)
 
+    def test_list_ndjson(self, credstore, cred_list_minimal, capsys):
+        credstore.command_interface.comms.serial_number = 1051202135
+        main(parse_args(['--output', 'ndjson', 'fakedev', 'list']), credstore)
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 3
+        assert json.loads(lines[0]) == {
+            'device': 1051202135, 'tag': 4294967292, 'type': 'NORDIC_PUB_KEY', 'type_value': 11,
+            'sha': '672E2F05962B4EFBFA8801255D87E0E0418F2DDF4DDAEFC59E9B4162F512CB63'}
+
+    def test_list_json(self, credstore, cred_list_minimal, capsys):
+        credstore.command_interface.comms.serial_number = 1051202135
+        main(parse_args(['--output', 'json', 'fakedev', 'list']), credstore)
+        records = json.loads(capsys.readouterr().out)
+        assert [r['tag'] for r in records] == [4294967292, 4294967293, 4294967294]
+
+    def test_list_csv(self, credstore, cred_list_minimal, capsys):
+        credstore.command_interface.comms.serial_number = 1051202135
+        main(parse_args(['--output', 'csv', 'fakedev', 'list']), credstore)
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == 'device,tag,type,type_value,sha'
+        assert lines[1].startswith('1051202135,4294967292,NORDIC_PUB_KEY,11,')
+
+    def test_generatemany_csv_with_and_without_cose(self, credstore, tmp_path, capsys):
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        credstore.keygen_many.return_value = {
+            123: {'der': '351234567890123/123.der'},
+            124: {'der': '351234567890123/124.der', 'cose': '351234567890123/124.cose'},
+        }
+        main(parse_args(['--output', 'csv', 'fakedev', 'generatemany', str(tmp_path), '123', '124']), credstore)
+        assert capsys.readouterr().out.splitlines() == [
+            'device,tag,der,pem,cose',
+            '351234567890123,123,351234567890123/123.der,,',
+            '351234567890123,124,351234567890123/124.der,,351234567890123/124.cose',
+        ]
+
+    def test_imei_ndjson(self, credstore, capsys):
+        credstore.command_interface.comms.serial_number = 1051202135
+        credstore.command_interface.get_imei.return_value = '123456789012345'
+        main(parse_args(['--output', 'ndjson', 'fakedev', 'imei']), credstore)
+        assert json.loads(capsys.readouterr().out) == {'device': 1051202135, 'imei': '123456789012345'}
+
     def test_write_tag_and_type(self, credstore):
         credstore.write.return_value = True
         main(parse_args(['fakedev', 'write', '123', 'ROOT_CA_CERT', 'tests/fixtures/root-ca.pem']), credstore)
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
         credstore.write.assert_called_with(123, CredType.ROOT_CA_CERT, ANY)
 
+    def test_write_next_tag(self, credstore, capsys):
+        credstore.allocate_tags.return_value = [1000]
+        main(parse_args(['fakedev', 'write', 'next', 'ROOT_CA_CERT', 'tests/fixtures/root-ca.pem',
+                         '--tag-range', '1000-1999']), credstore)
+        credstore.allocate_tags.assert_called_once_with(1, (1000, 1999))
+        credstore.write.assert_called_with(1000, CredType.ROOT_CA_CERT, ANY)
+        assert 'Using free secure tag 1000' in capsys.readouterr().out
+
+    @pytest.mark.parametrize('tag_range', ['1000', '2000-1000', 'a-b', '0-2147483648', '4294967291-4294967295'])
+    def test_write_invalid_tag_range(self, tag_range):
+        with pytest.raises(SystemExit):
+            parse_args(['fakedev', 'write', 'next', 'ROOT_CA_CERT', 'tests/fixtures/root-ca.pem', '--tag-range', tag_range])
+
+    def test_write_verify(self, credstore):
+        credstore.write.return_value = WriteResult.VERIFIED
+        main(parse_args(['fakedev', 'write', '123', 'ROOT_CA_CERT', 'tests/fixtures/root-ca.pem', '--verify']), credstore)
+        credstore.write.assert_called_with(123, CredType.ROOT_CA_CERT, ANY, verify=True)
+
+    def test_write_verify_mismatch(self, credstore):
+        credstore.write.return_value = WriteResult.MISMATCH
+        with pytest.raises(RuntimeError):
+            main(parse_args(['fakedev', 'write', '123', 'ROOT_CA_CERT', 'tests/fixtures/root-ca.pem', '--verify']), credstore)
+
     @patch('builtins.open')
     def test_write_file(self, mock_file, credstore):
         credstore.write.return_value = True
@@ -96,30 +169,74 @@ class TestCli():
 
     def test_deleteall(self, credstore, cred_list_minimal):
         credstore.deleteall.return_value = True
+        credstore.delete_many.return_value = []
         main(parse_args(['fakedev', 'deleteall']), credstore)
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
         credstore.list.assert_called_with(None, CredType.ANY)
+        credstore.delete_many.assert_called_with(credstore.list.return_value)
+
+    def test_deleteall_reports_failures(self, credstore, cred_list_minimal):
+        failed = Mock(tag=123, type=CredType.CLIENT_KEY)
+        credstore.delete_many.return_value = [(failed, False)]
+        with pytest.raises(RuntimeError):
+            main(parse_args(['fakedev', 'deleteall']), credstore)
 
     @patch('builtins.open')
     def test_generate_tag(self, mock_file, credstore):
-        credstore.keygen.return_value = True
+        credstore.keygen.return_value = b''
         main(parse_args(['fakedev', 'generate', '123', 'foo.der']), credstore)
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
-        credstore.keygen.assert_called_with(123, ANY, ANY)
+        credstore.keygen.assert_called_with(123, ANY, ANY, 'der')
 
     @patch('builtins.open')
     def test_generate_file(self, mock_file, credstore):
-        credstore.keygen.return_value = True
+        credstore.keygen.return_value = b''
         main(parse_args(['fakedev', 'generate', '123', 'foo.der']), credstore)
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
         mock_file.assert_called_with('foo.der', 'wb', ANY, ANY, ANY)
 
     @patch('builtins.open')
     def test_generate_with_attributes(self, credstore):
-        credstore.keygen.return_value = True
+        credstore.keygen.return_value = b''
         main(parse_args(['fakedev', 'generate', '123', 'foo.der', '--attributes', 'CN=foo']), credstore)
         credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
-        credstore.keygen.assert_called_with(123, ANY, 'CN=foo')
+        credstore.keygen.assert_called_with(123, ANY, 'CN=foo', 'der')
+
+    def test_generate_pem_closes_file(self, credstore, tmp_path):
+        credstore.keygen.return_value = b''
+        path = str(tmp_path / 'foo.pem')
+        args = parse_args(['fakedev', 'generate', '123', path, '--format', 'pem'])
+        main(args, credstore)
+        credstore.keygen.assert_called_with(123, args.file, '', 'pem')
+        assert args.file.closed
+        assert not (tmp_path / 'foo.cose').exists()
+
+    def test_generate_writes_cose(self, credstore, tmp_path, capsys):
+        credstore.keygen.return_value = b'cose'
+        path = str(tmp_path / 'foo.der')
+        main(parse_args(['fakedev', 'generate', '123', path]), credstore)
+        assert (tmp_path / 'foo.cose').read_bytes() == b'cose'
+        assert f'Wrote COSE signature to {tmp_path / "foo.cose"}' in capsys.readouterr().out
+
+    def test_generatemany(self, credstore, tmp_path):
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        credstore.keygen_many.return_value = {123: {}, 124: {}}
+        main(parse_args(['fakedev', 'generatemany', str(tmp_path), '123', '124']), credstore)
+        credstore.func_mode.assert_called_with(FUN_MODE_OFFLINE)
+        credstore.keygen_many.assert_called_with([123, 124], ANY, '351234567890123', '')
+
+    @pytest.mark.parametrize('dev', ['all', 'all-rtt', 'station'])
+    def test_generatemany_zip_refused_for_many_devices(self, dev):
+        with pytest.raises(SystemExit):
+            parse_args([dev, 'generatemany', 'csrs.zip', '123'])
+        assert parse_args([dev, 'generatemany', 'csrs', '123']).output == 'csrs'
+
+    def test_inventory(self, credstore, tmp_path):
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        credstore.export_inventory.return_value = []
+        path = str(tmp_path / 'fleet.jsonl')
+        main(parse_args(['fakedev', 'inventory', path]), credstore)
+        credstore.export_inventory.assert_called_with(path, '351234567890123')
 
     def test_imei(self, credstore):
         credstore.command_interface.get_imei.return_value = '123456789012345'
@@ -133,12 +250,147 @@ class TestCli():
         main(args, credstore)
         credstore.command_interface.get_attestation_token.assert_called_once()
 
+    def test_attestation_token_harvest(self, credstore, tmp_path):
+        credstore.command_interface.get_attestation_token.return_value = '2dn3hQFQUDYxVDkxRPCAIhIbZAFifQNQGv86y_GmR2SiY0wmRsHGVFDT791_BPH8YOWFiyCHND1q.0oRDoQEmoQRBIfZYQGuXwJliinHc6xDPruiyjsaXyXZbZVpUuOhHG9YS8L05VuglCcJhMN4EUhWVGpaHgNnHHno6ahi-d5tOeZmAcNY'
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        path = str(tmp_path / 'tokens.ndjson')
+        main(parse_args(['fakedev', 'attoken', '--harvest', path]), credstore)
+        with open(path) as f:
+            record = json.loads(f.read())
+        assert record['device'] == '351234567890123'
+        assert record['device_uuid'] == '50363154-3931-44f0-8022-121b6401627d'
+
+    def test_attestation_token_harvest_undecodable(self, credstore, tmp_path):
+        credstore.command_interface.get_attestation_token.return_value = 'foo.bar'
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        path = str(tmp_path / 'tokens.ndjson')
+        main(parse_args(['fakedev', 'attoken', '--harvest', path]), credstore)
+        with open(path) as f:
+            assert 'error' in json.loads(f.read())
+
+    def test_shell(self, credstore, empty_cred_list, capsys):
+        credstore.command_interface.comms.expect_response.return_value = (True, '+CGMR: mfw_nrf91x1_2.0.2\r\n')
+        lines = iter(['list', 'AT+CGMR', 'delete 123 ROOT_CA_CERT', 'exit'])
+        with patch('builtins.input', lambda prompt: next(lines)):
+            main(parse_args(['fakedev', 'shell']), credstore)
+        # The session goes offline once, not once per command
+        credstore.func_mode.assert_called_once_with(FUN_MODE_OFFLINE)
+        credstore.list.assert_called_once()
+        credstore.command_interface.at_command.assert_called_with('AT+CGMR')
+        credstore.delete.assert_called_with(123, CredType.ROOT_CA_CERT)
+        out = capsys.readouterr().out
+        assert 'mfw_nrf91x1_2.0.2' in out
+        assert out.count(' ms)') == 3
+
+    def test_shell_attoken_is_subcommand(self, credstore, capsys):
+        credstore.command_interface.get_attestation_token.return_value = 'foo.bar'
+        lines = iter(['attoken', 'at', 'exit'])
+        credstore.command_interface.comms.expect_response.return_value = (True, '')
+        with patch('builtins.input', lambda prompt: next(lines)):
+            main(parse_args(['fakedev', 'shell']), credstore)
+        credstore.command_interface.get_attestation_token.assert_called_once()
+        credstore.command_interface.at_command.assert_called_once_with('at')
+        assert 'Attestation token: foo.bar' in capsys.readouterr().out
+
+    def test_shell_errors_do_not_end_session(self, credstore, capsys):
+        credstore.list.side_effect = RuntimeError('Failed to list credentials')
+        lines = iter(['list', 'nosuchcommand', 'imei'])
+        credstore.command_interface.get_imei.return_value = '123456789012345'
+        def fake_input(prompt):
+            try:
+                return next(lines)
+            except StopIteration:
+                raise EOFError
+        with patch('builtins.input', fake_input):
+            main(parse_args(['fakedev', 'shell']), credstore)
+        out = capsys.readouterr().out
+        assert 'Error: Failed to list credentials' in out
+        assert 'IMEI: 123456789012345' in out
+
+    def test_journal(self, credstore, empty_cred_list, tmp_path):
+        credstore.command_interface.get_imei.return_value = '351234567890123'
+        main(parse_args(['--journal', str(tmp_path / 'journal.jsonl'), 'fakedev', 'list']), credstore)
+        assert credstore.journal.device_id == '351234567890123'
+
     def test_at_command_error_exit_code(self, credstore):
         credstore.func_mode.side_effect = RuntimeError("Failed to set modem to offline mode.")
         with pytest.raises(RuntimeError) as e:
             main(parse_args(['fakedev', 'list']), credstore)
         assert e.type == RuntimeError
 
+    def test_fleet(self):
+        report = Mock(failed=[])
+        report.summary.return_value = {'succeeded': 2, 'devices': 2, 'duration': 1.0,
+                                       'devices_per_minute': 120.0, 'failures': {}}
+        with patch('nrfcredstore.cli.fleet_devices', return_value=['/dev/ttyACM0', '/dev/ttyACM2']), \
+             patch('nrfcredstore.cli.run_fleet', return_value=report) as mock_run_fleet:
+            run(['nrfcredstore', '--fleet-jobs', '2', 'all', 'list'])
+        mock_run_fleet.assert_called_once_with(['/dev/ttyACM0', '/dev/ttyACM2'],
+            ['nrfcredstore', '--fleet-jobs', '2', 'all', 'list'], 'nrfcredstore-logs', 2, 600, on_record=None)
+
+    def test_fleet_timeout_from_job_timeout(self):
+        report = Mock(failed=[])
+        report.summary.return_value = {'succeeded': 1, 'devices': 1, 'duration': 1.0,
+                                       'devices_per_minute': 60.0, 'failures': {}}
+        with patch('nrfcredstore.cli.fleet_devices', return_value=['/dev/ttyACM0']), \
+             patch('nrfcredstore.cli.run_fleet', return_value=report) as mock_run_fleet:
+            run(['nrfcredstore', '--job-timeout', '60', 'all', 'list'])
+        assert mock_run_fleet.call_args[0][4] == 90
+
+    def test_fleet_records_on_stdout(self, capsys):
+        report = Mock(failed=[])
+        report.summary.return_value = {'succeeded': 1, 'devices': 1, 'duration': 1.0,
+                                       'devices_per_minute': 60.0, 'failures': {}}
+        def fake_run_fleet(*args, on_record):
+            on_record({'device': '1051202135', 'imei': '351234567890123'})
+            return report
+        with patch('nrfcredstore.cli.fleet_devices', return_value=['/dev/ttyACM0']), \
+             patch('nrfcredstore.cli.run_fleet', side_effect=fake_run_fleet):
+            run(['nrfcredstore', '--output', 'ndjson', 'all', 'imei'])
+        captured = capsys.readouterr()
+        assert [json.loads(line) for line in captured.out.splitlines()] == [
+            {'device': '1051202135', 'imei': '351234567890123'}]
+        assert '1 of 1 devices succeeded' in captured.err
+
+    def test_profile(self, tmp_path, capsys):
+        path = str(tmp_path / 'run.prof')
+        def fake_run_device(args):
+            with phase('operation'):
+                pass
+        timer.reset()
+        with patch('nrfcredstore.cli.run_device', side_effect=fake_run_device):
+            run(['nrfcredstore', '--profile', path, 'fakedev', 'list'])
+        assert pstats.Stats(path).total_calls > 0
+        with open(path + '.txt') as f:
+            assert 'operation' in f.read()
+        assert 'operation' in capsys.readouterr().err
+
+    def test_run_device_closes_comms(self):
+        comms = Mock()
+        with patch('nrfcredstore.cli.open_comms', return_value=comms), \
+             patch('nrfcredstore.cli.main', side_effect=RuntimeError('Failed')):
+            with pytest.raises(RuntimeError):
+                run(['nrfcredstore', 'fakedev', 'list'])
+        comms.close.assert_called_once()
+        comms.dump_trace.assert_called_once_with('RuntimeError: Failed')
+
+    def test_job_timeout(self):
+        comms = Mock()
+        with patch('nrfcredstore.cli.open_comms', return_value=comms), \
+             patch('nrfcredstore.cli.main') as mock_main:
+            run(['nrfcredstore', '--job-timeout', '30', 'fakedev', 'list'])
+        deadline = mock_main.call_args[0][1].deadline
+        assert 0 < deadline.remaining() <= 30
+        comms.set_deadline.assert_called_with(deadline)
+
+    @pytest.mark.parametrize('argv, attempts', [([], 1), (['--retries', '2'], 3)])
+    def test_retries(self, argv, attempts):
+        with patch('nrfcredstore.cli.open_comms', return_value=Mock()), \
+             patch('nrfcredstore.cli.main') as mock_main:
+            run(['nrfcredstore', *argv, 'fakedev', 'list'])
+        policies = mock_main.call_args[0][1].retry_policies
+        assert {policy.attempts for policy in policies.values()} == {attempts}
+
     def test_cannot_find_device(self):
         with patch("nrfcredstore.comms.__init__", return_value=Mock()) as mock_comms:
             mock_comms.side_effect = Exception("No device found")
@@ -1,14 +1,16 @@
-from unittest.mock import patch, Mock
+import contextlib
+from unittest.mock import patch, Mock, MagicMock
 from collections import namedtuple
 import pytest
 
-from nrfcredstore.command_interface import CredentialCommandInterface, ATCommandInterface, TLSCredShellInterface
+from nrfcredstore.command_interface import CredentialCommandInterface, ATCommandInterface, TLSCredShellInterface, PROBE_DRAIN_TIMEOUT
 from nrfcredstore.credstore import CredType
+from nrfcredstore.comms import CMD_TYPE_AT, CMD_TYPE_AT_SHELL, CMD_TYPE_TLS_SHELL
 
 @pytest.fixture
 def comms():
     """Mock comms object"""
-    comms = Mock()
+    comms = MagicMock()
     return comms
 
 @pytest.fixture
@@ -42,6 +44,21 @@ def test_write_credential_at(at_command_interface):
     at_command_interface.write_credential(sectag=42, cred_type=CredType.CLIENT_CERT.value, cred_text='test_value')
     at_command_interface.comms.write_line.assert_called_once_with('AT%CMNG=0,42,1,"test_value"')
 
+def test_at_command_with_payload(at_command_interface):
+    """Test streaming a large payload using ATCommandInterface"""
+    at_command_interface.comms.expect_response.return_value = (True, "")
+    result = at_command_interface.at_command_with_payload('AT%CMNG=0,42,0,"', b'line1\nline2', '"', wait_for_result=True)
+    assert result is True
+    at_command_interface.comms.write_line_parts.assert_called_once_with(
+        [b'AT%CMNG=0,42,0,"', b'line1\nline2', b'"'])
+
+def test_at_command_with_payload_shell(at_command_interface):
+    """Test streaming a large payload using ATCommandInterface in shell mode"""
+    at_command_interface.set_shell_mode(True)
+    at_command_interface.at_command_with_payload('AT%CMNG=0,42,0,"', b'line1\r\nline2', '"')
+    at_command_interface.comms.write_line_parts.assert_called_once_with(
+        [b"at 'AT%CMNG=0,42,0,\"", b'line1\\nline2', b"\"'"])
+
 def test_delete_credential_at(at_command_interface):
     """Test deleting a credential using ATCommandInterface"""
     at_command_interface.comms.write_line = Mock()
@@ -57,6 +74,13 @@ def test_check_credential_exists_at(at_command_interface):
     assert exists is True
     assert sha == '8CEA57609B0F95C0D0F80383A7A21ECD1C6E102FDCC3CDCEB1948B0EA828601D'
 
+def test_check_credential_not_exists_at(at_command_interface):
+    """Test checking a missing credential using ATCommandInterface"""
+    at_command_interface.comms.expect_response.return_value = (True, '')
+    exists, sha = at_command_interface.check_credential_exists(sectag=42, cred_type=CredType.CLIENT_CERT.value)
+    assert exists is False
+    assert sha is None
+
 def test_get_csr_at(at_command_interface):
     """Test getting a CSR using ATCommandInterface"""
     at_command_interface.comms.write_line = Mock()
@@ -119,36 +143,91 @@ def test_enable_error_codes(at_command_interface):
     at_command_interface.enable_error_codes()
     at_command_interface.comms.write_line.assert_called_once_with('AT+CMEE=1')
 
-class MockCommsAT:
-    """Mock comms for ATCommandInterface"""
+class MockDevice:
+    """Line level device simulator for detect_shell_mode"""
+    ready_response = ''
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.written = []
+        self.lines = []
+        self.timeouts = []
+
+    def transaction(self):
+        return contextlib.nullcontext(self)
+
+    def reset_input_buffer(self):
+        self.lines = []
+
     def write_line(self, line):
-        self.last_written = line
+        self.written.append(line)
+        self.lines += self.replies.get(line, [f'{line.split()[0]}: command not found'])
 
     def expect_response(self, ok_str=None, error_str=None, store_str=None, timeout=15, suppress_errors=False):
-        if self.last_written == 'AT+CGSN':
-            return True, '123456789012345'
-        else:
-            return False, ''
+        self.timeouts.append(timeout)
+        output = ''
+        while self.lines:
+            line = self.lines.pop(0)
+            if line == ok_str:
+                return True, output
+            if line == error_str:
+                return False, output
+            if store_str is not None and store_str in line:
+                output += line + '\r\n'
+        return False, output
+
+class MockCommsAT(MockDevice):
+    """Mock comms for ATCommandInterface"""
+    def __init__(self):
+        super().__init__({'AT+CGSN': ['123456789012345', 'OK'], 'at AT+CGSN': ['ERROR']})
 
 def test_detect_shell_mode_at(at_command_interface):
     """Test detecting shell mode using ATCommandInterface (AT Host)"""
     at_command_interface.comms = MockCommsAT()
-    at_command_interface.detect_shell_mode()
+    assert at_command_interface.detect_shell_mode() == CMD_TYPE_AT
     assert at_command_interface.shell == False
+    # Both responses are consumed, nothing is left for the next command
+    assert at_command_interface.comms.lines == []
 
-class MockCommsATShell:
-    """Mock comms for TLSCredShellInterface"""
-    def write_line(self, line):
-        self.last_written = line
+def test_detect_shell_mode_at_dropped_shell_probe(at_command_interface):
+    """Test that a raw AT client dropping the shell probe only costs a short wait"""
+    at_command_interface.comms = MockDevice({'AT+CGSN': ['123456789012345', 'OK'], 'at AT+CGSN': []})
+    assert at_command_interface.detect_shell_mode() == CMD_TYPE_AT
+    assert at_command_interface.comms.timeouts[-1] == PROBE_DRAIN_TIMEOUT
 
-    def expect_response(self, ok_str=None, error_str=None, store_str=None, timeout=15, suppress_errors=False):
-        if self.last_written == 'at AT+CGSN':
-            return True, '123456789012345'
-        else:
-            return False, ''
+class MockCommsATShell(MockDevice):
+    """Mock comms for TLSCredShellInterface"""
+    def __init__(self):
+        super().__init__({'at AT+CGSN': ['123456789012345', 'OK']})
 
 def test_detect_shell_mode_shell(at_command_interface):
     """Test detecting shell mode using ATCommandInterface (AT Shell)"""
     at_command_interface.comms = MockCommsATShell()
-    at_command_interface.detect_shell_mode()
+    assert at_command_interface.detect_shell_mode() == CMD_TYPE_AT_SHELL
     assert at_command_interface.shell == True
+
+def test_detect_shell_mode_prompt(at_command_interface):
+    """Test that a shell prompt seen when opening the port skips the raw AT probe"""
+    at_command_interface.comms = MockCommsATShell()
+    at_command_interface.comms.ready_response = 'uart:~$ '
+    assert at_command_interface.detect_shell_mode() == CMD_TYPE_AT_SHELL
+    assert at_command_interface.comms.written == ['at AT+CGSN']
+
+def test_detect_shell_mode_tls_shell(at_command_interface):
+    """Test detecting a shell without AT client"""
+    at_command_interface.comms = MockDevice({})
+    assert at_command_interface.detect_shell_mode() == CMD_TYPE_TLS_SHELL
+
+def test_detect_shell_mode_no_response(at_command_interface):
+    """Test that a silent device times out"""
+    at_command_interface.comms = MockDevice({'AT+CGSN': [], 'at AT+CGSN': []})
+    with pytest.raises(TimeoutError):
+        at_command_interface.detect_shell_mode()
+
+def test_detect_shell_mode_caches_imei(at_command_interface):
+    """Test that the IMEI read by the probe is not queried again"""
+    at_command_interface.comms = MockCommsAT()
+    at_command_interface.detect_shell_mode()
+    at_command_interface.comms = MagicMock()
+    assert at_command_interface.get_imei() == '123456789012345'
+    at_command_interface.comms.write_line.assert_not_called()
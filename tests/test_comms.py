@@ -1,14 +1,19 @@
 from unittest.mock import patch, Mock
+import time
 from collections import namedtuple
 import pytest
 
 from nrfcredstore.comms import (
+    jlink_pool,
+    get_connected_jlinks,
     get_connected_nordic_boards,
     select_jlink,
     select_device_by_serial,
     select_device,
     Comms,
 )
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.exceptions import DeadlineExceededError
 
 Port = namedtuple("Port", ["hwid", "device"])
 
@@ -197,11 +202,21 @@ def ports_linux_jlink_multi_com():
 def mock_serial():
     """Mock the serial.Serial class."""
     with patch("nrfcredstore.comms.serial.Serial", autospec=True) as mock_serial:
+        # Device answers the readiness probe
+        mock_serial.return_value.in_waiting = 4
+        mock_serial.return_value.read.return_value = b'OK\r\n'
         yield mock_serial
 
 # Tests for get_connected_nordic_boards
 
 
+def test_main_port_not_enumerated_yet(platform_linux):
+    # nRF5340-DK uses its second port, which shows up after the first one
+    ports = [Port("USB VID:PID=1366:1051 SER=000960112345 LOCATION=3-1:1.0", "/dev/ttyACM0")]
+    with patch("nrfcredstore.comms.list_ports", autospec=True) as m:
+        m.comports.return_value = ports
+        assert get_connected_nordic_boards() == []
+
 def test_mac(platform_darwin, ports_mac):
     boards = get_connected_nordic_boards()
     assert len(boards) == 1
@@ -444,6 +459,19 @@ def test_expect_response_timeout(mock_serial):
         assert result is False
         assert output == ''
 
+def test_expect_response_records_failure(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.read_line = Mock(side_effect=["+CME ERROR: 518"])
+        assert comms.expect_response("OK", "ERROR", suppress_errors=True) == (False, '')
+        assert comms.last_error_code == 518
+        assert not comms.last_timed_out
+
+        comms.read_line = Mock(return_value="")
+        comms.expect_response("OK", "ERROR", timeout=0.1, suppress_errors=True)
+        assert comms.last_error_code is None
+        assert comms.last_timed_out
+
 def test_expect_response_store(mock_serial):
     with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")) as mock_select:
         comms = Comms()
@@ -452,3 +480,305 @@ def test_expect_response_store(mock_serial):
         mock_select.assert_called_once()
         assert result is True
         assert output.strip() == '%ATTESTTOKEN: "foo.bar"'
+
+def test_expect_response_lines_not_delayed(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.read_line = Mock(side_effect=[f'%CMNG: {n},0,"AA"' for n in range(50)] + ["OK"])
+        start = time.time()
+        result, output = comms.expect_response("OK", "ERROR", "%CMNG: ")
+        assert time.time() - start < 1
+        assert len(output.splitlines()) == 50
+
+def test_expect_response_capture_limit(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms(capture_max_lines=10, capture_max_bytes=1000)
+        comms.read_line = Mock(side_effect=[f'<inf> log {n}' for n in range(100)] + ['352656100367872', "OK"])
+        result, output = comms.expect_response("OK", "ERROR", "")
+        assert result is True
+        assert comms.capture_overflow
+        lines = output.splitlines()
+        assert len(lines) == 10
+        assert lines[-1] == '352656100367872'
+
+        comms.read_line = Mock(side_effect=['x' * 600, 'y' * 600, "OK"])
+        result, output = comms.expect_response("OK", "ERROR", "")
+        assert output == 'y' * 600 + '\r\n'
+
+        comms.read_line = Mock(side_effect=['352656100367872', "OK"])
+        comms.expect_response("OK", "ERROR", "")
+        assert not comms.capture_overflow
+
+def test_expect_response_deadline(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.read_line = Mock(return_value="")
+        comms.set_deadline(Deadline(0.2))
+        start = time.time()
+        with pytest.raises(DeadlineExceededError):
+            comms.expect_response("OK", "ERROR", timeout=10)
+        assert time.time() - start < 5
+
+def test_cancel_interrupts_read(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        deadline = Deadline()
+        comms.set_deadline(deadline)
+        deadline.cancel()
+        mock_serial.return_value.cancel_read.assert_called_once()
+        comms.set_deadline(None)
+        deadline.cancel()
+        mock_serial.return_value.cancel_read.assert_called_once()
+
+# tests for transactions and unsolicited result codes
+
+def test_expect_response_dispatches_urc(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        handler = Mock()
+        comms.add_urc_handler(handler, prefix="+CEREG")
+        comms.read_line = Mock(side_effect=['+CEREG: 1', '%CMNG: 1,0,"AB"', "OK"])
+        result, output = comms.expect_response("OK", "ERROR", "")
+        assert result is True
+        assert output.strip() == '%CMNG: 1,0,"AB"'
+        handler.assert_called_once_with('+CEREG: 1')
+
+def test_expect_response_dispatches_unhandled_lines(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        handler = Mock()
+        comms.add_urc_handler(handler)
+        comms.read_line = Mock(side_effect=['[00:00:01] <inf> app: hello', '%ATTESTTOKEN: "foo.bar"', "OK"])
+        result, output = comms.expect_response("OK", "ERROR", "%ATTESTTOKEN:")
+        assert output.strip() == '%ATTESTTOKEN: "foo.bar"'
+        handler.assert_called_once_with('[00:00:01] <inf> app: hello')
+        comms.remove_urc_handler(handler)
+        assert comms._urc_handlers == []
+
+def test_reset_input_buffer_dispatches_pending_lines(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        handler = Mock()
+        comms.add_urc_handler(handler, prefix="%XMODEMSLEEP")
+        comms.serial_api.in_waiting = 30
+        comms.serial_api.read.return_value = b'%XMODEMSLEEP: 1,0\r\n+CEREG: 5'
+        comms.reset_input_buffer()
+        handler.assert_called_once_with('%XMODEMSLEEP: 1,0')
+
+def test_transaction_blocks_other_threads(mock_serial):
+    import threading
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        written = []
+        comms.write = lambda data: written.append(data)
+        comms.read_line = Mock(return_value="OK")
+
+        def other_command():
+            comms.write_line("AT+CFUN=4")
+            comms.expect_response("OK", "ERROR")
+
+        with comms.transaction():
+            comms.write_line("AT+CGSN")
+            other = threading.Thread(target=other_command)
+            other.start()
+            other.join(timeout=0.3)
+            # The other thread waits until the transaction is left
+            assert other.is_alive()
+            assert written == [b"AT+CGSN\r\n"]
+            comms.expect_response("OK", "ERROR")
+        other.join(timeout=1)
+        assert written == [b"AT+CGSN\r\n", b"AT+CFUN=4\r\n"]
+
+def test_write_line_outside_transaction_does_not_hold_link(mock_serial):
+    import threading
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        written = []
+        comms.write = lambda data: written.append(data)
+
+        comms.write_line("AT+CGSN")
+        other = threading.Thread(target=comms.write_line, args=("AT+CFUN=4",))
+        other.start()
+        other.join(timeout=1)
+        assert not other.is_alive()
+        assert written == [b"AT+CGSN\r\n", b"AT+CFUN=4\r\n"]
+
+def test_transaction_released_on_error(mock_serial):
+    import threading
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.write = Mock()
+        with pytest.raises(RuntimeError):
+            with comms.transaction():
+                comms.write_line("AT+CGSN")
+                raise RuntimeError("lost")
+        other = threading.Thread(target=comms.write_line, args=("AT+CFUN=4",))
+        other.start()
+        other.join(timeout=1)
+        assert not other.is_alive()
+
+# tests for streaming writes
+
+def test_write_line_parts_serial(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.serial_api.write.reset_mock()
+        payload = b'x' * 2500
+        comms.write_line_parts([b'AT%CMNG=0,1,0,"', payload, b'"'])
+        written = b''.join(bytes(c.args[0]) for c in comms.serial_api.write.call_args_list)
+        assert written == b'AT%CMNG=0,1,0,"' + payload + b'"\r\n'
+        # Large payloads are written in chunks
+        assert comms.serial_api.write.call_count == 6
+
+def test_write_rtt_resends_partial_writes(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.jlink_api = Mock()
+        written = []
+        def rtt_write(channel_index, msg):
+            # Target buffer accepts at most 5 bytes at a time
+            written.append(bytes(msg[:5]))
+            return len(msg[:5])
+        comms.jlink_api.rtt_write.side_effect = rtt_write
+        comms._write_rtt(b'AT%CMNG=0,1,0,"abcdefghijklmnop"')
+        assert b''.join(written) == b'AT%CMNG=0,1,0,"abcdefghijklmnop"'
+        comms.jlink_api = None
+
+# tests for the J-Link session pool
+
+@pytest.fixture
+def lowlevel():
+    with patch("nrfcredstore.comms.LowLevel") as m:
+        m.API.side_effect = lambda *args: Mock()
+        jlink_pool.close_all()
+        yield m
+        jlink_pool.close_all()
+
+def test_get_connected_jlinks_is_cached(lowlevel):
+    enum_api = Mock()
+    enum_api.enum_emu_snr.return_value = [1051202135]
+    lowlevel.API.side_effect = None
+    lowlevel.API.return_value = enum_api
+    assert get_connected_jlinks() == [1051202135]
+    assert get_connected_jlinks() == [1051202135]
+    enum_api.enum_emu_snr.assert_called_once()
+    get_connected_jlinks(refresh=True)
+    assert enum_api.enum_emu_snr.call_count == 2
+    enum_api.open.assert_called_once()
+
+def test_rtt_session_is_reused(lowlevel):
+    with patch("nrfcredstore.comms.select_device", return_value=(None, 1051202135)):
+        comms = Comms(rtt=True)
+        api = comms.jlink_api
+        api.sys_reset.assert_called_once()
+        api.rtt_start.assert_called_once()
+        comms.close()
+        api.close.assert_not_called()
+
+        # Reopening skips connect, reset and RTT start
+        api.is_rtt_started.return_value = True
+        comms = Comms(rtt=True)
+        assert comms.jlink_api is api
+        api.connect_to_emu_with_snr.assert_called_once_with(1051202135)
+        api.sys_reset.assert_called_once()
+        api.rtt_start.assert_called_once()
+        comms.close()
+
+def test_rtt_reset_device_keeps_session(lowlevel):
+    with patch("nrfcredstore.comms.select_device", return_value=(None, 1051202135)):
+        comms = Comms(rtt=True)
+        api = comms.jlink_api
+        comms.reset_device()
+        assert comms.jlink_api is api
+        assert api.sys_reset.call_count == 2
+        api.open.assert_called_once()
+        comms.reconnect_rtt()
+        assert api.sys_reset.call_count == 2
+        assert api.rtt_stop.call_count == 2
+        comms.close()
+
+def test_close_all_closes_sessions(lowlevel):
+    with patch("nrfcredstore.comms.select_device", return_value=(None, 1051202135)):
+        comms = Comms(rtt=True)
+        api = comms.jlink_api
+        comms.close()
+        jlink_pool.close_all()
+        api.close.assert_called_once()
+
+# tests for the serial readiness probe
+
+def test_serial_ready_response(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        start = time.time()
+        comms = Comms(ready_timeout=5)
+        assert time.time() - start < 1
+        assert comms.ready_response == 'OK\r\n'
+        mock_serial.return_value.write.assert_any_call(b'AT\r\n')
+        mock_serial.return_value.reset_input_buffer.assert_called()
+
+def test_serial_ready_waits_for_whole_answer(mock_serial):
+    # The echo arrives first, the shell answer and prompt later
+    mock_serial.return_value.read.side_effect = [b'AT\r\n', b'AT: command not found\r\n', b'uart:~$ ']
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms(ready_timeout=5)
+        assert comms.ready_response == 'AT\r\nAT: command not found\r\n'
+
+def test_serial_ready_ignores_other_output(mock_serial):
+    # A boot banner is not an answer to the probe
+    mock_serial.return_value.read.return_value = b'*** Booting nRF Connect SDK ***\r\n'
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        start = time.time()
+        comms = Comms(ready_timeout=0.3)
+        assert time.time() - start >= 0.3
+        assert comms.ready_response == ''
+
+def test_serial_ready_timeout(mock_serial):
+    mock_serial.return_value.in_waiting = 0
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        start = time.time()
+        comms = Comms(ready_timeout=0.3)
+        assert time.time() - start >= 0.3
+        assert comms.ready_response == ''
+
+def test_reopen_changes_baudrate(mock_serial):
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(device='/dev/ttyACM0'), "123456789")):
+        comms = Comms(baudrate=115200, ready_timeout=0)
+        first = mock_serial.return_value
+        comms.reopen(921600)
+        first.close.assert_called_once()
+        assert comms.baudrate == 921600
+        assert mock_serial.call_args.kwargs['baudrate'] == 921600
+        assert mock_serial.call_args.kwargs['port'] == '/dev/ttyACM0'
+
+def test_reopen_rtt_fails(lowlevel):
+    with patch("nrfcredstore.comms.select_device", return_value=(None, 1051202135)):
+        comms = Comms(rtt=True)
+        with pytest.raises(RuntimeError):
+            comms.reopen(921600)
+        comms.close()
+
+# tests for the trace buffer
+
+def test_trace_dumped_on_error(mock_serial, tmp_path):
+    path = str(tmp_path / 'trace.txt')
+    mock_serial.return_value.readline.side_effect = [b'+CME ERROR: 514\r\n']
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms(trace_path=path)
+        comms.write_line('AT%CMNG=3,123,0')
+        assert comms.expect_response("OK", "ERROR", suppress_errors=True) == (False, '')
+        assert not (tmp_path / 'trace.txt').exists()
+        comms.write_line('AT%CMNG=3,123,0')
+        mock_serial.return_value.readline.side_effect = [b'+CME ERROR: 514\r\n']
+        comms.expect_response("OK", "ERROR")
+        lines = (tmp_path / 'trace.txt').read_text().splitlines()
+        assert lines[0] == '# No OK from device'
+        assert lines[-2].endswith('> AT%CMNG=3,123,0')
+        assert lines[-1].endswith('< +CME ERROR: 514')
+
+def test_trace_records_timeout(mock_serial):
+    mock_serial.return_value.readline.return_value = b''
+    with patch("nrfcredstore.comms.select_device", return_value=(Mock(), "123456789")):
+        comms = Comms()
+        comms.write_line('AT')
+        comms.expect_response("OK", "ERROR", timeout=0.1)
+        assert list(comms.trace.lines())[-1].endswith('! Timeout after 0.1 s')
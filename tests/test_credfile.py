@@ -0,0 +1,52 @@
+import io
+import os
+import pytest
+
+from unittest.mock import patch
+from nrfcredstore.credfile import load_credential, load_credential_path, clear_cache
+from nrfcredstore.command_interface import ATCommandInterface, TLSCredShellInterface
+
+ROOT_CA = 'tests/fixtures/root-ca.pem'
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+def test_text_is_normalized():
+    cred = load_credential(io.StringIO('-----BEGIN-----\nabc\n-----END-----\n\n'))
+    assert cred.text == '-----BEGIN-----\nabc\n-----END-----'
+
+def test_digests_match_command_interfaces():
+    with open(ROOT_CA, 'r', encoding='utf-8') as f:
+        cred = load_credential(f)
+    assert cred.at_sha == ATCommandInterface(None).calculate_expected_hash(cred.text)
+    assert cred.tls_sha == TLSCredShellInterface(None).calculate_expected_hash(cred.text)
+
+def test_file_is_read_once():
+    with open(ROOT_CA, 'r', encoding='utf-8') as f:
+        first = load_credential(f)
+    with open(ROOT_CA, 'r', encoding='utf-8') as f:
+        second = load_credential(f)
+        # Cache hit does not consume the file
+        assert f.tell() == 0
+    assert first is second
+
+def test_path_is_opened_once():
+    first = load_credential_path(ROOT_CA)
+    with patch('builtins.open') as mock_open:
+        second = load_credential_path(ROOT_CA)
+        mock_open.assert_not_called()
+    assert first is second
+
+def test_modified_file_is_reread(tmp_path):
+    path = tmp_path / 'cert.pem'
+    path.write_text('first')
+    assert load_credential_path(str(path)).text == 'first'
+    path.write_text('second!')
+    assert load_credential_path(str(path)).text == 'second!'
+
+def test_streams_are_not_cached():
+    assert load_credential(io.StringIO('a')).text == 'a'
+    assert load_credential(io.StringIO('b')).text == 'b'
@@ -1,9 +1,13 @@
 import io
+import json
 import pytest
 
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, MagicMock, patch
 from nrfcredstore.credstore import *
-from nrfcredstore.exceptions import ATCommandError
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.exceptions import ATCommandError, DeadlineExceededError
+from nrfcredstore.journal import ProvisioningJournal
+from nrfcredstore.retry import retry_policies
 
 # pylint: disable=no-self-use
 class TestCredStore:
@@ -15,7 +19,7 @@ class TestCredStore:
 
     @pytest.fixture
     def cred_store(self):
-        self.command_interface = Mock()
+        self.command_interface = MagicMock()
         return CredStore(self.command_interface)
 
     @pytest.fixture
@@ -52,14 +56,93 @@ class TestCredStore:
     @pytest.fixture
     def at_error(self, cred_store):
         cred_store.command_interface.at_command.return_value = False
+        cred_store.command_interface.at_command_with_payload.return_value = False
 
     @pytest.fixture
     def at_error_in_expect_response(self, cred_store):
         cred_store.command_interface.comms.expect_response.return_value = (False, "")
 
+    def test_deadline_passed_to_command_interface(self, cred_store):
+        deadline = Deadline(10)
+        cred_store.set_deadline(deadline)
+        cred_store.command_interface.set_deadline.assert_called_once_with(deadline)
+
+    def test_keygen_many_stops_at_deadline(self, cred_store):
+        cred_store.set_deadline(Deadline(0))
+        with pytest.raises(DeadlineExceededError):
+            cred_store.keygen_many([1, 2], Mock(), 'dev1')
+        cred_store.command_interface.get_csr.assert_not_called()
+
+    def test_write_retried_after_modem_error(self, cred_store):
+        cred_store.retry_policies = retry_policies(2)
+        cred_store.command_interface.comms.last_error_code = 518
+        cred_store.command_interface.comms.last_timed_out = False
+        cred_store.command_interface.at_command_with_payload.side_effect = [False, True]
+        assert cred_store.write(123, CredType.ROOT_CA_CERT, io.StringIO('cert')) == WriteResult.WRITTEN
+        assert cred_store.command_interface.at_command_with_payload.call_count == 2
+
+    def test_write_confirmed_after_timeout(self, cred_store):
+        cred_store.retry_policies = retry_policies(2)
+        cred_store.command_interface.comms.last_error_code = None
+        cred_store.command_interface.comms.last_timed_out = True
+        cred_store.command_interface.at_command_with_payload.return_value = False
+        cred_store.command_interface.expected_hash_for_file.return_value = 'AA'
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'AA')
+        assert cred_store.write(123, CredType.ROOT_CA_CERT, io.StringIO('cert')) == WriteResult.WRITTEN
+        cred_store.command_interface.at_command_with_payload.assert_called_once()
+
+    def test_delete_not_retried_after_permanent_error(self, cred_store):
+        cred_store.retry_policies = retry_policies(2)
+        cred_store.command_interface.comms.last_error_code = 513
+        cred_store.command_interface.at_command.return_value = False
+        with pytest.raises(RuntimeError):
+            cred_store.delete(123, CredType.ROOT_CA_CERT)
+        cred_store.command_interface.at_command.assert_called_once()
+
+    def test_used_tags_sorted_with_reserved(self, cred_store, list_all_resp):
+        assert cred_store.used_tags() == [567890, 12345678, 4294967292, 4294967293, 4294967294]
+
+    def test_allocate_tags_skips_used(self, cred_store):
+        cred_store.command_interface.comms.expect_response.return_value = (True, "\r\n".join(
+            f'%CMNG: {tag}, 0, "AA"' for tag in [1000, 1001, 1003]))
+        assert cred_store.allocate_tags(3, (1000, 1999)) == [1002, 1004, 1005]
+        # Allocated tags are not handed out again, without listing again
+        assert cred_store.allocate_tags(1, (1000, 1999)) == [1006]
+        cred_store.command_interface.comms.expect_response.assert_called_once()
+
+    def test_allocate_tags_range_full(self, cred_store):
+        cred_store.command_interface.comms.expect_response.return_value = (True, '%CMNG: 5, 0, "AA"')
+        with pytest.raises(RuntimeError):
+            cred_store.allocate_tags(2, (4, 5))
+
+    def test_allocate_tags_top_of_range(self, cred_store):
+        cred_store.command_interface.comms.expect_response.return_value = (True, '')
+        assert cred_store.allocate_tags(2, (SEC_TAG_MAX - 1, SEC_TAG_MAX)) == [SEC_TAG_MAX - 1, SEC_TAG_MAX]
+
+    @pytest.mark.parametrize('tag_range', [(4294967291, 4294967295), (0, SEC_TAG_MAX + 1), (-1, 10), (20, 10)])
+    def test_allocate_tags_invalid_range(self, cred_store, tag_range):
+        with pytest.raises(ValueError):
+            cred_store.allocate_tags(1, tag_range)
+
+    def test_written_tag_marked_used(self, cred_store, ok_resp):
+        cred_store.command_interface.comms.expect_response.return_value = (True, '')
+        cred_store.command_interface.at_command_with_payload.return_value = True
+        assert cred_store.allocate_tags(1, (10, 20)) == [10]
+        cred_store.write(11, CredType.ROOT_CA_CERT, io.StringIO('cert'))
+        assert cred_store.allocate_tags(1, (10, 20)) == [12]
+
     def test_exposes_command_interface(self, cred_store):
         assert cred_store.command_interface is self.command_interface
 
+    def test_export_inventory(self, cred_store, list_all_resp, tmp_path):
+        path = str(tmp_path / 'inventory.jsonl')
+        creds = cred_store.export_inventory(path, '351234567890123')
+        assert len(creds) == 2
+        with open(path) as f:
+            record = json.loads(f.read())
+        assert record['device'] == '351234567890123'
+        assert record['creds'] == [[12345678, 0, '978C...02C4'], [567890, 1, 'C485...CF09']]
+
     def test_func_mode_offline(self, cred_store):
         cred_store.func_mode(4)
         self.command_interface.at_command.assert_called_with('AT+CFUN=4', wait_for_result=True)
@@ -114,7 +197,7 @@ class TestCredStore:
             cred_store.list()
 
     def test_delete_success(self, cred_store, ok_resp):
-        cred_store.delete(567890, CredType(1))
+        assert cred_store.delete(567890, CredType(1)) is True
         self.command_interface.at_command.assert_called_with('AT%CMNG=3,567890,1', wait_for_result=True)
 
     def test_delete_fail(self, cred_store, at_error):
@@ -131,7 +214,25 @@ dGVzdA==
 -----END CERTIFICATE-----'''
         fake_file = io.StringIO(cert_text)
         cred_store.write(567890, CredType.CLIENT_KEY, fake_file)
-        self.command_interface.at_command.assert_called_with(f'AT%CMNG=0,567890,2,"{cert_text}"', wait_for_result=True)
+        self.command_interface.at_command_with_payload.assert_called_with(
+            'AT%CMNG=0,567890,2,"', cert_text.encode(), '"', wait_for_result=True)
+
+    def test_write_returns_written(self, cred_store, ok_resp):
+        assert cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key')) == WriteResult.WRITTEN
+        self.command_interface.check_credential_exists.assert_not_called()
+
+    def test_write_verify(self, cred_store, ok_resp):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'ABCD')
+        result = cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'), verify=True)
+        assert result == WriteResult.VERIFIED
+        self.command_interface.check_credential_exists.assert_called_with(567890, 2)
+
+    def test_write_verify_mismatch(self, cred_store, ok_resp):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'FFFF')
+        result = cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'), verify=True)
+        assert result == WriteResult.MISMATCH
 
     def test_write_fail(self, cred_store, at_error):
         with pytest.raises(RuntimeError):
@@ -158,7 +259,100 @@ dGVzdA==
         cred_store.keygen(12345678, fake_binary_file)
         fake_binary_file.write.assert_called_with(b'foo')
 
+    def test_generate_returns_cose(self, cred_store, csr_resp):
+        assert cred_store.keygen(12345678, io.BytesIO()) == b'bar'
+
+    def test_generate_pem_leaves_file_open(self, cred_store, csr_resp):
+        file = io.BytesIO()
+        cred_store.keygen(12345678, file, csr_format='pem')
+        assert file.getvalue() == b'-----BEGIN CERTIFICATE REQUEST-----\nZm9v\n-----END CERTIFICATE REQUEST-----\n'
+        assert not file.closed
+
     def test_generate_fail(self, cred_store):
         with patch.object(cred_store.command_interface, 'get_csr', return_value=None):
             with pytest.raises(RuntimeError):
                 cred_store.keygen(12345678, Mock())
+
+    @pytest.fixture
+    def journal(self, cred_store, tmp_path):
+        cred_store.journal = ProvisioningJournal(str(tmp_path / 'journal.jsonl'), 'dev1')
+        return cred_store.journal
+
+    def test_journaled_write_records_step(self, cred_store, ok_resp, journal):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'))
+        assert journal.completed('write:567890:2')['sha'] == 'ABCD'
+
+    def test_journaled_write_skips_confirmed_step(self, cred_store, ok_resp, journal):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'ABCD')
+        journal.complete('write:567890:2', sha='ABCD')
+        cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'))
+        self.command_interface.at_command_with_payload.assert_not_called()
+
+    def test_journaled_write_repeats_on_hash_mismatch(self, cred_store, ok_resp, journal):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'FFFF')
+        journal.complete('write:567890:2', sha='ABCD')
+        cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'))
+        self.command_interface.at_command_with_payload.assert_called_with(
+            'AT%CMNG=0,567890,2,"', b'key', '"', wait_for_result=True)
+
+    def test_journaled_write_fail_stays_pending(self, cred_store, at_error, journal):
+        cred_store.command_interface.expected_hash_for_file.return_value = 'ABCD'
+        with pytest.raises(RuntimeError):
+            cred_store.write(567890, CredType.CLIENT_KEY, io.StringIO('key'))
+        assert journal.pending() == ['write:567890:2']
+
+    def test_journaled_keygen_reuses_csr(self, cred_store, journal):
+        cred_store.command_interface.check_credential_exists.return_value = (True, 'ABCD')
+        journal.complete('keygen:12345678', sha='ABCD', csr='Zm9v.YmFy')
+        fake_binary_file = Mock()
+        cred_store.keygen(12345678, fake_binary_file)
+        self.command_interface.get_csr.assert_not_called()
+        fake_binary_file.write.assert_called_with(b'foo')
+
+    def test_delete_many_concatenates(self, cred_store, ok_resp):
+        creds = [Credential(1, 0, 'AA'), Credential(2, 1, 'BB'), Credential(4294967293, 10, 'CC')]
+        results = cred_store.delete_many(creds)
+        assert results == [(creds[0], True), (creds[1], True)]
+        self.command_interface.at_command.assert_called_with(
+            'AT%CMNG=3,1,0;%CMNG=3,2,1', wait_for_result=True, suppress_errors=True)
+
+    def test_delete_many_splits_long_batches(self, cred_store, ok_resp):
+        creds = [Credential(1000000 + i, 0, '') for i in range(40)]
+        cred_store.delete_many(creds)
+        batches = [c.args[0] for c in self.command_interface.at_command.call_args_list[1:]]
+        assert len(batches) > 1
+        assert all(len(b) <= AT_CONCAT_MAX_LEN for b in batches)
+        assert sum(b.count('%CMNG=3') for b in batches) == 40
+
+    def test_delete_many_without_concatenation(self, cred_store):
+        # Probe fails, deletes succeed
+        self.command_interface.at_command.side_effect = [False, True, False]
+        creds = [Credential(1, 0, 'AA'), Credential(2, 1, 'BB')]
+        results = cred_store.delete_many(creds)
+        assert results == [(creds[0], True), (creds[1], False)]
+        self.command_interface.at_command.assert_called_with('AT%CMNG=3,2,1', wait_for_result=True)
+
+    def test_delete_many_recovers_failed_batch(self, cred_store):
+        # Probe ok, batch fails after first delete, list, retry of second succeeds
+        self.command_interface.at_command.side_effect = [True, False, True, True]
+        self.command_interface.comms.expect_response.return_value = (True, '%CMNG: 2,1,"BB"')
+        creds = [Credential(1, 0, 'AA'), Credential(2, 1, 'BB')]
+        results = cred_store.delete_many(creds)
+        assert results == [(creds[0], True), (creds[1], True)]
+        self.command_interface.at_command.assert_called_with('AT%CMNG=3,2,1', wait_for_result=True)
+
+    def test_keygen_many_writes_each_tag(self, cred_store, csr_resp):
+        writer = Mock()
+        writer.add.side_effect = lambda device_id, tag, der, cose: {'der': f'{device_id}/{tag}.der'}
+        files = cred_store.keygen_many([1, 2], writer, 'dev1')
+        assert files == {1: {'der': 'dev1/1.der'}, 2: {'der': 'dev1/2.der'}}
+        writer.add.assert_called_with('dev1', 2, b'foo', b'bar')
+        assert self.command_interface.get_csr.call_count == 2
+
+    def test_keygen_many_fail(self, cred_store):
+        cred_store.command_interface.get_csr.return_value = None
+        with pytest.raises(RuntimeError):
+            cred_store.keygen_many([1, 2], Mock(), 'dev1')
@@ -0,0 +1,158 @@
+import io
+import json
+import os
+import zipfile
+import pytest
+
+from nrfcredstore.csr import (
+    CSRWriter, FORMAT_DER, FORMAT_PEM, der_to_pem, iter_keygen_outputs, load_csr_index, main, parse_csr,
+    split_keygen_output
+)
+
+def test_split_keygen_output():
+    # base64-encoded 'foo' and base64-encoded 'bar' joined by '.'
+    assert split_keygen_output('Zm9v.YmFy') == (b'foo', b'bar')
+
+def test_split_keygen_output_without_cose():
+    assert split_keygen_output('Zm9v\r\n') == (b'foo', b'')
+
+def test_writer_directory(tmp_path):
+    with CSRWriter(str(tmp_path)) as writer:
+        writer.add('dev1', 123, b'der', b'cose')
+        writer.add(42, 124, b'der2')
+    assert (tmp_path / 'dev1' / '123.der').read_bytes() == b'der'
+    assert (tmp_path / 'dev1' / '123.cose').read_bytes() == b'cose'
+    index = load_csr_index(str(tmp_path / 'index.jsonl'))
+    assert index == {
+        'dev1': {'123': {'der': 'dev1/123.der', 'cose': 'dev1/123.cose'}},
+        '42': {'124': {'der': '42/124.der'}},
+    }
+
+def test_writer_extends_index(tmp_path):
+    with CSRWriter(str(tmp_path)) as writer:
+        writer.add('dev1', 123, b'der')
+    with CSRWriter(str(tmp_path)) as writer:
+        writer.add('dev2', 123, b'der')
+    index = load_csr_index(str(tmp_path / 'index.jsonl'))
+    assert sorted(index) == ['dev1', 'dev2']
+
+def test_writers_sharing_directory(tmp_path):
+    # Fleet workers have their writers open at the same time
+    first = CSRWriter(str(tmp_path))
+    second = CSRWriter(str(tmp_path))
+    first.add('dev1', 123, b'der')
+    second.add('dev2', 123, b'der')
+    second.close()
+    first.close()
+    assert sorted(load_csr_index(str(tmp_path / 'index.jsonl'))) == ['dev1', 'dev2']
+
+def test_index_ignores_torn_line(tmp_path):
+    with CSRWriter(str(tmp_path)) as writer:
+        writer.add('dev1', 123, b'der')
+    with open(tmp_path / 'index.jsonl', 'a') as f:
+        f.write('{"device": "dev2", "ta')
+    assert sorted(load_csr_index(str(tmp_path / 'index.jsonl'))) == ['dev1']
+
+def test_writer_archive(tmp_path):
+    path = str(tmp_path / 'csrs.zip')
+    with CSRWriter(path) as writer:
+        writer.add('dev1', 123, b'der', b'cose')
+    with zipfile.ZipFile(path) as archive:
+        assert archive.read('dev1/123.der') == b'der'
+        assert archive.read('dev1/123.cose') == b'cose'
+    index = load_csr_index(str(tmp_path / 'csrs.index.jsonl'))
+    assert index['dev1']['123']['der'] == 'dev1/123.der'
+
+def test_writer_archive_rerun_replaces_entries(tmp_path, recwarn):
+    path = str(tmp_path / 'csrs.zip')
+    with CSRWriter(path) as writer:
+        writer.add('dev1', 123, b'old')
+        writer.add('dev1', 124, b'kept')
+    with CSRWriter(path) as writer:
+        writer.add('dev1', 123, b'new')
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == ['dev1/123.der', 'dev1/124.der']
+        assert archive.read('dev1/123.der') == b'new'
+        assert archive.read('dev1/124.der') == b'kept'
+    assert not recwarn.list
+    assert not os.path.exists(path + '.tmp')
+
+# CSR generated by openssl for a P-256 key, as returned by %KEYGEN (base64url without padding)
+CSR_BLOB = ('MIIBFTCBvQIBADBbMQswCQYDVQQGEwJOTzEdMBsGA1UECgwUTm9yZGljIFNlbWljb25kdWN0b3IxLTArBgNVBAMMJDUwMzYz'
+            'MTU0LTM5MzEtNDRmMC04MDIyLTEyMWI2NDAxNjI3ZDBZMBMGByqGSM49AgEGCCqGSM49AwEHA0IABBJPgPy4Oo1A_k6_26Em'
+            'VABOUpKM87dLYRsPx_3sAjETe-BmEdSpzFTnxZyLLT2Q6D3-rw7MkX2GWzF8jfqsUAygADAKBggqhkjOPQQDAgNHADBEAiBk'
+            'h2ognzd2y-mM8sxHLuiiFytt2mAdf2EKZpvZ2i-nigIgBXV1era-S9iTuE3PTDtAk2-RfJdRApy7AH7vtcR-LD4')
+SUBJECT = 'C=NO,O=Nordic Semiconductor,CN=50363154-3931-44f0-8022-121b6401627d'
+PUBLIC_KEY_PEM = (b'-----BEGIN PUBLIC KEY-----\n'
+                  b'MFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAEEk+A/Lg6jUD+Tr/boSZUAE5Skozz\n'
+                  b't0thGw/H/ewCMRN74GYR1KnMVOfFnIstPZDoPf6vDsyRfYZbMXyN+qxQDA==\n'
+                  b'-----END PUBLIC KEY-----\n')
+
+def test_parse_csr():
+    der, _ = split_keygen_output(CSR_BLOB)
+    info = parse_csr(der)
+    assert info.subject == SUBJECT
+    assert info.public_key.startswith('04124f80fc')
+    assert len(info.public_key) == 130
+    assert der_to_pem(info.public_key_der, 'PUBLIC KEY') == PUBLIC_KEY_PEM
+
+@pytest.mark.parametrize('der', [b'', b'foo', b'\x30\x05\x30\x03\x02\x01'])
+def test_parse_csr_malformed(der):
+    with pytest.raises(ValueError):
+        parse_csr(der)
+
+def test_der_to_pem():
+    pem = der_to_pem(b'\x00' * 100).decode()
+    lines = pem.splitlines()
+    assert lines[0] == '-----BEGIN CERTIFICATE REQUEST-----'
+    assert [len(line) for line in lines[1:-1]] == [64, 64, 8]
+    assert lines[-1] == '-----END CERTIFICATE REQUEST-----'
+
+def test_writer_formats(tmp_path):
+    with CSRWriter(str(tmp_path), [FORMAT_DER, FORMAT_PEM]) as writer:
+        files = writer.add('dev1', 123, b'der', b'cose')
+    assert files == {'der': 'dev1/123.der', 'pem': 'dev1/123.pem', 'cose': 'dev1/123.cose'}
+    assert (tmp_path / 'dev1' / '123.pem').read_bytes() == der_to_pem(b'der')
+
+def test_iter_keygen_outputs():
+    lines = [
+        f'%KEYGEN: "{CSR_BLOB}.0oRDoQEmoQRBIfZYQGuX"',
+        CSR_BLOB,
+        json.dumps({'device': 'dev1', 'step': 'keygen:124', 'state': 'done', 'csr': CSR_BLOB}),
+        json.dumps({'device': 'dev1', 'step': 'write:1:0', 'state': 'done'}),
+        '',
+    ]
+    outputs = list(iter_keygen_outputs(io.StringIO('\n'.join(lines))))
+    assert [(device, tag) for device, tag, _ in outputs] == [(None, None), (None, None), ('dev1', 124)]
+    assert outputs[0][2] == CSR_BLOB + '.0oRDoQEmoQRBIfZYQGuX'
+
+def test_main(tmp_path, capsys):
+    inputs = tmp_path / 'keygen.txt'
+    inputs.write_text('\n'.join(f'%KEYGEN: "{CSR_BLOB}.0oRDoQEmoQRBIfZYQGuX"' for _ in range(3)))
+    out = tmp_path / 'csrs'
+    assert main([str(inputs), '--output-dir', str(out), '--format', 'both', '--output', 'ndjson']) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r['tag'] for r in records] == [0, 1, 2]
+    assert records[0]['subject'] == SUBJECT
+    assert (out / 'unknown' / '2.pem').read_bytes().startswith(b'-----BEGIN CERTIFICATE REQUEST-----')
+    assert (out / 'unknown' / '2.cose').exists()
+
+def test_main_numbers_across_files(tmp_path, capsys):
+    paths = []
+    for name in ['a.txt', 'b.txt']:
+        path = tmp_path / name
+        path.write_text(f'%KEYGEN: "{CSR_BLOB}"\n')
+        paths.append(str(path))
+    out = tmp_path / 'csrs'
+    assert main(paths + ['--output-dir', str(out)]) == 0
+    assert (out / 'unknown' / '0.der').exists()
+    assert (out / 'unknown' / '1.der').exists()
+    assert 'Wrote 2 CSRs' in capsys.readouterr().out
+
+def test_main_reports_malformed_and_continues(tmp_path, capsys):
+    inputs = tmp_path / 'keygen.txt'
+    inputs.write_text('\n'.join(['%KEYGEN: "not a csr', 'Zm9v', '{"device": "dev1", "csr"', CSR_BLOB]))
+    assert main([str(inputs), '--output', 'ndjson']) == 1
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [('error' in r) for r in records] == [True, True, True, False]
+    assert records[-1]['subject'] == SUBJECT
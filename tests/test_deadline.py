@@ -0,0 +1,58 @@
+import threading
+import time
+import pytest
+
+from unittest.mock import Mock
+from nrfcredstore.deadline import Deadline
+from nrfcredstore.exceptions import DeadlineExceededError, JobCancelledError
+
+def test_no_timeout():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert deadline.budget(5) == 5
+    deadline.check()
+
+def test_budget_limited_by_remaining():
+    deadline = Deadline(1)
+    assert deadline.budget(10) <= 1
+    assert deadline.budget(0.5) == 0.5
+
+def test_expired():
+    deadline = Deadline(0)
+    with pytest.raises(DeadlineExceededError):
+        deadline.check()
+    with pytest.raises(TimeoutError):
+        deadline.budget(1)
+
+def test_cancel():
+    callback = Mock()
+    deadline = Deadline(10)
+    deadline.on_cancel(callback)
+    deadline.cancel()
+    assert deadline.cancelled
+    callback.assert_called_once()
+    with pytest.raises(JobCancelledError):
+        deadline.check()
+
+def test_removed_callback_not_called():
+    callback = Mock()
+    deadline = Deadline()
+    deadline.on_cancel(callback)
+    deadline.remove_on_cancel(callback)
+    deadline.cancel()
+    callback.assert_not_called()
+
+def test_cancel_wakes_wait():
+    deadline = Deadline()
+    threading.Timer(0.05, deadline.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(JobCancelledError):
+        deadline.wait(10)
+    assert time.monotonic() - start < 5
+
+def test_wait_stops_at_deadline():
+    deadline = Deadline(0.05)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        deadline.wait(10)
+    assert time.monotonic() - start < 5
@@ -0,0 +1,120 @@
+import json
+import multiprocessing
+import os
+import time
+import pytest
+
+from collections import namedtuple
+from unittest.mock import patch
+from nrfcredstore.fleet import DEFAULT_DEVICE_TIMEOUT, FleetRunner, device_timeout_for, run_fleet, fleet_devices, log_file_name
+
+Port = namedtuple("Port", ["hwid", "device"])
+
+def ok_worker(dev, argv, log_path, results):
+    with open(log_path, 'a') as log:
+        log.write(f'{dev} {argv}\n')
+    results.put({'device': dev, 'ok': True, 'error': None})
+
+def failing_worker(dev, argv, log_path, results):
+    if dev == 'bad':
+        results.put({'device': dev, 'ok': False, 'error': 'RuntimeError()'})
+    else:
+        results.put({'device': dev, 'ok': True, 'error': None})
+
+def crashing_worker(dev, argv, log_path, results):
+    if dev == 'crash':
+        os._exit(3)
+    results.put({'device': dev, 'ok': True, 'error': None})
+
+def hanging_worker(dev, argv, log_path, results):
+    if dev == 'hang':
+        time.sleep(60)
+    results.put({'device': dev, 'ok': True, 'error': None})
+
+@pytest.fixture
+def fork():
+    return multiprocessing.get_context('fork')
+
+def test_log_file_name():
+    assert log_file_name('/dev/ttyACM0') == 'dev_ttyACM0.log'
+    assert log_file_name('1051202135') == '1051202135.log'
+
+def test_fleet_devices_serial():
+    boards = [('nRF9151-DK', 1051202135, Port('', '/dev/ttyACM2'))]
+    with patch('nrfcredstore.fleet.get_connected_nordic_boards', return_value=boards):
+        assert fleet_devices(rtt=False) == ['/dev/ttyACM2']
+
+def test_fleet_devices_rtt():
+    with patch('nrfcredstore.fleet.get_connected_jlinks', return_value=[1051202135]):
+        assert fleet_devices(rtt=True) == ['1051202135']
+
+def test_run_fleet_ok(tmp_path, fork):
+    argv = ['nrfcredstore', 'all', 'list']
+    report = run_fleet(['/dev/ttyACM0', '/dev/ttyACM2'], argv, str(tmp_path), target=ok_worker, mp_context=fork)
+    assert [r['device'] for r in report.results] == ['/dev/ttyACM0', '/dev/ttyACM2']
+    assert report.failed == []
+    assert (tmp_path / 'dev_ttyACM0.log').read_text().startswith('/dev/ttyACM0')
+
+def test_run_fleet_reports_failures(tmp_path, fork):
+    report = run_fleet(['good', 'bad', 'other'], [], str(tmp_path), jobs=1,
+                       target=failing_worker, mp_context=fork)
+    summary = report.summary()
+    assert summary['succeeded'] == 2
+    assert summary['failures'] == {'bad': 'RuntimeError()'}
+
+def test_run_fleet_survives_crash(tmp_path, fork):
+    report = run_fleet(['crash', 'good'], [], str(tmp_path), target=crashing_worker, mp_context=fork)
+    assert report.summary()['failures'] == {'crash': 'Worker exited with code 3'}
+
+def test_run_fleet_kills_hung_device(tmp_path, fork):
+    start = time.time()
+    report = run_fleet(['hang', 'good'], [], str(tmp_path), device_timeout=0.5,
+                       target=hanging_worker, mp_context=fork)
+    assert time.time() - start < 10
+    assert [r['device'] for r in report.failed] == ['hang']
+
+def test_report_file(tmp_path, fork):
+    report = run_fleet(['good'], [], str(tmp_path), target=ok_worker, mp_context=fork)
+    report.write(str(tmp_path / 'report.json'))
+    summary = json.loads((tmp_path / 'report.json').read_text())
+    assert summary['devices'] == 1
+    assert summary['results'][0]['log'].endswith('good.log')
+
+def test_cli_worker(tmp_path, fork):
+    def run_device(args):
+        print(f'running {args.subcommand} on {args.dev}')
+        if args.dev == '/dev/ttyACM2':
+            raise RuntimeError('Failed to list credentials')
+    with patch('nrfcredstore.cli.run_device', side_effect=run_device):
+        report = run_fleet(['/dev/ttyACM0', '/dev/ttyACM2'], ['nrfcredstore', 'all', 'list'],
+                           str(tmp_path), mp_context=fork)
+    assert report.summary()['failures'] == {'/dev/ttyACM2': "RuntimeError('Failed to list credentials')"}
+    assert 'running list on /dev/ttyACM0' in (tmp_path / 'dev_ttyACM0.log').read_text()
+    assert 'Failed to list credentials' in (tmp_path / 'dev_ttyACM2.log').read_text()
+
+def test_cli_worker_sends_records_to_parent(tmp_path, fork):
+    def run_device(args):
+        print('log line')
+        args.record_writer.write({'device': args.dev, 'imei': '351234567890123'})
+    records = []
+    with patch('nrfcredstore.cli.run_device', side_effect=run_device):
+        report = run_fleet(['/dev/ttyACM0'], ['nrfcredstore', '--output', 'ndjson', 'all', 'imei'],
+                           str(tmp_path), mp_context=fork, on_record=records.append)
+    assert report.failed == []
+    assert records == [{'device': '/dev/ttyACM0', 'imei': '351234567890123'}]
+    log = (tmp_path / 'dev_ttyACM0.log').read_text()
+    assert 'log line' in log
+    assert '351234567890123' not in log
+
+def test_runner_refuses_second_job_for_device(tmp_path, fork):
+    runner = FleetRunner([], str(tmp_path), target=hanging_worker, mp_context=fork)
+    runner.start('hang')
+    with pytest.raises(RuntimeError):
+        runner.start('hang')
+    proc = runner.running['hang'][0]
+    proc.kill()
+    proc.join()
+
+def test_device_timeout_for():
+    assert device_timeout_for(60) == 90
+    assert device_timeout_for(None) == DEFAULT_DEVICE_TIMEOUT
@@ -0,0 +1,83 @@
+import json
+import pytest
+
+from nrfcredstore.inventory import Inventory, load_manifest, main, write_snapshot
+
+CA = (123, 0, 'AA')
+CERT = (123, 1, 'BB')
+DEV_KEY = (4294967294, 8, 'CC')
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / 'fleet.jsonl')
+    write_snapshot(path, 'dev1', [CA, CERT, DEV_KEY])
+    write_snapshot(path, 'dev2', [CA, CERT, (4294967294, 8, 'DD')])
+    write_snapshot(path, 'dev3', [(123, 0, 'XX'), CERT])
+    write_snapshot(path, 'dev4', [CA])
+    return path
+
+def test_write_snapshot(snapshot):
+    with open(snapshot) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['device'] for r in records] == ['dev1', 'dev2', 'dev3', 'dev4']
+    assert records[0]['creds'][0] == [123, 0, 'AA']
+
+def test_index(snapshot):
+    inventory = Inventory()
+    inventory.load(snapshot)
+    assert inventory.index[(123, 0)]['AA'] == {'dev1', 'dev2', 'dev4'}
+    assert inventory.index[(123, 1)]['BB'] == {'dev1', 'dev2', 'dev3'}
+
+def test_compare_with_majority(snapshot):
+    inventory = Inventory()
+    inventory.load(snapshot)
+    issues = inventory.compare()
+    assert [(i['device'], i['tag'], i['issue']) for i in issues] == [
+        ('dev3', 123, 'mismatch'),
+        ('dev4', 123, 'missing'),
+    ]
+    assert issues[0]['sha'] == 'XX'
+    assert issues[0]['expected'] == 'AA'
+    assert issues[0]['type'] == 'ROOT_CA_CERT'
+
+def test_compare_reserved(snapshot):
+    inventory = Inventory()
+    inventory.load(snapshot)
+    reserved = [i for i in inventory.compare(include_reserved=True) if i['tag'] == 4294967294]
+    # Device specific keys have no majority, each one is reported
+    assert {i['device'] for i in reserved} == {'dev1', 'dev2'}
+    assert {i['issue'] for i in reserved} == {'unexpected'}
+
+def test_compare_with_manifest(snapshot, tmp_path):
+    manifest_path = str(tmp_path / 'golden.jsonl')
+    write_snapshot(manifest_path, 'golden', [(123, 0, 'XX')])
+    inventory = Inventory()
+    inventory.load(snapshot)
+    issues = inventory.compare(load_manifest(manifest_path))
+    by_issue = {}
+    for i in issues:
+        by_issue.setdefault(i['issue'], set()).add(i['device'])
+    assert by_issue == {
+        'mismatch': {'dev1', 'dev2', 'dev4'},
+        'unexpected': {'dev1', 'dev2', 'dev3'},
+    }
+
+def test_later_snapshot_replaces_device(snapshot):
+    write_snapshot(snapshot, 'dev3', [CA, CERT])
+    write_snapshot(snapshot, 'dev4', [CA, CERT])
+    inventory = Inventory()
+    inventory.load(snapshot)
+    assert inventory.compare() == []
+
+def test_main_exit_code(snapshot, capsys):
+    assert main([snapshot, '--output', 'ndjson']) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])['device'] == 'dev3'
+
+def test_many_devices(tmp_path):
+    inventory = Inventory()
+    for n in range(2000):
+        inventory.add(f'dev{n}', [CA, CERT] if n != 1234 else [CA, (123, 1, 'OLD')])
+    issues = inventory.compare()
+    assert [(i['device'], i['issue']) for i in issues] == [('dev1234', 'mismatch')]
@@ -0,0 +1,53 @@
+import json
+import pytest
+
+from nrfcredstore.journal import ProvisioningJournal, STEP_PLANNED, STEP_DONE
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'journal.jsonl')
+
+def test_empty_journal(journal_path):
+    journal = ProvisioningJournal(journal_path, 351234567890123)
+    assert journal.completed('write:123:0') is None
+    assert journal.pending() == []
+
+def test_plan_and_complete(journal_path):
+    journal = ProvisioningJournal(journal_path, 351234567890123)
+    journal.plan('write:123:0', sha='ABCD')
+    assert journal.completed('write:123:0') is None
+    assert journal.pending() == ['write:123:0']
+    journal.complete('write:123:0', sha='ABCD')
+    assert journal.completed('write:123:0')['sha'] == 'ABCD'
+    assert journal.pending() == []
+
+def test_resume_from_file(journal_path):
+    journal = ProvisioningJournal(journal_path, 351234567890123)
+    journal.plan('write:123:0', sha='ABCD')
+    journal.complete('write:123:0', sha='ABCD')
+    journal.plan('write:123:1', sha='EF01')
+
+    resumed = ProvisioningJournal(journal_path, '351234567890123')
+    assert resumed.completed('write:123:0')['sha'] == 'ABCD'
+    assert resumed.pending() == ['write:123:1']
+
+def test_devices_are_isolated(journal_path):
+    ProvisioningJournal(journal_path, 'dev1').complete('write:123:0', sha='ABCD')
+    other = ProvisioningJournal(journal_path, 'dev2')
+    assert other.completed('write:123:0') is None
+
+def test_torn_line_is_ignored(journal_path):
+    journal = ProvisioningJournal(journal_path, 'dev1')
+    journal.complete('write:123:0', sha='ABCD')
+    with open(journal_path, 'a') as f:
+        f.write('{"device":"dev1","step":"write:1')
+    resumed = ProvisioningJournal(journal_path, 'dev1')
+    assert resumed.completed('write:123:0')['sha'] == 'ABCD'
+
+def test_records_are_json_lines(journal_path):
+    journal = ProvisioningJournal(journal_path, 'dev1')
+    journal.plan('delete:123:0')
+    journal.complete('delete:123:0')
+    with open(journal_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['state'] for r in records] == [STEP_PLANNED, STEP_DONE]
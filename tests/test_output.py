@@ -0,0 +1,57 @@
+import io
+import json
+import pytest
+
+from nrfcredstore.output import RecordWriter, create_writer
+
+RECORDS = [
+    {'device': 1051202135, 'tag': 123, 'type': 'ROOT_CA_CERT', 'sha': 'AB'},
+    {'device': 1051202135, 'tag': 124, 'type': 'CLIENT_CERT', 'sha': 'CD'},
+]
+
+def write_all(fmt, records):
+    stream = io.StringIO()
+    with create_writer(fmt, stream) as writer:
+        for record in records:
+            writer.write(record)
+    return stream.getvalue()
+
+def test_json():
+    assert json.loads(write_all('json', RECORDS)) == RECORDS
+
+def test_json_empty():
+    assert json.loads(write_all('json', [])) == []
+
+def test_ndjson():
+    lines = write_all('ndjson', RECORDS).splitlines()
+    assert [json.loads(line) for line in lines] == RECORDS
+
+def test_csv():
+    assert write_all('csv', RECORDS) == (
+        'device,tag,type,sha\n'
+        '1051202135,123,ROOT_CA_CERT,AB\n'
+        '1051202135,124,CLIENT_CERT,CD\n'
+    )
+
+def test_csv_fields_with_differing_records():
+    stream = io.StringIO()
+    with create_writer('csv', stream, fields=['device', 'tag', 'der', 'cose']) as writer:
+        writer.write({'device': 'dev1', 'tag': 1, 'der': 'dev1/1.der'})
+        writer.write({'device': 'dev1', 'tag': 2, 'der': 'dev1/2.der', 'cose': 'dev1/2.cose'})
+    assert stream.getvalue() == (
+        'device,tag,der,cose\n'
+        'dev1,1,dev1/1.der,\n'
+        'dev1,2,dev1/2.der,dev1/2.cose\n'
+    )
+
+def test_csv_extra_field_does_not_end_stream():
+    records = RECORDS + [{**RECORDS[0], 'error': 'late field'}]
+    assert write_all('csv', records).splitlines()[-1] == '1051202135,123,ROOT_CA_CERT,AB'
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        create_writer('xml')
+
+def test_record_writer_is_abstract():
+    with pytest.raises(TypeError):
+        RecordWriter(io.StringIO())
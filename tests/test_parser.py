@@ -0,0 +1,94 @@
+import random
+import pytest
+
+from nrfcredstore.parser import (CmngRecord, iter_cmng, last_cmng, last_line, parse_attesttoken,
+    parse_cme_error, parse_cmng, parse_imei, parse_keygen)
+
+# Captured from an nRF9151 DK as returned by Comms.expect_response
+CMNG_TRANSCRIPT = (
+    '%CMNG: 16842753,0,"2C43952EE9E000FF2ACC4E2ED0897C0A72AD5FA72C3D934E81741CBD54F05BD1"\r\n'
+    '%CMNG: 16842753,1,"DDFF4E6D13F0B7F1F1A64F12C92BEB1E8D01E5B6FA8DDF9ABF5F0F0E5A3AE4E8"\r\n'
+    '%CMNG: 4294967292,19,"672E2F05962B4EFBFA8801255D87E0E0418F2DDF4DDAEFC59E9B4162F512CB63"\r\n'
+    '%CMNG: 4294967293,20,"2C43952EE9E000FF2ACC4E2ED0897C0A72AD5FA72C3D934E81741CBD54F05BD1"\r\n'
+)
+KEYGEN_TRANSCRIPT = '%KEYGEN: "MIIBCjCBrwIBADA_MT0wOwYDVQQDDDQ1MDM2MzA0MC0zMTM5.0oRDoQEmoQRBIVhL2dn3hQlQ"\r\n'
+ATTESTTOKEN_TRANSCRIPT = '%ATTESTTOKEN: "2dn3hQFQUDYxQDkxODYRDYzMzMDQbGm92aXNpb25pbmc.0oRDoQEmoQRBIfZYQGuX"\r\n'
+CGSN_TRANSCRIPT = '352656100367872\r\n'
+
+def test_parse_cmng():
+    records = parse_cmng(CMNG_TRANSCRIPT)
+    assert len(records) == 4
+    assert records[0] == CmngRecord(16842753, 0, '2C43952EE9E000FF2ACC4E2ED0897C0A72AD5FA72C3D934E81741CBD54F05BD1')
+    assert records[3].tag == 4294967293
+    assert records[3].type == 20
+
+def test_parse_cmng_spaces_and_missing_sha():
+    assert parse_cmng('%CMNG: 12345678, 0, "978C...02C4"') == [CmngRecord(12345678, 0, '978C...02C4')]
+    assert parse_cmng('%CMNG: 42,1\r\n') == [CmngRecord(42, 1, '')]
+
+def test_last_cmng():
+    assert last_cmng(CMNG_TRANSCRIPT).type == 20
+    assert last_cmng('') is None
+
+def test_iter_cmng_is_lazy():
+    records = iter_cmng(CMNG_TRANSCRIPT)
+    assert next(records).type == 0
+
+def test_parse_keygen():
+    csr = parse_keygen(KEYGEN_TRANSCRIPT)
+    assert csr.body.startswith('MIIBCjCB')
+    assert csr.cose == '0oRDoQEmoQRBIVhL2dn3hQlQ'
+    assert csr.blob == KEYGEN_TRANSCRIPT.split('"')[1]
+
+def test_parse_keygen_without_cose():
+    csr = parse_keygen('%KEYGEN: "foo"')
+    assert csr.cose == ''
+    assert csr.blob == 'foo'
+
+def test_parse_attesttoken():
+    token = parse_attesttoken(ATTESTTOKEN_TRANSCRIPT)
+    assert token.blob == ATTESTTOKEN_TRANSCRIPT.split('"')[1]
+    assert parse_attesttoken(KEYGEN_TRANSCRIPT) is None
+
+@pytest.mark.parametrize('output', [
+    CGSN_TRANSCRIPT,
+    '+CGSN: "352656100367872"\r\n',
+    'uart:~$ at AT+CGSN\r\n352656100367872\r\n',
+])
+def test_parse_imei(output):
+    assert parse_imei(output) == '352656100367872'
+
+def test_parse_imei_rejects_longer_numbers():
+    assert parse_imei('3526561003678721') is None
+
+def test_parse_cme_error():
+    assert parse_cme_error('+CME ERROR: 514').code == 514
+    assert parse_cme_error('ERROR') is None
+
+@pytest.mark.parametrize('output, line', [
+    ('nRF9151-LACA\r\n', 'nRF9151-LACA'),
+    ('uart:~$ at AT+CGMR\r\n\r\nmfw_nrf91x1_2.0.2\r\n\r\n', 'mfw_nrf91x1_2.0.2'),
+    ('\r\n \n', ''),
+    ('', ''),
+])
+def test_last_line(output, line):
+    assert last_line(output) == line
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fuzz_transcripts(seed):
+    """Truncated, interleaved and corrupted transcripts never raise"""
+    rng = random.Random(seed)
+    transcript = CMNG_TRANSCRIPT + KEYGEN_TRANSCRIPT + ATTESTTOKEN_TRANSCRIPT + CGSN_TRANSCRIPT
+    for _ in range(50):
+        chars = list(transcript[:rng.randrange(len(transcript) + 1)])
+        for _ in range(rng.randrange(5)):
+            if chars:
+                chars[rng.randrange(len(chars))] = rng.choice('",.\r\n0123456789%:+ xZ')
+        output = ''.join(chars)
+        for record in parse_cmng(output):
+            assert isinstance(record.tag, int) and '"' not in record.sha
+        for blob in (parse_keygen(output), parse_attesttoken(output)):
+            assert blob is None or '"' not in blob.blob
+        imei = parse_imei(output)
+        assert imei is None or len(imei) == 15
+        assert '\n' not in last_line(output)
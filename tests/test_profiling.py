@@ -0,0 +1,32 @@
+import pstats
+import pytest
+
+from nrfcredstore.profiling import PhaseTimer, profile_run
+
+def test_phases_accumulate():
+    t = PhaseTimer()
+    with t.phase('open'):
+        pass
+    with t.phase('operation'):
+        pass
+    with t.phase('open'):
+        pass
+    assert list(t.phases) == ['open', 'operation']
+    assert 'total' in t.report()
+
+def test_phase_timed_on_error():
+    t = PhaseTimer()
+    with pytest.raises(RuntimeError):
+        with t.phase('detect'):
+            raise RuntimeError()
+    assert 'detect' in t.phases
+
+def test_profile_run_writes_stats_on_error(tmp_path):
+    path = str(tmp_path / 'run.prof')
+    def fail():
+        raise TimeoutError()
+    with pytest.raises(TimeoutError):
+        profile_run(fail, path)
+    assert pstats.Stats(path)
+    with open(path + '.txt') as f:
+        assert 'cumulative' in f.read()
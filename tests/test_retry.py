@@ -0,0 +1,68 @@
+import pytest
+
+from unittest.mock import MagicMock, Mock
+from nrfcredstore.retry import (
+    RETRY_KEYGEN, RETRY_WRITE, RetryPolicy, retry_policies, run_with_retry
+)
+
+def failing_comms(code=None, timed_out=False):
+    comms = MagicMock()
+    comms.last_error_code = code
+    comms.last_timed_out = timed_out
+    return comms
+
+def test_delay_has_jitter_and_cap():
+    policy = RetryPolicy(5, base_delay=0.5, max_delay=1.0)
+    assert policy.delay(0, rand=lambda: 1.0) == 0.5
+    assert policy.delay(3, rand=lambda: 1.0) == 1.0
+    assert policy.delay(3, rand=lambda: 0.25) == 0.25
+
+def test_classification():
+    policy = RetryPolicy(3)
+    assert policy.is_transient(518, False)
+    assert not policy.is_transient(515, False)
+    assert policy.is_transient(None, True)
+    assert not policy.is_transient(None, False)
+    assert not policy._replace(retry_on_timeout=False).is_transient(None, True)
+
+def test_transient_error_retried():
+    comms = failing_comms(518)
+    attempt = Mock(side_effect=[False, False, True])
+    assert run_with_retry(RetryPolicy(3), comms, attempt)
+    assert attempt.call_count == 3
+    assert comms.wait.call_count == 2
+
+def test_attempts_run_out():
+    attempt = Mock(return_value=False)
+    assert not run_with_retry(RetryPolicy(3), failing_comms(518), attempt)
+    assert attempt.call_count == 3
+
+def test_permanent_error_not_retried():
+    attempt = Mock(return_value=False)
+    assert not run_with_retry(RetryPolicy(3), failing_comms(515), attempt)
+    attempt.assert_called_once()
+
+def test_confirm_after_timeout():
+    attempt = Mock(return_value=False)
+    confirm = Mock(return_value=True)
+    assert run_with_retry(RetryPolicy(3), failing_comms(timed_out=True), attempt, confirm)
+    attempt.assert_called_once()
+
+def test_confirm_not_used_for_modem_error():
+    confirm = Mock(return_value=True)
+    run_with_retry(RetryPolicy(2), failing_comms(518), Mock(return_value=False), confirm)
+    confirm.assert_not_called()
+
+def test_failure_read_within_attempt_transaction():
+    comms = failing_comms(515)
+    def attempt():
+        # Another thread's command would run here without the transaction
+        comms.transaction.return_value.__exit__.side_effect = lambda *args: setattr(comms, 'last_error_code', 518)
+        return False
+    assert not run_with_retry(RetryPolicy(3), comms, attempt)
+    comms.wait.assert_not_called()
+
+def test_policies():
+    policies = retry_policies(2)
+    assert policies[RETRY_WRITE].attempts == 3
+    assert not policies[RETRY_KEYGEN].retry_on_timeout
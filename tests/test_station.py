@@ -0,0 +1,130 @@
+import threading
+import pytest
+
+from unittest.mock import Mock
+from nrfcredstore.station import Station, acm_devices
+
+class FakeRunner:
+    """Runner that finishes a job on the poll after it was started"""
+    def __init__(self):
+        self.running = {}
+        self.started = []
+
+    def start(self, dev, name=None):
+        self.running[dev] = name
+        self.started.append((dev, name))
+
+    def poll(self):
+        done = [{'device': dev, 'ok': True, 'error': None} for dev in self.running]
+        self.running = {}
+        return done
+
+def board(serial, device):
+    return ('nRF9151-DK', serial, Mock(device=device))
+
+@pytest.fixture
+def hub():
+    """Boards and ACM devices currently plugged in"""
+    return {'boards': [], 'acm': frozenset()}
+
+@pytest.fixture
+def station(hub):
+    list_boards = Mock(side_effect=lambda: hub['boards'])
+    return Station(FakeRunner(), settle_time=0, list_boards=list_boards, list_acm=lambda: hub['acm'])
+
+def plug(hub, serial, device):
+    hub['boards'] = hub['boards'] + [board(serial, device)]
+    hub['acm'] = hub['acm'] | {device.rsplit('/', 1)[-1]}
+
+def unplug(hub, serial):
+    hub['boards'] = [b for b in hub['boards'] if b[1] != serial]
+    hub['acm'] = frozenset(b[2].device.rsplit('/', 1)[-1] for b in hub['boards'])
+
+def test_new_board_is_started(station, hub):
+    station.poll()
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    station.poll()
+    assert station.runner.started == [('/dev/ttyACM0', '1051202135')]
+
+def test_board_is_processed_once(station, hub):
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    for _ in range(3):
+        station.poll()
+    assert len(station.runner.started) == 1
+    assert [r['ok'] for r in station.results] == [True]
+
+def test_replugged_board_is_processed_again(station, hub):
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    station.poll()
+    unplug(hub, 1051202135)
+    station.poll()
+    plug(hub, 1051202135, '/dev/ttyACM2')
+    station.poll()
+    assert [dev for dev, _ in station.runner.started] == ['/dev/ttyACM0', '/dev/ttyACM2']
+
+def test_replugged_board_waits_for_running_job(station, hub):
+    station.runner.poll = Mock(return_value=[])
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    station.poll()
+    unplug(hub, 1051202135)
+    station.poll()
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    station.poll()
+    # The first job still runs, it is not replaced
+    assert station.runner.started == [('/dev/ttyACM0', '1051202135')]
+    station.runner.running = {}
+    station.poll()
+    assert station.runner.started == [('/dev/ttyACM0', '1051202135')] * 2
+
+def test_boards_enumerated_only_on_acm_change(station, hub):
+    plug(hub, 1051202135, '/dev/ttyACM0')
+    for _ in range(5):
+        station.poll()
+    assert station.list_boards.call_count == 1
+
+def test_enumerate_every_poll_without_sysfs(hub):
+    station = Station(FakeRunner(), settle_time=0, list_boards=Mock(return_value=[]), list_acm=lambda: None)
+    for _ in range(3):
+        station.poll()
+    assert station.list_boards.call_count == 3
+
+def test_jobs_limit(station, hub):
+    station.jobs = 1
+    plug(hub, 1, '/dev/ttyACM0')
+    plug(hub, 2, '/dev/ttyACM2')
+    station.poll()
+    assert len(station.runner.started) == 1
+    station.poll()
+    assert len(station.runner.started) == 2
+
+def test_settle_time(hub):
+    station = Station(FakeRunner(), settle_time=60, list_boards=lambda: hub['boards'], list_acm=lambda: hub['acm'])
+    plug(hub, 1, '/dev/ttyACM0')
+    station.poll()
+    assert station.runner.started == []
+
+def test_board_unplugged_while_settling(hub):
+    station = Station(FakeRunner(), settle_time=60, list_boards=lambda: hub['boards'], list_acm=lambda: hub['acm'])
+    plug(hub, 1, '/dev/ttyACM0')
+    station.poll()
+    unplug(hub, 1)
+    station.settle_time = 0
+    station.poll()
+    assert station.runner.started == []
+
+def test_run_until_stopped(station, hub):
+    plug(hub, 1, '/dev/ttyACM0')
+    stop = threading.Event()
+    results = []
+    def on_result(result):
+        results.append(result)
+        stop.set()
+    report = station.run(stop, poll_interval=0.01, on_result=on_result)
+    assert report.summary()['succeeded'] == 1
+    assert results[0]['device'] == '/dev/ttyACM0'
+
+def test_acm_devices(tmp_path):
+    for name in ['ttyACM0', 'ttyACM1', 'ttyS0']:
+        (tmp_path / name).mkdir()
+    assert acm_devices(str(tmp_path)) == {'ttyACM0', 'ttyACM1'}
+    assert acm_devices(str(tmp_path / 'missing')) is None
@@ -0,0 +1,28 @@
+from nrfcredstore.trace import TraceBuffer, TRACE_EVENT, TRACE_RX, TRACE_TX
+
+def test_ring_buffer_keeps_last_entries():
+    trace = TraceBuffer(size=3)
+    for n in range(5):
+        trace.record(TRACE_RX, f'line {n}'.encode())
+    lines = list(trace.lines())
+    assert len(trace) == 3
+    assert lines[0].endswith('< line 2')
+    assert lines[-1].endswith('< line 4')
+
+def test_formats_parts_and_invalid_bytes():
+    trace = TraceBuffer()
+    trace.record(TRACE_TX, (b'AT%CMNG=0,1,0,"', b'-----BEGIN', b'"\r\n'))
+    trace.record(TRACE_RX, b'\xff\r\n')
+    trace.record(TRACE_EVENT, 'Timeout after 3 s')
+    lines = list(trace.lines())
+    assert lines[0].endswith('> AT%CMNG=0,1,0,"-----BEGIN"')
+    assert lines[1].endswith('< \\xff')
+    assert lines[2].endswith('! Timeout after 3 s')
+
+def test_dump(tmp_path):
+    trace = TraceBuffer()
+    trace.record(TRACE_TX, b'AT\r\n')
+    path = tmp_path / 'trace.txt'
+    trace.dump(str(path), 'Failed')
+    assert path.read_text().splitlines()[0] == '# Failed'
+    assert len(path.read_text().splitlines()) == 2